@@ -1,9 +1,13 @@
 # -*- coding:utf-8 -*-
 # Installed packages (via pip)
+from django.conf.urls import url
 from django.contrib import admin
+from django.http import FileResponse, Http404
+from django.template.response import TemplateResponse
 
 # Internal project dependencies
 from .models import MainCourseClassification, CourseClassification, MainCourseClassificationTemplate, CourseCategory
+from .profiling import get_profile_directory, get_profile_path, list_profiles
 
 class MainCourseClassificationAdmin(admin.ModelAdmin):
     list_display = ('name', 'sequence', 'is_active',)
@@ -21,6 +25,36 @@ class CourseClassificationAdmin(admin.ModelAdmin):
     def categories(self, obj):
         return ", ".join([p.name for p in obj.course_category.all()])
 
+    def get_urls(self):
+        urls = [
+            url(r'^profiles/$', self.admin_site.admin_view(self.profiles_view), name='course_classification_profiles'),
+            url(
+                r'^profiles/(?P<name>[\w.]+)/$',
+                self.admin_site.admin_view(self.profile_download_view),
+                name='course_classification_profile_download'
+            ),
+        ]
+        return urls + super(CourseClassificationAdmin, self).get_urls()
+
+    def profiles_view(self, request):
+        """
+            List the profiles of the slow discovery requests, see profiling.py
+        """
+        context = dict(
+            self.admin_site.each_context(request),
+            opts=self.model._meta,
+            title='Discovery profiles',
+            profiles=list_profiles(),
+            profile_directory=get_profile_directory(),
+        )
+        return TemplateResponse(request, 'admin/course_classification/profiles.html', context)
+
+    def profile_download_view(self, request, name):
+        path = get_profile_path(name)
+        if path is None:
+            raise Http404
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=name, content_type='application/zip')
+
 class MainCourseClassificationTemplateAdmin(admin.ModelAdmin):
     raw_id_fields = ('main_classification',)
     list_display = ('main_classification', 'language', )
@@ -1,25 +1,39 @@
 """ search business logic implementations """
 # Python Standard Libraries
 import datetime
+import hashlib
+import json
 import logging
 
 # Installed packages (via pip)
 from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import get_language
 from search.api import *
+from search.utils import DateRange
 
 # Edx dependencies
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.keys import CourseKey
 from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
 
 # Internal project dependencies
-from course_classification.helpers import get_courses_by_classification, set_data_courses, get_courses_by_category
+from course_classification.helpers import get_classified_courses, get_courses_extra_data_by_id, get_date_facets, get_discovery_facets, parse_filter_ids, set_data_courses, decode_discovery_cursor, encode_discovery_cursor, get_next_discovery_cursor, get_catalog_taxonomy, get_featured_courses, get_course_cards, set_courses_state
+from . import metrics
+from .fallback import search_with_fallback
+from .invalidation import get_versions
 from .models import CourseClassification
+from .popularity import sort_by_popularity
+from .routers import get_read_database
+from .results import get_extra_data_fields, get_source_fields, project_result
 
 
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
-def course_discovery_search_eol(search_term=None, size=20, from_=0, order_by="", year="", state="", classification="", category="", featured=""):
+def search_discovery_engine(search_term=None, size=20, from_=0, order_by="", year="", state="", classification="", category="", featured="", cursor=None, fields=None, facets=False, classification_match="any", category_match="any"):
     """
-    Course Discovery activities against the search engine index of course details
+    Search the courses of a discovery search in the search engine, the results are the search engine hits
+    without the enrichment of course_discovery_search_eol(). It has the same parameters
     """
     # We'll ignore the course-enrollment information in field and filter
     # dictionary, and use our own logic upon enrollment dates for these
@@ -62,55 +76,175 @@ def course_discovery_search_eol(search_term=None, size=20, from_=0, order_by="",
             else:
                 query &= Q(start__gt = datetime.utcnow())
     results = {}
-    # Check if classification exist
-    if classification != "":
-        try:
-            courses = get_courses_by_classification(int(classification))
-            query &= Q(id__in=courses)
-        except Exception as e:
-            error = f'Course Discovery - Error in course_classification get_courses_by_classification function, error: {format(str(e))}'
-            log.error(error)
-            results['error'] = error
-            return results
-    # Check if category exist
-    if category != "":
-        try:
-            courses = get_courses_by_category(int(category))
+    # Check if classification or category exist
+    try:
+        classification_ids = parse_filter_ids(classification)
+        category_ids = parse_filter_ids(category)
+        if classification_ids or category_ids:
+            courses = get_classified_courses(classification_ids, category_ids, classification_match, category_match)
             query &= Q(id__in=courses)
-        except Exception as e:
-            error = f'Course Discovery - Error in course_classification get_courses_by_category function, error: {format(str(e))}'
-            log.error(error)
-            results['error'] = error
-            return results
+    except Exception as e:
+        error = f'Course Discovery - Error in course_classification get_classified_courses function, error: {format(str(e))}'
+        log.error(error)
+        results['error'] = error
+        return results
     # Check if featured is use
     if featured:
         try:
-            if CourseClassification.objects.filter(is_featured_course=True).exists():
-                courses = CourseClassification.objects.filter(is_featured_course=True).values('course_id')
-                course_ids = [x['course_id'] for x in courses]
+            course_ids = list(CourseClassification.objects.filter(is_featured_course=True).values_list('course_id', flat=True))
+            if course_ids:
                 query &= Q(id__in=course_ids)
         except Exception as e:
             log.error("Course Discovery - Error in course_classification get_courses_by_classification function, error: {}".format(str(e)))
     # Check if query is not empty
     if query:
-        ids = list(CourseOverview.objects.exclude(query).values("id"))
+        ids = list(CourseOverview.objects.using(get_read_database()).exclude(query).values("id"))
         ids = [str(x['id']) for x in ids]
         exclude_dictionary["_id"] = ids
 
+    # Check if cursor pagination is use
+    cursor_order = None
+    popular = order_by == "popular"
+    if cursor is not None:
+        cursor_order = "popular" if popular else "start:desc" if order_by == "newer" else "start"
+        cursor_data = decode_discovery_cursor(cursor) if cursor else {}
+        if cursor_data and cursor_data.get('order') != cursor_order:
+            raise ValueError('Invalid cursor value for order_by {}'.format(order_by))
+        if popular:
+            # The popular order is paginated by position, the cursor keeps the position of the next page
+            from_ = cursor_data.get('offset', 0)
+            if not isinstance(from_, int) or from_ < 0:
+                raise ValueError('Invalid cursor value')
+        else:
+            # Stable sort, the course id breaks ties between courses with the same start date
+            sort = "{},id".format(cursor_order)
+            from_ = 0
+        if cursor_data.get('start', None) and not popular:
+            cursor_start = datetime.fromisoformat(cursor_data['start'])
+            if order_by == "newer":
+                use_field_dictionary["start"] = DateRange(None, cursor_start)
+            else:
+                use_field_dictionary["start"] = DateRange(cursor_start, None)
+            # Courses with the cursor start date already returned in previous pages, first in the range
+            from_ = cursor_data.get('skip', 0)
+
+    # Check if facets or the popular order are use, the ids of the matching courses are a facet of the search and
+    # the start and end dates are facets for the year and state counts (the facets are not computed with the next
+    # pages of a cursor)
+    facet_terms = course_discovery_facets()
+    facets = facets and not (cursor_order is not None and cursor_data)
+    max_facet_courses = getattr(settings, "COURSE_CLASSIFICATION_FACET_MAX_COURSES", 1000)
+    if facets:
+        facet_terms = dict(facet_terms, id={'size': max_facet_courses}, start={'size': max_facet_courses}, end={'size': max_facet_courses})
+    if popular:
+        facet_terms = dict(facet_terms, id={'size': getattr(settings, "COURSE_CLASSIFICATION_POPULAR_MAX_COURSES", 10000)})
+
+    # Check if fields projection is use, the search engine returns only the needed fields
+    search_kwargs = {}
+    if fields is not None:
+        source_filter_param = getattr(settings, "COURSE_CLASSIFICATION_SOURCE_FILTER_PARAM", "_source_include")
+        search_kwargs[source_filter_param] = get_source_fields(fields)
+
     # get results using exclude terms
-    results = searcher.search(
-        query_string=search_term,
+    with metrics.stage_timer(metrics.get_endpoint('discovery'), 'engine'):
+        results = search_with_fallback(
+            searcher,
+            query_string=search_term,
+            doc_type="course_info",
+            size=0 if popular else size,
+            from_=0 if popular else from_,
+            field_dictionary=use_field_dictionary,
+            filter_dictionary=filter_dictionary,
+            exclude_dictionary=exclude_dictionary,
+            facet_terms=facet_terms,
+            sort=sort,
+            **search_kwargs
+        )
+        if facets or popular:
+            id_facet = results.setdefault('facets', {}).pop('id', None) or {}
+        if facets:
+            date_facets = [results['facets'].pop(x, None) for x in ('start', 'end')]
+        if popular:
+            results['results'] = search_popular_page(searcher, list(id_facet.get('terms', {})), size, from_, search_kwargs)
+    if facets:
+        try:
+            with metrics.stage_timer(metrics.get_endpoint('discovery'), 'facets'):
+                results['facets'].update(get_discovery_facets(list(id_facet.get('terms', {}))))
+                results['facets'].update(get_date_facets(*date_facets))
+        except Exception as e:
+            log.error("Course Discovery - Error in course_classification get_discovery_facets function, error: {}".format(str(e)))
+    if cursor_order == "popular":
+        results['next_cursor'] = encode_discovery_cursor({'order': cursor_order, 'offset': from_ + size}) if from_ + size < results['total'] else None
+    elif cursor_order is not None:
+        results['next_cursor'] = get_next_discovery_cursor(results['results'], size, cursor_order, cursor_data)
+    return results
+
+def search_popular_page(searcher, course_ids, size, from_, search_kwargs):
+    """
+    Return the search engine hits of a page of the courses sorted by the precomputed popularity ranks (see popularity.py),
+    course_ids are the ids of all the matching courses. The courses of the page are requested by id in one search
+    """
+    page_ids = sort_by_popularity(course_ids)[from_:from_ + size]
+    if not page_ids:
+        return []
+    page = search_with_fallback(
+        searcher,
         doc_type="course_info",
+        size=len(page_ids),
+        from_=0,
+        filter_dictionary={"id": page_ids},
+        **search_kwargs
+    )
+    hits = {hit['data']['id']: hit for hit in page['results']}
+    return [hits[x] for x in page_ids if x in hits]
+
+def course_discovery_search_eol(search_term=None, size=20, from_=0, order_by="", year="", state="", classification="", category="", featured="", cursor=None, fields=None, facets=False, classification_match="any", category_match="any"):
+    """
+    Course Discovery activities against the search engine index of course details
+
+    classification and category are ids, ids separated by commas or lists of ids. With classification_match or
+    category_match "any" the courses match one of the ids, with "all" all of them. Both filters are resolved in
+    one query, so the total and the pagination are the ones of the combined filter.
+
+    If facets is True the results include the counts of the matching courses by classification, category, year
+    and state. The search engine returns terms facets of the same search: the counts of the start and end dates of
+    the matching courses, summed by year and state (see helpers.get_date_facets), and the ids of the matching courses
+    (up to COURSE_CLASSIFICATION_FACET_MAX_COURSES), counted by classification and category (see helpers.get_discovery_facets).
+
+    With order_by "popular" the courses are sorted by the precomputed popularity ranks (see popularity.py): the
+    search engine returns the ids of the matching courses as a terms facet (up to COURSE_CLASSIFICATION_POPULAR_MAX_COURSES)
+    and the courses of the page, sorted by rank, are requested by id.
+
+    If fields is a tuple of fields (see results.get_discovery_fields) the search engine returns only the fields
+    needed by them, extra_data is computed only for them and each result is a dictionary with only those fields.
+
+    If cursor is not None the results are paginated by cursor instead of from_: the courses are sorted by
+    start date and course id, an empty cursor returns the first page and the response includes "next_cursor"
+    to request the next one (None when there are no more results).
+    """
+    results = search_discovery_engine(
+        search_term=search_term,
         size=size,
         from_=from_,
-        field_dictionary=use_field_dictionary,
-        filter_dictionary=filter_dictionary,
-        exclude_dictionary=exclude_dictionary,
-        facet_terms=course_discovery_facets(),
-        sort=sort
+        order_by=order_by,
+        year=year,
+        state=state,
+        classification=classification,
+        category=category,
+        featured=featured,
+        cursor=cursor,
+        fields=fields,
+        facets=facets,
+        classification_match=classification_match,
+        category_match=category_match
     )
+    if 'error' in results:
+        return results
     try:
-        results['results'] = set_data_courses(results['results'])
+        with metrics.stage_timer(metrics.get_endpoint('discovery'), 'enrichment'):
+            results['results'] = set_data_courses(results['results'], get_extra_data_fields(fields))
+            if fields is not None:
+                results['results'] = [project_result(x, fields) for x in results['results']]
     except Exception as e:
         error = f'Course Discovery - Error in course_classification set_data_courses function, error: {format(str(e))}'
         log.error(error)
@@ -118,3 +252,112 @@ def course_discovery_search_eol(search_term=None, size=20, from_=0, order_by="",
         results['results'] = []
         return results
     return results
+
+def course_discovery_multi_search_eol(queries):
+    """
+    Return the results of several discovery searches, in the order of the queries. Each query has the parameters
+    of course_discovery_search_eol(), e.g. [{'featured': True, 'size': 8}, {'state': 'active'}]. The extra_data of
+    the courses of all the searches is computed in one batch. The errors of a search are returned in its results.
+    """
+    responses = []
+    for query in queries:
+        try:
+            responses.append(search_discovery_engine(**query))
+        except Exception as e:
+            error = f'Course Discovery - Error in course_classification search_discovery_engine function, error: {format(str(e))}'
+            log.error(error)
+            responses.append({'error': error})
+    searched = [(query, results) for query, results in zip(queries, responses) if 'error' not in results]
+    if not searched:
+        return responses
+    extra_data_fields = set()
+    for query, _ in searched:
+        query_fields = get_extra_data_fields(query.get('fields'))
+        if query_fields is None:
+            extra_data_fields = None
+            break
+        extra_data_fields.update(query_fields)
+    try:
+        with metrics.stage_timer(metrics.get_endpoint('multi_search'), 'enrichment'):
+            course_ids = {CourseKey.from_string(hit['_id']) for _, results in searched for hit in results['results']}
+            extra_data = get_courses_extra_data_by_id(list(course_ids), extra_data_fields)
+            for query, results in searched:
+                results['results'] = set_data_courses(results['results'], extra_data=extra_data)
+                if query.get('fields') is not None:
+                    results['results'] = [project_result(x, query['fields']) for x in results['results']]
+    except Exception as e:
+        error = f'Course Discovery - Error in course_classification set_data_courses function, error: {format(str(e))}'
+        log.error(error)
+        for _, results in searched:
+            results['error'] = error
+            results['results'] = []
+    return responses
+
+def get_homepage_discovery_data():
+    """
+    Return all the discovery data of the homepage in one pass: the taxonomy (logos, main classifications and
+    course categories) with one query each, the precomputed featured courses and the courses of the first search page
+    grouped by course state, with one search engine query and one enrichment batch. The version is the one of
+    get_homepage_version(), read before the data.
+        {
+            "logos": [[logo_url, institution_url], ...],
+            "main_classifications": [[id, name], ...],
+            "course_categories": [[id, name], ...],
+            "featured_courses": [{course}, ...],
+            "courses_by_state": {"ongoing_enrollable": [{course}, ...], ...},
+            "version": "d41d8cd98f00b204e9800998ecf8427e"
+        }
+    """
+    version = get_homepage_version()
+    data = get_catalog_taxonomy()
+    data['featured_courses'] = get_featured_courses()
+    courses_by_state = {}
+    results = course_discovery_search_eol(size=20)
+    for course in results.get('results', []):
+        courses_by_state.setdefault(course['course_state'], []).append(course)
+    data['courses_by_state'] = courses_by_state
+    data['version'] = version
+    return data
+
+def get_homepage_version():
+    """
+    Return the version of the homepage data without building it: a hash of the catalog and taxonomy versions
+    (see invalidation.py), the language and the hour, the course states and the time left change with the time
+    """
+    key = json.dumps([get_versions('catalog', 'taxonomy'), get_language(), timezone.now().strftime('%Y-%m-%dT%H')])
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+def get_courses_data(course_ids):
+    """
+    Return the course cards of a list of course ids, with the same data of the discovery results
+    (main classification, logo, price, time_left and course_state) in the order of the list.
+    Invalid or not found course ids are returned in errors instead of raising an exception, the courses not
+    visible in the catalog are not found, like in the discovery search.
+        {
+            "results": [{course}, ...],
+            "errors": {"course-v1:eol+Test+2023": "Course not found", "invalid": "Invalid course key"}
+        }
+    """
+    max_courses = getattr(settings, "COURSE_CLASSIFICATION_BATCH_MAX_COURSES", 100)
+    course_ids = list(dict.fromkeys(course_ids))
+    if len(course_ids) > max_courses:
+        raise ValueError('Too many course ids, the maximum is {}'.format(max_courses))
+    errors = {}
+    course_keys = []
+    for course_id in course_ids:
+        try:
+            course_keys.append(CourseKey.from_string(course_id))
+        except InvalidKeyError:
+            errors[course_id] = 'Invalid course key'
+    course_overviews = list(CourseOverview.objects.using(get_read_database()).filter(id__in=course_keys, catalog_visibility="both"))
+    found_ids = {str(x.id) for x in course_overviews}
+    for course_key in course_keys:
+        if str(course_key) not in found_ids:
+            errors[str(course_key)] = 'Course not found'
+    courses = set_courses_state(get_course_cards(course_overviews), timezone.now())
+    positions = {course_id: position for position, course_id in enumerate(course_ids)}
+    courses.sort(key=lambda course: positions.get(course['id'], len(positions)))
+    return {
+        'results': courses,
+        'errors': errors
+    }
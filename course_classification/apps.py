@@ -26,3 +26,6 @@ class CourseClassificationConfig(AppConfig):
                     PluginSettings.RELATIVE_PATH: "settings.common"}},
         },
     }
+
+    def ready(self):
+        from . import signals  # pylint: disable=unused-import
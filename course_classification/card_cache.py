@@ -0,0 +1,51 @@
+# -*- coding:utf-8 -*-
+"""
+Cache of the rendered course cards of the institution pages.
+
+Each card (course.html) is rendered once by course, language and version of its data, the version is a hash
+of the course of the discovery results, so a change of the course, its classification or its state renders it again.
+"""
+# Python Standard Libraries
+import hashlib
+
+# Installed packages (via pip)
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import get_language
+
+# Edx dependencies
+from common.djangoapps.edxmako.shortcuts import render_to_string
+
+# Internal project dependencies
+from . import metrics
+from .results import dumps_discovery_json
+
+CARD_CACHE_PREFIX = 'course_classification.card'
+
+
+def get_card_cache_key(course, language):
+    """
+    Return the cache key of the rendered card of a course of the discovery results
+    """
+    version = hashlib.md5(dumps_discovery_json(course, sort_keys=True)).hexdigest()
+    return '{}.{}.{}.{}'.format(CARD_CACHE_PREFIX, course['id'], language, version)
+
+
+def get_course_card_fragments(courses):
+    """
+    Return the rendered card of each course, from the cache or rendered and cached with one cache call for all
+    """
+    timeout = getattr(settings, "COURSE_CLASSIFICATION_CARD_CACHE_TIMEOUT", 3600)
+    language = get_language() or settings.LANGUAGE_CODE
+    keys = [get_card_cache_key(course, language) for course in courses]
+    fragments = cache.get_many(keys) if timeout else {}
+    rendered = {}
+    cards = []
+    for key, course in zip(keys, courses):
+        if key not in fragments:
+            fragments[key] = rendered[key] = render_to_string('course.html', {'course': course})
+        cards.append(fragments[key])
+    if rendered and timeout:
+        cache.set_many(rendered, timeout)
+    metrics.cache_result('card', len(cards) - len(rendered), len(rendered))
+    return cards
@@ -0,0 +1,252 @@
+# -*- coding:utf-8 -*-
+"""
+Course state classification of many courses at once.
+
+The date columns of the courses are parsed once and the course state, time_left and sort keys
+are computed with NumPy masks. If NumPy is not installed the same rules are applied course by course.
+"""
+# Python Standard Libraries
+from datetime import datetime, timedelta, timezone as dt_timezone
+import math
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+# Courses are sorted by state in this order, 'other' courses are sorted with the completed ones
+COURSE_STATES_ORDER = (
+    'ongoing_enrollable',
+    'upcoming_enrollable',
+    'upcoming_notenrollable',
+    'ongoing_notenrollable',
+    'completed',
+)
+STATE_NAMES = COURSE_STATES_ORDER + ('other',)
+TIME_LEFT_UNITS = ('d', 'm', 'y')
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+# int64 value of NaT
+NAT_VALUE = -2 ** 63
+
+
+def parse_course_date(value):
+    """
+    Return an aware datetime from an ISO string or datetime of the search engine documents, naive values are UTC
+    """
+    if not value:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=dt_timezone.utc)
+    return value
+
+
+def get_time_left(course_start, today):
+    """
+    Return how much time is left until the course start as [value, unit], unit can be 'y', 'm' or 'd'
+    """
+    days_left = (course_start - today).days
+    year = math.trunc(days_left / 365)
+    month = math.trunc(days_left / 30)
+    if year > 0:
+        return [year, 'y']
+    if 0 < month <= 12:
+        return [month, 'm']
+    return [days_left, 'd']
+
+
+def get_course_state(course_start, course_end, enroll_start, enroll_end, is_invitation_only, today):
+    """
+    Return the state of one course by its dates and enrollment
+    """
+    if course_start is None:
+        return 'other'
+    enroll_start = enroll_start or course_start
+    enroll_end = enroll_end or course_end or today.replace(year=today.year + 100)
+    course_open = course_end is None or course_end > today
+    # If the course enrollment is by invitation
+    if is_invitation_only:
+        if course_start > today:
+            return 'upcoming_notenrollable'
+        if course_open:
+            return 'ongoing_notenrollable'
+        return 'completed'
+    # If today is between enrollment range and the course already started
+    if enroll_start <= today and enroll_end > today and course_start <= today and course_open:
+        return 'ongoing_enrollable'
+    # If you are not within the registration deadline today and the course has already begun
+    if enroll_start < today and enroll_end < today and course_start <= today and course_open:
+        return 'ongoing_notenrollable'
+    # If you are not within the registration deadline today and the course has not yet started
+    if enroll_start < today and enroll_end < today and course_start > today and course_open:
+        return 'upcoming_notenrollable'
+    # If you are within the enrollment range today and the course has not yet started
+    if enroll_start <= today and enroll_end > today and course_start > today:
+        return 'upcoming_enrollable'
+    # If you are not within the enrollment range today and the course has not yet started
+    if enroll_start > today and enroll_end > today and course_start > today:
+        return 'upcoming_notenrollable'
+    # If today is after the end date of the course
+    if course_end is not None and course_end <= today:
+        return 'completed'
+    return 'other'
+
+
+def _sort_key(date, today):
+    """
+    Absolute number of days between a date and today or infinite if there is no date
+    """
+    if date is None:
+        return float('inf')
+    return abs((date - today).days)
+
+
+def _parse_date(value):
+    """
+    parse_course_date without errors, invalid dates are considered missing
+    """
+    try:
+        return parse_course_date(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_course_columns(courses):
+    """
+    Return the date columns (not parsed yet) and the invitation column of the courses,
+    which can be dictionaries of the search engine documents or catalog rows
+    """
+    columns = {'start': [], 'end': [], 'enrollment_start': [], 'enrollment_end': [], 'invitation_only': []}
+    for course in courses:
+        for key in ('start', 'end', 'enrollment_start', 'enrollment_end'):
+            columns[key].append(course.get(key, None))
+        extra_data = course.get('extra_data', None) or {}
+        columns['invitation_only'].append(bool(extra_data.get('invitation_only', course.get('invitation_only', False))))
+    return columns
+
+
+def _classify_columns_python(columns, today):
+    """
+    Course by course implementation of classify_courses
+    """
+    states = []
+    time_lefts = []
+    sort_keys = []
+    for start, end, enroll_start, enroll_end, is_invitation_only in zip(
+            columns['start'], columns['end'], columns['enrollment_start'], columns['enrollment_end'], columns['invitation_only']):
+        start, end, enroll_start, enroll_end = [_parse_date(x) for x in (start, end, enroll_start, enroll_end)]
+        state = get_course_state(start, end, enroll_start, enroll_end, is_invitation_only, today)
+        states.append(state)
+        time_lefts.append(get_time_left(start, today) if start is not None else None)
+        sort_keys.append(_sort_key(start if state in COURSE_STATES_ORDER[:4] else end, today))
+    return states, time_lefts, sort_keys
+
+
+def _to_datetime64(values):
+    """
+    Return a datetime64[us] array in UTC of a date column, missing or invalid dates are NaT.
+    UTC and naive ISO strings are parsed by NumPy in one call, the other values are parsed one by one
+    """
+    strings = []
+    for value in values:
+        if isinstance(value, str) and value.endswith('+00:00'):
+            strings.append(value[:-6])
+        elif isinstance(value, str) and '+' not in value[10:] and '-' not in value[10:] and not value.endswith('Z'):
+            strings.append(value or 'NaT')
+        else:
+            date = _parse_date(value)
+            strings.append(date.astimezone(dt_timezone.utc).replace(tzinfo=None).isoformat() if date else 'NaT')
+    try:
+        return np.array(strings, dtype='datetime64[us]')
+    except ValueError:
+        dates = [_parse_date(x) for x in values]
+        return np.array(
+            [(x - EPOCH) // ONE_MICROSECOND if x is not None else NAT_VALUE for x in dates],
+            dtype='int64'
+        ).view('datetime64[us]')
+
+
+def _classify_columns_numpy(columns, today):
+    """
+    Vectorized implementation of classify_courses, with the same rules of get_course_state
+    """
+    now = np.datetime64((today - EPOCH) // ONE_MICROSECOND, 'us')
+    far_future = np.datetime64((today.replace(year=today.year + 100) - EPOCH) // ONE_MICROSECOND, 'us')
+    start = _to_datetime64(columns['start'])
+    end = _to_datetime64(columns['end'])
+    enroll_start = _to_datetime64(columns['enrollment_start'])
+    enroll_end = _to_datetime64(columns['enrollment_end'])
+    invitation = np.array(columns['invitation_only'], dtype=bool)
+
+    has_start = ~np.isnat(start)
+    has_end = ~np.isnat(end)
+    enroll_start = np.where(np.isnat(enroll_start), start, enroll_start)
+    enroll_end = np.where(np.isnat(enroll_end), end, enroll_end)
+    enroll_end = np.where(np.isnat(enroll_end), far_future, enroll_end)
+    # NaT comparisons are always False, the missing dates are handled with the has_* masks
+    started = has_start & (start <= now)
+    not_started = has_start & (start > now)
+    course_open = ~has_end | (end > now)
+    enrollable = (enroll_start <= now) & (enroll_end > now)
+    enroll_closed = (enroll_start < now) & (enroll_end < now)
+
+    # State codes are positions in STATE_NAMES, the first four are sorted by start date
+    codes = np.select(
+        [
+            ~has_start,
+            invitation & not_started,
+            invitation & course_open,
+            invitation,
+            enrollable & started & course_open,
+            enroll_closed & started & course_open,
+            enroll_closed & not_started & course_open,
+            enrollable & not_started,
+            (enroll_start > now) & (enroll_end > now) & not_started,
+            has_end & (end <= now),
+        ],
+        [5, 2, 3, 4, 0, 3, 2, 1, 2, 4],
+        default=5
+    )
+
+    one_day = np.timedelta64(1, 'D')
+    start_days = np.where(has_start, start - now, np.timedelta64(0, 'us')) // one_day
+    end_days = np.where(has_end, end - now, np.timedelta64(0, 'us')) // one_day
+    years = np.trunc(start_days / 365).astype('int64')
+    in_months = (start_days >= 30) & (start_days < 390)
+    time_left_value = np.where(years > 0, years, np.where(in_months, start_days // 30, start_days))
+    time_left_unit = np.where(years > 0, 2, np.where(in_months, 1, 0))
+
+    sort_keys = np.where(
+        codes < 4,
+        np.where(has_start, np.abs(start_days).astype(float), np.inf),
+        np.where(has_end, np.abs(end_days).astype(float), np.inf)
+    )
+    time_lefts = [
+        [value, TIME_LEFT_UNITS[unit]] if valid else None
+        for value, unit, valid in zip(time_left_value.tolist(), time_left_unit.tolist(), has_start.tolist())
+    ]
+    return [STATE_NAMES[x] for x in codes.tolist()], time_lefts, sort_keys.tolist()
+
+
+def classify_courses(courses, today, use_numpy=True):
+    """
+    Return the course states, time_left and sort keys of the courses, in the same order
+    """
+    columns = get_course_columns(courses)
+    if use_numpy and np is not None and courses:
+        return _classify_columns_numpy(columns, today)
+    return _classify_columns_python(columns, today)
+
+
+def sort_courses_by_state(courses, states, sort_keys):
+    """
+    Return the courses sorted by state (COURSE_STATES_ORDER) and sort key, keeping the original order on ties
+    """
+    state_positions = {state: position for position, state in enumerate(COURSE_STATES_ORDER)}
+    order = sorted(
+        range(len(courses)),
+        key=lambda i: (state_positions.get(states[i], len(COURSE_STATES_ORDER) - 1), sort_keys[i])
+    )
+    return [courses[i] for i in order]
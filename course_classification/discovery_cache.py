@@ -0,0 +1,300 @@
+# -*- coding:utf-8 -*-
+"""
+Coalescing of identical course discovery searches.
+
+Concurrent identical searches (after normalizing the parameters) are computed once: in each process the callers
+wait for the search in flight, across processes a short lived lock in the cache lets one worker compute the
+search while the others wait for its results in the cache. The results are shared during
+COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT seconds (0 by default, disabled), they do not depend on the user. The cache keys include
+the active language (the prices are translated) and the catalog and taxonomy versions, so the shared results are not used after
+a change.
+
+With COURSE_CLASSIFICATION_DISCOVERY_PREFETCH the next page of each search (next from_ or next_cursor) is computed
+in a background thread and put in the cache, so the next click of the user is a cache hit. At most
+COURSE_CLASSIFICATION_DISCOVERY_PREFETCH_CONCURRENCY pages are prefetched at a time in each process, the other
+prefetches are skipped (e.g. under load).
+"""
+# Python Standard Libraries
+from concurrent.futures import ThreadPoolExecutor
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+
+# Installed packages (via pip)
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils import translation
+
+# Internal project dependencies
+from . import metrics
+from .api import course_discovery_multi_search_eol, course_discovery_search_eol
+from .helpers import parse_filter_ids
+from .invalidation import get_versions
+
+
+log = logging.getLogger(__name__)
+DISCOVERY_CACHE_PREFIX = 'course_classification.discovery'
+# Seconds between the reads of the cache while other worker computes the same search
+POLL_INTERVAL = 0.05
+
+
+def get_filter_param(value):
+    """
+    Return the normalized ids of a classification or category filter, e.g. '3, 1' and [1, 3] -> '1,3'
+    """
+    try:
+        return ','.join(str(x) for x in parse_filter_ids(value))
+    except ValueError:
+        # The search returns an error
+        return str(value)
+
+
+def get_discovery_params(search_term=None, size=20, from_=0, order_by="", year="", state="", classification="", category="", featured="", cursor=None, fields=None, facets=False, classification_match="any", category_match="any"):
+    """
+    Return the normalized parameters of a discovery search in the active language, the searches with the same
+    parameters have the same results. Only the whitespace of the search term is normalized, the search engine
+    receives the original term
+    """
+    return {
+        'language': translation.get_language(),
+        'search_term': ' '.join((search_term or '').split()),
+        'size': int(size),
+        'from_': int(from_),
+        'order_by': str(order_by or '').strip(),
+        'year': str(year or '').strip(),
+        'state': str(state or '').strip(),
+        'classification': get_filter_param(classification),
+        'category': get_filter_param(category),
+        'classification_match': str(classification_match or ''),
+        'category_match': str(category_match or ''),
+        'featured': bool(featured),
+        'cursor': cursor,
+        'fields': list(fields) if fields is not None else None,
+        'facets': bool(facets),
+    }
+
+
+def get_discovery_cache_key(params):
+    """
+    Return the cache key of the normalized parameters of a discovery search
+    """
+    params_hash = hashlib.md5(json.dumps(params, sort_keys=True).encode('utf-8')).hexdigest()
+    return '{}.{}'.format(DISCOVERY_CACHE_PREFIX, params_hash)
+
+
+class Flight(object):
+    """
+    A computation in flight and its result or exception
+    """
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Run one computation per key at a time in the process, the concurrent callers of the same key wait
+    for it and receive a copy of its result (or its exception)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+
+    def do(self, key, func):
+        with self.lock:
+            flight = self.flights.get(key)
+            is_leader = flight is None
+            if is_leader:
+                flight = self.flights[key] = Flight()
+        if not is_leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return copy.deepcopy(flight.result)
+        try:
+            flight.result = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.event.set()
+        return flight.result
+
+
+discovery_flights = SingleFlight()
+
+
+def compute_discovery_search(cache_key, kwargs):
+    """
+    Return the results of the cache or compute them, only one worker at a time computes the same search
+    """
+    timeout = getattr(settings, "COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT", 0)
+    lock_timeout = getattr(settings, "COURSE_CLASSIFICATION_DISCOVERY_LOCK_TIMEOUT", 10)
+    results = cache.get(cache_key)
+    if results is not None:
+        return results
+    lock_key = cache_key + '.lock'
+    if not cache.add(lock_key, 1, lock_timeout):
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            results = cache.get(cache_key)
+            if results is not None:
+                return results
+            if cache.get(lock_key) is None:
+                # The other worker finished without results (error), compute them here
+                break
+        return course_discovery_search_eol(**kwargs)
+    try:
+        results = course_discovery_search_eol(**kwargs)
+        # Errors are not shared, the next search tries again
+        if 'error' not in results:
+            cache.set(cache_key, results, timeout)
+    finally:
+        cache.delete(lock_key)
+    return results
+
+
+class Prefetcher(object):
+    """
+    Run the prefetches in background threads, at most max_workers at a time, the others are skipped
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.max_workers = 0
+        self.running = 0
+
+    def submit(self, func, max_workers):
+        """
+        Run func in a background thread, return False if max_workers prefetches are running
+        """
+        with self.lock:
+            if self.running >= max_workers:
+                return False
+            if self.executor is None or self.max_workers != max_workers:
+                if self.executor is not None:
+                    self.executor.shutdown(wait=False)
+                self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='course_classification_prefetch')
+                self.max_workers = max_workers
+            self.running += 1
+            executor = self.executor
+        executor.submit(self.run, func)
+        return True
+
+    def run(self, func):
+        try:
+            func()
+        except Exception as e:
+            log.warning("Course Discovery - Error prefetching a discovery search, error: {}".format(str(e)))
+        finally:
+            connections.close_all()
+            with self.lock:
+                self.running -= 1
+
+
+prefetcher = Prefetcher()
+
+
+def run_in_background(func):
+    """
+    Run a prefetch in a background thread, return False if it is skipped
+    """
+    return prefetcher.submit(func, getattr(settings, "COURSE_CLASSIFICATION_DISCOVERY_PREFETCH_CONCURRENCY", 2))
+
+
+def get_next_page_kwargs(kwargs, results):
+    """
+    Return the arguments of the next page of a search, or None if it is the last page
+    """
+    if 'error' in results or not kwargs.get('size', 20):
+        return None
+    next_kwargs = dict(kwargs)
+    if kwargs.get('cursor') is not None:
+        if not results.get('next_cursor'):
+            return None
+        next_kwargs['cursor'] = results['next_cursor']
+    else:
+        next_kwargs['from_'] = int(kwargs.get('from_', 0)) + int(kwargs.get('size', 20))
+        if next_kwargs['from_'] >= results.get('total', 0):
+            return None
+    return next_kwargs
+
+
+def prefetch_next_page(kwargs, results, versions):
+    """
+    Compute the next page of a search in the background and put it in the cache, if it is not there. The page is
+    computed in the language of the request (the background thread does not have it)
+    """
+    next_kwargs = get_next_page_kwargs(kwargs, results)
+    if next_kwargs is None:
+        return
+    params = get_discovery_params(**next_kwargs)
+    params['versions'] = versions
+    cache_key = get_discovery_cache_key(params)
+    if cache.get(cache_key) is not None:
+        return
+    language = params['language']
+
+    def prefetch():
+        with translation.override(language):
+            discovery_flights.do(cache_key, lambda: compute_discovery_search(cache_key, next_kwargs))
+    scheduled = run_in_background(prefetch)
+    metrics.inc('course_classification_prefetches_total', result='scheduled' if scheduled else 'skipped')
+
+
+def coalesced_discovery_search(**kwargs):
+    """
+    course_discovery_search_eol() with the same arguments, computed once for the identical concurrent searches
+    of all the workers and shared during COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT seconds (0 to disable)
+    """
+    if not getattr(settings, "COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT", 0):
+        return course_discovery_search_eol(**kwargs)
+    params = get_discovery_params(**kwargs)
+    # The popular order also depends on the popularity ranks
+    params['versions'] = get_versions('catalog', 'taxonomy', *(['popularity'] if params['order_by'] == 'popular' else []))
+    cache_key = get_discovery_cache_key(params)
+    results = cache.get(cache_key)
+    metrics.cache_result('discovery', int(results is not None), int(results is None))
+    if results is None:
+        results = discovery_flights.do(cache_key, lambda: compute_discovery_search(cache_key, kwargs))
+    if getattr(settings, "COURSE_CLASSIFICATION_DISCOVERY_PREFETCH", False):
+        prefetch_next_page(kwargs, results, params['versions'])
+    return results
+
+
+def coalesced_discovery_multi_search(queries):
+    """
+    course_discovery_multi_search_eol() with the results of each query shared with the identical searches, like
+    coalesced_discovery_search(). The queries not in the cache are searched and enriched in one batch
+    """
+    timeout = getattr(settings, "COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT", 0)
+    if not timeout:
+        return course_discovery_multi_search_eol(queries)
+    catalog_version, taxonomy_version, popularity_version = get_versions('catalog', 'taxonomy', 'popularity')
+    keys = []
+    for query in queries:
+        params = get_discovery_params(**query)
+        params['versions'] = [catalog_version, taxonomy_version] + ([popularity_version] if params['order_by'] == 'popular' else [])
+        keys.append(get_discovery_cache_key(params))
+    results = cache.get_many(keys)
+    missing = {}
+    for key, query in zip(keys, queries):
+        if key not in results:
+            missing.setdefault(key, query)
+    metrics.cache_result('discovery', len(keys) - len(missing), len(missing))
+    if missing:
+        computed = dict(zip(missing, course_discovery_multi_search_eol(list(missing.values()))))
+        # Errors are not shared, the next search tries again
+        cache.set_many({key: value for key, value in computed.items() if 'error' not in value}, timeout)
+        results.update(computed)
+    return [results[key] for key in keys]
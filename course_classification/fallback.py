@@ -0,0 +1,459 @@
+# -*- coding:utf-8 -*-
+"""
+Fallback search engine for the course discovery.
+
+FallbackSearchEngine keeps the course_info documents in a local SQLite FTS5 index and answers the same searches
+of the main search engine. search_with_fallback() sends the searches to the main engine while it works and to the
+fallback engine when the circuit breaker is open, after consecutive errors or slow searches, probing the main
+engine again every probe interval.
+
+The index is a file of each host. The process that saves a course overview updates the index of its own host
+(sync_fallback_index), so every host must also run the rebuild_fallback_index command periodically (e.g. every
+10 minutes with cron) to get the changes saved by the other hosts and to remove the deleted courses.
+"""
+# Python Standard Libraries
+from collections import Counter
+from contextlib import closing
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+# Installed packages (via pip)
+from django.conf import settings
+from django.db import transaction
+from search.api import QueryParseError
+from search.search_engine_base import SearchEngine
+from search.utils import ValueRange
+
+# Edx dependencies
+from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
+
+# Internal project dependencies
+from . import metrics
+from .course_state import parse_course_date
+from .helpers import get_course_modes_info
+
+
+log = logging.getLogger(__name__)
+DATE_FIELDS = ('start', 'end', 'enrollment_start', 'enrollment_end')
+# Fields of the course_info documents used in the full text search
+TEXT_FIELDS = ('display_name', 'number', 'short_description', 'overview')
+
+
+def get_field(document, field):
+    """
+    Return the value of a field of the document, e.g. 'content.display_name', or None if it does not exist
+    """
+    value = document
+    for key in field.split('.'):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def _comparable(value):
+    """
+    Dates are compared as aware datetimes, like the date fields of the search engine
+    """
+    try:
+        return parse_course_date(value)
+    except (TypeError, ValueError):
+        return value
+
+
+def get_matcher(expected):
+    """
+    Return a function that checks if a document value matches a term, a list of terms or a ValueRange/DateRange
+    of the search dictionaries. The terms are converted to a set once for all the documents of a search
+    """
+    if isinstance(expected, ValueRange):
+        lower = _comparable(expected.lower) if expected.lower is not None else None
+        upper = _comparable(expected.upper) if expected.upper is not None else None
+
+        def range_matches(value):
+            if value is None:
+                return False
+            value = _comparable(value)
+            return (lower is None or value >= lower) and (upper is None or value <= upper)
+        return range_matches
+    expected_values = {str(x) for x in (expected if isinstance(expected, (list, tuple, set)) else [expected])}
+
+    def terms_match(value):
+        if isinstance(value, list):
+            return any(str(x) in expected_values for x in value)
+        return str(value) in expected_values
+    return terms_match
+
+
+def value_matches(value, expected):
+    """
+    Check if a document value matches a term, a list of terms or a ValueRange/DateRange of the search dictionaries
+    """
+    return get_matcher(expected)(value)
+
+
+def get_match_query(query_string):
+    """
+    Return the FTS5 query of a search string, every word is required and used as prefix.
+    The words are quoted, so the FTS5 operators of the search string are searched as text
+    """
+    words = query_string.split()
+    return ' '.join('"{}"*'.format(word.replace('"', '""')) for word in words)
+
+
+def get_terms_facet(hits, field, options=None):
+    """
+    Return the terms facet of a field of the hits, like the main search engine: the most common
+    options["size"] terms (10 by default), their total and the count of the other terms
+    """
+    counts = Counter()
+    for hit in hits:
+        value = get_field(hit['data'], field)
+        for term in (value if isinstance(value, list) else [value]):
+            if term is not None:
+                counts[str(term)] += 1
+    terms = dict(counts.most_common((options or {}).get('size', 10)))
+    return {
+        'terms': terms,
+        'total': sum(terms.values()),
+        'other': sum(counts.values()) - sum(terms.values()),
+    }
+
+
+class FallbackSearchEngine(SearchEngine):
+    """
+    Search engine of the course_info documents in a SQLite FTS5 file, with the interface of edx-search engines
+    """
+    def __init__(self, index=None, path=None):
+        super(FallbackSearchEngine, self).__init__(index=index)
+        self.path = path or getattr(settings, "COURSE_CLASSIFICATION_FALLBACK_INDEX_PATH", None)
+
+    @staticmethod
+    def get_fallback_engine(index=None):
+        """
+        Return the fallback engine or None if COURSE_CLASSIFICATION_FALLBACK_INDEX_PATH is not configured
+        """
+        if not getattr(settings, "COURSE_CLASSIFICATION_FALLBACK_INDEX_PATH", None):
+            return None
+        return FallbackSearchEngine(index=index)
+
+    # Paths of the index files with the tables created by this process
+    ready_paths = set()
+    ready_lock = threading.Lock()
+
+    def connect(self):
+        """
+        Return a connection to the index file, the tables are created the first time the process opens the file
+        """
+        connection = sqlite3.connect(self.path, timeout=5)
+        if self.path not in self.ready_paths:
+            with self.ready_lock:
+                if self.path not in self.ready_paths:
+                    self.create_tables(connection)
+                    self.ready_paths.add(self.path)
+        return connection
+
+    @staticmethod
+    def create_tables(connection):
+        with connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS documents (doc_type TEXT, id TEXT, data TEXT, PRIMARY KEY (doc_type, id))'
+            )
+            connection.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS documents_text USING fts5('
+                'doc_type UNINDEXED, id UNINDEXED, content, tokenize="unicode61 remove_diacritics 2")'
+            )
+
+    def index(self, doc_type, sources, **kwargs):
+        """
+        Add or replace the documents, the id of each document is its "id" field
+        """
+        with closing(self.connect()) as connection, connection:
+            for source in sources:
+                doc_id = str(source['id'])
+                text = ' '.join(str(get_field(source, 'content.' + x) or '') for x in TEXT_FIELDS)
+                connection.execute('DELETE FROM documents_text WHERE doc_type = ? AND id = ?', (doc_type, doc_id))
+                connection.execute(
+                    'INSERT OR REPLACE INTO documents (doc_type, id, data) VALUES (?, ?, ?)',
+                    (doc_type, doc_id, json.dumps(source, default=str))
+                )
+                connection.execute(
+                    'INSERT INTO documents_text (doc_type, id, content) VALUES (?, ?, ?)',
+                    (doc_type, doc_id, ' '.join([doc_id, text, str(source.get('org') or '')]))
+                )
+
+    def remove(self, doc_type, doc_ids, **kwargs):
+        with closing(self.connect()) as connection, connection:
+            for doc_id in doc_ids:
+                connection.execute('DELETE FROM documents WHERE doc_type = ? AND id = ?', (doc_type, str(doc_id)))
+                connection.execute('DELETE FROM documents_text WHERE doc_type = ? AND id = ?', (doc_type, str(doc_id)))
+
+    def search(self,
+               query_string=None,
+               field_dictionary=None,
+               filter_dictionary=None,
+               exclude_dictionary=None,
+               facet_terms=None,
+               **kwargs):
+        """
+        Search the documents like the main search engine: the words of query_string in the text fields,
+        the terms and ranges of field_dictionary, the terms of filter_dictionary (or missing field),
+        without the terms of exclude_dictionary ("_id" is the document id), sorted by kwargs["sort"]
+        (e.g. "start:desc,id") or by relevance and paginated by kwargs["size"] and kwargs["from_"]
+        """
+        started = time.monotonic()
+        doc_type = kwargs.get('doc_type', 'course_info')
+        with closing(self.connect()) as connection:
+            if query_string and query_string.strip():
+                rows = connection.execute(
+                    'SELECT documents.id, documents.data, bm25(documents_text) FROM documents_text '
+                    'JOIN documents ON documents.doc_type = documents_text.doc_type AND documents.id = documents_text.id '
+                    'WHERE documents_text MATCH ? AND documents_text.doc_type = ? ORDER BY bm25(documents_text)',
+                    (get_match_query(query_string), doc_type)
+                ).fetchall()
+            else:
+                rows = connection.execute(
+                    'SELECT id, data, 0 FROM documents WHERE doc_type = ? ORDER BY rowid', (doc_type,)
+                ).fetchall()
+        field_matchers = [(field, get_matcher(value)) for field, value in (field_dictionary or {}).items()]
+        filter_matchers = [(field, get_matcher(value)) for field, value in (filter_dictionary or {}).items()]
+        exclude_matchers = [(field, get_matcher(value)) for field, value in (exclude_dictionary or {}).items() if value and field != '_id']
+        # The excluded document ids (e.g. all the courses not visible in the catalog) are skipped before reading the document
+        excluded_ids = get_matcher((exclude_dictionary or {}).get('_id') or [])
+        hits = []
+        for doc_id, data, rank in rows:
+            if excluded_ids(doc_id):
+                continue
+            document = json.loads(data)
+            if not all(matches(get_field(document, field)) for field, matches in field_matchers):
+                continue
+            if not all(get_field(document, field) is None or matches(get_field(document, field)) for field, matches in filter_matchers):
+                continue
+            if any(matches(get_field(document, field)) for field, matches in exclude_matchers):
+                continue
+            # bm25() is lower for better matches
+            hits.append({'_index': self.index_name, '_type': doc_type, '_id': doc_id, '_score': -rank, 'data': document, 'score': -rank})
+        for sort_field in reversed([x for x in (kwargs.get('sort') or '').split(',') if x]):
+            field, _, direction = sort_field.partition(':')
+            missing = [x for x in hits if get_field(x['data'], field) is None]
+            present = [x for x in hits if get_field(x['data'], field) is not None]
+            present.sort(key=lambda x: _comparable(get_field(x['data'], field)), reverse=direction == 'desc')
+            # Documents without the field are sorted last, like the main search engine
+            hits = present + missing
+        from_ = kwargs.get('from_', 0) or 0
+        size = kwargs.get('size', 10)
+        results = {
+            'took': int((time.monotonic() - started) * 1000),
+            'total': len(hits),
+            'max_score': max([x['_score'] for x in hits], default=0),
+            'results': hits[from_:from_ + size],
+        }
+        if facet_terms:
+            results['facets'] = {name: get_terms_facet(hits, name, options) for name, options in facet_terms.items()}
+        return results
+
+
+def get_fallback_document(course_overview, modes_info):
+    """
+    Return the course_info document of a course overview, with the fields used by the course discovery
+    """
+    course_id = str(course_overview.id)
+    document = {
+        'id': course_id,
+        'course': course_id,
+        'content': {
+            'display_name': course_overview.display_name,
+            'number': course_overview.display_number_with_default,
+            'short_description': course_overview.short_description,
+        },
+        'image_url': course_overview.course_image_url,
+        'number': course_overview.display_number_with_default,
+        'org': course_overview.org,
+        'modes': modes_info[course_id]['modes'],
+        'language': course_overview.language,
+        'catalog_visibility': course_overview.catalog_visibility,
+    }
+    for field in DATE_FIELDS:
+        value = getattr(course_overview, field)
+        if value is not None:
+            document[field] = value.isoformat()
+    return document
+
+
+def sync_fallback_index(course_ids):
+    """
+    Update the documents of the courses in the fallback index after the transaction,
+    courses without course overview (deleted) are removed from the index
+    """
+    if not getattr(settings, "COURSE_CLASSIFICATION_FALLBACK_INDEX_PATH", None) or not course_ids:
+        return
+
+    def sync():
+        engine = FallbackSearchEngine(index=getattr(settings, "COURSEWARE_INDEX_NAME", "courseware_index"))
+        try:
+            course_overviews = list(CourseOverview.objects.filter(id__in=course_ids))
+            modes_info = get_course_modes_info(course_overviews)
+            engine.index('course_info', [get_fallback_document(x, modes_info) for x in course_overviews])
+            found_ids = {str(x.id) for x in course_overviews}
+            engine.remove('course_info', [str(x) for x in course_ids if str(x) not in found_ids])
+        except Exception as e:
+            log.error("Course Discovery - Error updating the fallback search index, error: {}".format(str(e)))
+    transaction.on_commit(sync)
+
+
+def rebuild_fallback_index(chunk_size=500):
+    """
+    Index the documents of all the course overviews in the fallback index of this host and remove the documents
+    of the deleted courses, e.g. to create it or periodically on every host, and return how many were indexed
+    """
+    engine = FallbackSearchEngine(index=getattr(settings, "COURSEWARE_INDEX_NAME", "courseware_index"))
+    with closing(sqlite3.connect(engine.path, timeout=5)) as connection:
+        # The file could be replaced since the process created its tables
+        engine.create_tables(connection)
+    indexed_ids = set()
+    course_overviews = []
+    for course_overview in CourseOverview.objects.order_by('id').iterator(chunk_size=chunk_size):
+        course_overviews.append(course_overview)
+        if len(course_overviews) == chunk_size:
+            modes_info = get_course_modes_info(course_overviews)
+            engine.index('course_info', [get_fallback_document(x, modes_info) for x in course_overviews])
+            indexed_ids.update(str(x.id) for x in course_overviews)
+            course_overviews = []
+    if course_overviews:
+        modes_info = get_course_modes_info(course_overviews)
+        engine.index('course_info', [get_fallback_document(x, modes_info) for x in course_overviews])
+        indexed_ids.update(str(x.id) for x in course_overviews)
+    with closing(engine.connect()) as connection:
+        existing_ids = {x[0] for x in connection.execute('SELECT id FROM documents WHERE doc_type = ?', ('course_info',))}
+    engine.remove('course_info', existing_ids - indexed_ids)
+    return len(indexed_ids)
+
+
+class CircuitBreaker(object):
+    """
+    Closed while the main search engine works. After failure_threshold consecutive errors or searches slower than
+    latency_budget seconds it opens and the searches go to the fallback engine, every probe_interval seconds one
+    search probes the main engine again and closes the breaker if it works within the budget.
+    """
+    def __init__(self, failure_threshold=3, latency_budget=2.0, probe_interval=30):
+        self.failure_threshold = failure_threshold
+        self.latency_budget = latency_budget
+        self.probe_interval = probe_interval
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow_request(self):
+        """
+        Check if the search can use the main engine, when the breaker is open only one probe at a time is allowed
+        """
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if not self.probing and time.monotonic() - self.opened_at >= self.probe_interval:
+                self.probing = True
+                return True
+            return False
+
+    def record_success(self, elapsed):
+        with self.lock:
+            if elapsed > self.latency_budget:
+                self._record_failure()
+            else:
+                self.failures = 0
+                self.opened_at = None
+                self.probing = False
+
+    def record_failure(self):
+        with self.lock:
+            self._record_failure()
+
+    def end_probe(self):
+        """
+        Allow the next probe after a probe that did not record its result (e.g. interrupted by a timeout)
+        """
+        with self.lock:
+            self.probing = False
+
+    def _record_failure(self):
+        self.failures += 1
+        self.probing = False
+        # A failed probe opens the breaker for another probe interval
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                log.warning("Course Discovery - Search engine circuit breaker opened, using the fallback search engine")
+            self.opened_at = time.monotonic()
+
+
+_circuit_breaker = None
+
+
+def get_circuit_breaker():
+    """
+    Return the circuit breaker of the process, created with the settings on first use
+    """
+    global _circuit_breaker
+    if _circuit_breaker is None:
+        _circuit_breaker = CircuitBreaker(
+            failure_threshold=getattr(settings, "COURSE_CLASSIFICATION_FALLBACK_FAILURE_THRESHOLD", 3),
+            latency_budget=getattr(settings, "COURSE_CLASSIFICATION_FALLBACK_LATENCY_BUDGET", 2.0),
+            probe_interval=getattr(settings, "COURSE_CLASSIFICATION_FALLBACK_PROBE_INTERVAL", 30),
+        )
+    return _circuit_breaker
+
+
+def is_client_error(error):
+    """
+    Check if an error of the main search engine is caused by the search (e.g. a malformed search string) and
+    not by the engine: QueryParseError and the 4xx errors of elasticsearch, except timeouts and throttling
+    """
+    if isinstance(error, QueryParseError):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    return isinstance(status_code, int) and 400 <= status_code < 500 and status_code not in (408, 429)
+
+
+def search_with_fallback(searcher, **kwargs):
+    """
+    Search with the main search engine or with the fallback engine if the circuit breaker is open or the
+    main engine fails. Without COURSE_CLASSIFICATION_FALLBACK_INDEX_PATH it is the same as searcher.search().
+    The errors caused by the search (see is_client_error) are raised, they are not failures of the engine
+    """
+    fallback = FallbackSearchEngine.get_fallback_engine(searcher.index_name)
+    if fallback is None:
+        try:
+            return searcher.search(**kwargs)
+        except Exception as e:
+            if not is_client_error(e):
+                metrics.inc('course_classification_engine_errors_total', engine='primary')
+            raise
+    circuit_breaker = get_circuit_breaker()
+    if circuit_breaker.allow_request():
+        # With the breaker open only the probe is allowed
+        probe = circuit_breaker.is_open
+        started = time.monotonic()
+        try:
+            results = searcher.search(**kwargs)
+        except Exception as e:
+            if is_client_error(e):
+                raise
+            circuit_breaker.record_failure()
+            metrics.inc('course_classification_engine_errors_total', engine='primary')
+            log.warning("Course Discovery - Search engine error, using the fallback search engine, error: {}".format(str(e)))
+        else:
+            circuit_breaker.record_success(time.monotonic() - started)
+            return results
+        finally:
+            if probe:
+                circuit_breaker.end_probe()
+    metrics.inc('course_classification_fallback_searches_total')
+    return fallback.search(**kwargs)
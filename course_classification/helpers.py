@@ -1,31 +1,58 @@
 # -*- coding:utf-8 -*-
 # Python Standard Libraries
-from datetime import datetime
+from datetime import datetime, timedelta
+from functools import partial
+import base64
+import csv
 import json
 import logging
-import math
 
 # Installed packages (via pip)
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
 from django.urls import reverse
-from django.utils import timezone
+from django.utils import timezone, translation
+from django.utils.translation import ugettext as _
 
 # Edx dependencies
 from opaque_keys.edx.keys import CourseKey
 from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
-from common.djangoapps.course_modes.models import get_cosmetic_display_price
-from lms.djangoapps.courseware.courses import get_course_by_id
+from openedx.core.djangoapps.site_configuration import helpers as configuration_helpers
+from common.djangoapps.course_modes.models import CourseMode
+from common.djangoapps.student.models import CourseEnrollment
 
 # Internal project dependencies
-from .models import MainCourseClassification, CourseClassification, MainCourseClassificationTemplate, CourseCategory
+from . import metrics
+from .course_state import EPOCH, classify_courses, get_time_left, parse_course_date, sort_courses_by_state
+from .models import MainCourseClassification, CourseClassification, MainCourseClassificationTemplate, CourseCategory, CourseCatalogChange
+from .results import CourseExtraData, DiscoveryResult
+from .routers import get_read_database
+from .snapshot import get_snapshot_extra_data
 
 
 log = logging.getLogger(__name__)
+FEATURED_COURSES_CACHE_KEY = 'course_classification.featured_courses'
+CATALOG_EXPORT_FORMATS = ('jsonl', 'csv')
+CATALOG_EXPORT_FIELDS = (
+    'id', 'display_name', 'number', 'org', 'short_description', 'image_url', 'language',
+    'start', 'end', 'enrollment_start', 'enrollment_end', 'self_paced', 'invitation_only', 'effort',
+    'main_classification_id', 'main_classification', 'categories', 'is_featured_course', 'modes', 'price', 'course_state',
+)
+
+class EchoBuffer(object):
+    """
+        File-like object that returns the written value instead of storing it, used to stream csv rows
+    """
+    def write(self, value):
+        return value
     
 def sort_key(course, today, key='start'):
     """
     Allows you to obtain a number with the  absolute value between a date and today or an infinite positive number
     """
-    date = getattr(course, key, None)
+    date = parse_course_date(course.get(key, None))
     if date:
         return abs((date - today).days)
     else:
@@ -35,16 +62,52 @@ def set_time_left(course_start,today):
     """
     Allows you to obtain how much time are left until a course start, can be in days, months or years
     """
-    days_left = (course_start - today).days
-    year = math.trunc(days_left/365)
-    month = math.trunc(days_left/30)
-    if(year>0):
-        time_left = [year,'y']
-    elif(month>0 and month<=12):
-        time_left = [month,'m']
-    elif(days_left<=31):
-        time_left = [days_left,'d']
-    return time_left
+    return get_time_left(course_start, today)
+
+def encode_discovery_cursor(cursor):
+    """
+        Return an opaque string for a discovery cursor dictionary
+        e.g. {'order': 'start', 'start': '2030-01-01T00:00:00+00:00', 'skip': 2}
+    """
+    data = json.dumps(cursor, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(data).decode('ascii')
+
+def decode_discovery_cursor(cursor):
+    """
+        Return the dictionary of an opaque discovery cursor, raise ValueError if the cursor is malformed
+    """
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+        if not isinstance(data, dict):
+            raise ValueError
+        skip = data.get('skip', 0)
+        if not isinstance(skip, int) or skip < 0:
+            raise ValueError
+        if data.get('start') is not None:
+            datetime.fromisoformat(data['start'])
+    except Exception:
+        raise ValueError('Invalid cursor value')
+    return data
+
+def get_next_discovery_cursor(hits, size, order, cursor=None):
+    """
+        Return the cursor that continues after the last engine hit of the page or None if there are no more pages.
+        The cursor keeps the start date of the last hit and how many courses with that start date were already
+        returned. The hits are sorted by start date and course id, so the next page is the start date range
+        skipping those courses, and the cursor size does not grow with the pages.
+    """
+    if len(hits) < size:
+        return None
+    cursor = cursor or {}
+    def hit_start(hit):
+        start = hit['data'].get('start', None)
+        return start.isoformat() if isinstance(start, datetime) else start
+    last_start = hit_start(hits[-1])
+    skip = sum(1 for hit in hits if hit_start(hit) == last_start)
+    # The boundary start date did not change, the courses of the previous pages are skipped too
+    if cursor.get('start', None) == last_start:
+        skip += cursor.get('skip', 0)
+    return encode_discovery_cursor({'order': order, 'start': last_start, 'skip': skip})
 
 def get_all_logos():
     """
@@ -83,6 +146,37 @@ def get_all_course_categories():
     ).distinct().order_by('sequence')]
     return orgs
 
+def get_catalog_taxonomy():
+    """
+        Return the logos, main classifications and course categories of the catalog in one pass,
+        with the same values of get_all_logos(), get_all_main_classifications() and get_all_course_categories()
+    """
+    courses_with_both_visibility = CourseOverview.objects.filter(catalog_visibility="both").values("id")
+    classified = CourseClassification.objects.filter(course_id__in=courses_with_both_visibility).values_list('MainClass', 'course_category')
+    main_classification_ids = set()
+    category_ids = set()
+    for main_classification_id, category_id in classified:
+        main_classification_ids.add(main_classification_id)
+        category_ids.add(category_id)
+    main_classifications = list(MainCourseClassification.objects.filter(is_active=True).order_by('sequence'))
+    with_template = set(MainCourseClassificationTemplate.objects.filter(
+        main_classification__in=[x.id for x in main_classifications if x.logo]
+    ).values_list('main_classification', flat=True))
+    logos = [
+        [
+            x.logo.url,
+            reverse('course_classification:institution', kwargs={'org_id':x.id}) if x.id in with_template else None
+        ]
+        for x in main_classifications if x.visibility in [0, 2] and x.logo
+    ]
+    orgs = [[x.id, x.name] for x in main_classifications if x.visibility in [1, 2] and x.id in main_classification_ids]
+    categories = [[x.id, x.name] for x in CourseCategory.objects.filter(show_opt__in=[1, 2], id__in=category_ids - {None}).order_by('sequence')]
+    return {
+        'logos': logos,
+        'main_classifications': orgs,
+        'course_categories': categories
+    }
+
 def get_courses_by_category(category_id):
     """
         Return list of courses ids by course category
@@ -99,8 +193,499 @@ def get_courses_by_classification(org_id):
     course_ids = [x['course_id'] for x in courses]
     return course_ids
 
-def set_data_courses(origin_courses):
+def get_facet(counts):
+    """
+        Return a facet with the counts of its terms, with the format of the search engine facets
+    """
+    return {
+        'terms': counts,
+        'total': sum(counts.values()),
+        'other': 0
+    }
+
+def get_discovery_facets(course_ids):
+    """
+        Return the facet counts of the courses of a search by main classification and course category, the keys of
+        the terms are the values of the filters of the course discovery. Each facet is one query
+        e.g. {'classification': {'terms': {'1': 12}, 'total': 12, 'other': 0}, 'category': {'terms': {'3': 5}, ...}}
+    """
+    course_keys = [CourseKey.from_string(x) for x in course_ids]
+    classifications = CourseClassification.objects.filter(
+        course_id__in=course_keys,
+        MainClass__is_active=True,
+        MainClass__visibility__in=[1, 2]
+    ).values('MainClass').annotate(count=Count('id')).order_by('MainClass__sequence')
+    categories = CourseClassification.course_category.through.objects.filter(
+        courseclassification__course_id__in=course_keys,
+        coursecategory__show_opt__in=[1, 2]
+    ).values('coursecategory').annotate(count=Count('id')).order_by('coursecategory__sequence')
+    return {
+        'classification': get_facet({str(x['MainClass']): x['count'] for x in classifications}),
+        'category': get_facet({str(x['coursecategory']): x['count'] for x in categories}),
+    }
+
+def parse_facet_date(term):
+    """
+        Return the aware datetime of a term of a date facet of the search engine, milliseconds since the epoch
+        (elasticsearch) or an ISO string
+    """
+    if isinstance(term, (int, float)) or (isinstance(term, str) and term.lstrip('-').isdigit()):
+        return EPOCH + timedelta(milliseconds=int(term))
+    return parse_course_date(term)
+
+def get_date_facets(start_facet, end_facet):
+    """
+        Return the facet counts of the courses of a search by start year and state from the terms facets of the
+        search engine of their start and end dates (the counts of each distinct date), without queries.
+        The states are the ones of the filters of course_discovery_search_eol for courses that end after they start:
+        the active courses are the started courses that are not finished
+        e.g. {'year': {'terms': {'2023': 12}, 'total': 12, 'other': 0}, 'state': {'terms': {'active': 10, ...}, ...}}
+    """
+    years = {}
+    started = coming_soon = finished = 0
+    now = timezone.now()
+    for term, count in (start_facet or {}).get('terms', {}).items():
+        start = parse_facet_date(term)
+        if start is None:
+            continue
+        years[str(start.year)] = years.get(str(start.year), 0) + count
+        if start > now:
+            coming_soon += count
+        else:
+            started += count
+    for term, count in (end_facet or {}).get('terms', {}).items():
+        end = parse_facet_date(term)
+        if end is not None and end <= now:
+            finished += count
+    states = {'active': max(started - finished, 0), 'finished': finished, 'coming_soon': coming_soon}
+    return {
+        'year': get_facet({x: years[x] for x in sorted(years, reverse=True)}),
+        'state': get_facet({x: y for x, y in states.items() if y}),
+    }
+
+FILTER_MATCHES = ('any', 'all')
+
+def parse_filter_ids(value):
+    """
+        Return the sorted ids of a classification or category filter: an id, ids separated by commas or a list of them,
+        e.g. '3,1' -> [1, 3]. Raise ValueError if an id is not a number
+    """
+    if value is None or value == "":
+        return []
+    values = value if isinstance(value, (list, tuple)) else str(value).split(',')
+    ids = set()
+    for item in values:
+        for x in str(item).split(','):
+            if x.strip():
+                ids.add(int(x))
+    return sorted(ids)
+
+def get_classified_courses(classification_ids=None, category_ids=None, classification_match='any', category_match='any'):
+    """
+        Return the query of the course ids that match the main classification and category filters, with one query.
+        'any' matches the courses with one of the ids, 'all' the courses with all of them (a course has only one main
+        classification, so 'all' of several main classifications matches no course)
+    """
+    if classification_match not in FILTER_MATCHES or category_match not in FILTER_MATCHES:
+        raise ValueError('Invalid filter match, use any or all')
+    classified = CourseClassification.objects.all()
+    if classification_ids:
+        if classification_match == 'all' and len(classification_ids) > 1:
+            return CourseClassification.objects.none().values('course_id')
+        classified = classified.filter(MainClass__id__in=classification_ids, MainClass__is_active=True)
+    if category_ids:
+        classified = classified.filter(course_category__id__in=category_ids)
+        if category_match == 'all' and len(category_ids) > 1:
+            classified = classified.annotate(category_count=Count('course_category', distinct=True)).filter(category_count=len(category_ids))
+    return classified.values('course_id').distinct()
+
+def get_course_modes_info(course_overviews):
+    """
+        Return the course modes slugs and the cosmetic display price of each course overview with one CourseMode query,
+        the price follow the same rules of get_cosmetic_display_price(). The course modes are read from the database
+        of the course overviews (e.g. the read replica of the discovery)
+        e.g. {'course-v1:eol+Test202+2023': {'modes': ['audit'], 'price': 'Free'}}
+    """
+    currency, currency_symbol = configuration_helpers.get_value(
+        'PAID_COURSE_REGISTRATION_CURRENCY',
+        settings.PAID_COURSE_REGISTRATION_CURRENCY
+    )[:2]
+    now = timezone.now()
+    modes = {}
+    registration_prices = {}
+    course_modes = CourseMode.objects.using(course_overviews[0]._state.db if course_overviews else None).filter(
+        course_id__in=[x.id for x in course_overviews]
+    ).filter(Q(expiration_datetime__isnull=True) | Q(expiration_datetime__gte=now)).values('course_id', 'mode_slug', 'min_price', 'currency')
+    for mode in course_modes:
+        course_id = str(mode['course_id'])
+        modes.setdefault(course_id, []).append(mode['mode_slug'])
+        if mode['currency'].lower() == currency.lower():
+            registration_prices[course_id] = min(registration_prices.get(course_id, mode['min_price']), mode['min_price'])
+    courses_info = {}
+    for course in course_overviews:
+        course_id = str(course.id)
+        price = course.cosmetic_display_price
+        if registration_prices.get(course_id, 0) > 0:
+            price = registration_prices[course_id]
+        courses_info[course_id] = {
+            'modes': modes.get(course_id, [CourseMode.DEFAULT_MODE_SLUG]),
+            'price': _("{currency_symbol}{price}").format(currency_symbol=currency_symbol, price=price) if price else _('Free'),
+            'is_free': not price
+        }
+    return courses_info
+
+def get_catalog_rows(course_overviews):
+    """
+        Return the catalog rows of a chunk of course overviews, the classification, categories and price
+        of the whole chunk are obtained with one query each
+    """
+    classifications = {
+        str(x.course_id): x
+        for x in CourseClassification.objects.filter(
+            course_id__in=[c.id for c in course_overviews]
+        ).select_related('MainClass').prefetch_related('course_category')
+    }
+    modes_info = get_course_modes_info(course_overviews)
+    rows = []
+    for course in course_overviews:
+        course_id = str(course.id)
+        classification = classifications.get(course_id, None)
+        main_classification = classification.MainClass if classification is not None else None
+        rows.append({
+            'id': course_id,
+            'display_name': course.display_name,
+            'number': course.display_number_with_default,
+            'org': course.display_org_with_default,
+            'short_description': course.short_description,
+            'image_url': course.course_image_url,
+            'language': course.language,
+            'start': course.start.isoformat() if course.start else None,
+            'end': course.end.isoformat() if course.end else None,
+            'enrollment_start': course.enrollment_start.isoformat() if course.enrollment_start else None,
+            'enrollment_end': course.enrollment_end.isoformat() if course.enrollment_end else None,
+            'self_paced': course.self_paced,
+            'invitation_only': course.invitation_only,
+            'effort': course.effort,
+            'main_classification_id': main_classification.id if main_classification else None,
+            'main_classification': main_classification.name if main_classification else None,
+            'categories': [x.name for x in classification.course_category.all()] if classification is not None else [],
+            'is_featured_course': classification.is_featured_course if classification is not None else False,
+            'modes': modes_info[course_id]['modes'],
+            'price': modes_info[course_id]['price'],
+        })
+    states, _, _ = classify_courses(rows, timezone.now())
+    for row, state in zip(rows, states):
+        row['course_state'] = state
+    return rows
+
+def get_snapshot_rows(course_overviews):
+    """
+        Return the rows of the catalog snapshot (see snapshot.write_catalog_snapshot) of a chunk of course overviews,
+        with the fields of get_courses_extra_data, the dates, the main classification and the category ids
+    """
+    classifications = {
+        str(x.course_id): x
+        for x in CourseClassification.objects.filter(
+            course_id__in=[c.id for c in course_overviews]
+        ).select_related('MainClass').prefetch_related('course_category')
+    }
+    modes_info = get_course_modes_info(course_overviews)
+    rows = []
+    for course in course_overviews:
+        course_id = str(course.id)
+        classification = classifications.get(course_id, None)
+        main_classification = classification.MainClass if classification is not None else None
+        rows.append({
+            'id': course_id,
+            'start': course.start,
+            'end': course.end,
+            'enrollment_start': course.enrollment_start,
+            'enrollment_end': course.enrollment_end,
+            'short_description': course.short_description,
+            'advertised_start': course.advertised_start,
+            'display_org_with_default': course.display_org_with_default,
+            'invitation_only': course.invitation_only,
+            'effort': course.effort,
+            'self_paced': course.self_paced,
+            'main_classification': {
+                'id': main_classification.id,
+                'name': main_classification.name,
+                'logo': '' if not main_classification.logo else main_classification.logo.url
+            } if main_classification is not None else None,
+            'categories': [x.id for x in classification.course_category.all()] if classification is not None else [],
+            'price': modes_info[course_id]['price'],
+            'is_free': modes_info[course_id]['is_free'],
+        })
+    return rows
+
+def iter_catalog_rows(chunk_size=500, get_rows=get_catalog_rows):
+    """
+        Iterate over the rows of all courses visible in the catalog, the course overviews are read
+        with a server side iterator and enriched by chunks so the memory does not grow with the catalog size.
+        get_rows returns the rows of a chunk, e.g. get_snapshot_rows
+    """
+    course_overviews = CourseOverview.objects.filter(catalog_visibility="both").order_by('id').iterator(chunk_size=chunk_size)
+    chunk = []
+    for course in course_overviews:
+        chunk.append(course)
+        if len(chunk) == chunk_size:
+            yield from get_rows(chunk)
+            chunk = []
+    if chunk:
+        yield from get_rows(chunk)
+
+def iter_catalog_export(export_format='jsonl', chunk_size=500):
+    """
+        Iterate over the lines of the catalog export in JSON Lines or CSV format,
+        in CSV the list values (categories, modes) are joined by |
+    """
+    if export_format not in CATALOG_EXPORT_FORMATS:
+        raise ValueError('Invalid export format {}'.format(export_format))
+    if export_format == 'csv':
+        writer = csv.writer(EchoBuffer())
+        yield writer.writerow(CATALOG_EXPORT_FIELDS)
+        for row in iter_catalog_rows(chunk_size):
+            yield writer.writerow(['|'.join(row[x]) if isinstance(row[x], list) else row[x] for x in CATALOG_EXPORT_FIELDS])
+    else:
+        for row in iter_catalog_rows(chunk_size):
+            yield json.dumps(row) + '\n'
+
+def log_catalog_changes(course_ids):
+    """
+        Append the courses to the catalog change log
+    """
+    if course_ids:
+        CourseCatalogChange.objects.bulk_create([CourseCatalogChange(course_id=x) for x in set(course_ids)])
+
+def get_catalog_changes_retention():
     """
+        Return the days the catalog change log is kept, None to keep it forever
+    """
+    return getattr(settings, "COURSE_CLASSIFICATION_CHANGES_RETENTION_DAYS", None) or None
+
+def is_catalog_change_pruned(since_id):
+    """
+        Check if changes after the since token may have been removed from the catalog change log, when the oldest
+        kept change is not the next one
+    """
+    oldest_change = CourseCatalogChange.objects.order_by('id').values_list('id', flat=True).first()
+    return oldest_change is not None and since_id < oldest_change - 1
+
+def prune_catalog_changes(retention_days=None, chunk_size=1000):
+    """
+        Remove the catalog changes older than retention_days (by default COURSE_CLASSIFICATION_CHANGES_RETENTION_DAYS)
+        by chunks, return how many were removed. The last change is always kept, so the tokens are never reused
+    """
+    retention_days = retention_days or get_catalog_changes_retention()
+    if not retention_days:
+        return 0
+    last_change = CourseCatalogChange.objects.order_by('-id').values_list('id', flat=True).first()
+    if last_change is None:
+        return 0
+    old_changes = CourseCatalogChange.objects.filter(created__lt=timezone.now() - timedelta(days=retention_days), id__lt=last_change)
+    removed = 0
+    while True:
+        change_ids = list(old_changes.order_by('id').values_list('id', flat=True)[:chunk_size])
+        if not change_ids:
+            return removed
+        removed += CourseCatalogChange.objects.filter(id__in=change_ids).delete()[0]
+
+def get_catalog_changes(since=None, limit=1000):
+    """
+        Return the catalog changes after the since token (the id of the last change read) or ISO timestamp.
+        Each changed course is returned once, as an upsert with its catalog row if it is visible in the catalog
+        or as a deletion otherwise. Without since only the current token is returned.
+        {
+            "upserts": [{catalog row}, ...],
+            "deletions": ["course-v1:eol+Test202+2023", ...],
+            "next_since": "25",
+            "has_more": False,
+            "resync": False
+        }
+        If since is older than the kept change log (see prune_catalog_changes) the changes are not returned and
+        "resync" is True: the consumer must read the whole catalog (e.g. course_catalog_export) and continue
+        from the next_since of this response, read before the catalog.
+    """
+    changes = CourseCatalogChange.objects.all()
+    last_change = changes.order_by('-id').values_list('id', flat=True).first()
+    resync_response = {'upserts': [], 'deletions': [], 'next_since': str(last_change or 0), 'has_more': False, 'resync': True}
+    if not since:
+        return dict(resync_response, resync=False)
+    if since.isdigit():
+        if is_catalog_change_pruned(int(since)):
+            return resync_response
+        changes = changes.filter(id__gt=int(since))
+    else:
+        try:
+            since_date = datetime.fromisoformat(since)
+        except ValueError:
+            raise ValueError('Invalid since value')
+        if timezone.is_naive(since_date):
+            since_date = timezone.make_aware(since_date, timezone.utc)
+        retention_days = get_catalog_changes_retention()
+        if retention_days and since_date < timezone.now() - timedelta(days=retention_days):
+            return resync_response
+        changes = changes.filter(created__gt=since_date)
+    changes = list(changes.order_by('id').values_list('id', 'course_id')[:limit + 1])
+    has_more = len(changes) > limit
+    changes = changes[:limit]
+    course_ids = list({x[1] for x in changes})
+    course_overviews = list(CourseOverview.objects.filter(id__in=course_ids, catalog_visibility="both"))
+    upserts = get_catalog_rows(course_overviews)
+    visible_ids = {x['id'] for x in upserts}
+    return {
+        'upserts': upserts,
+        'deletions': sorted(str(x) for x in course_ids if str(x) not in visible_ids),
+        'next_since': str(changes[-1][0]) if changes else since,
+        'has_more': has_more,
+        'resync': False
+    }
+
+def get_courses_extra_data(course_overviews, modes_info=None, fields=None):
+    """
+        Return the extra_data of set_data_courses() of each course overview, with one query for
+        classifications and one for course modes. If fields is a set of extra_data fields the
+        queries of main_classification and price are done only if they are in fields (None otherwise)
+        e.g. {'course-v1:eol+Test202+2023': CourseExtraData(short_description=None, ..., main_classification={'name': 'MCC1', 'logo': ''}, price='Free')}
+    """
+    main_classifications = {}
+    if fields is None or 'main_classification' in fields:
+        main_classifications = {
+            str(x.course_id) : {
+                'name':x.MainClass.name,
+                'logo':'' if not x.MainClass.logo else x.MainClass.logo.url
+                }
+            for x in CourseClassification.objects.filter(course_id__in=[c.id for c in course_overviews]).exclude(MainClass=None).select_related('MainClass')
+            }
+    if modes_info is None and (fields is None or 'price' in fields):
+        modes_info = get_course_modes_info(course_overviews)
+    return {
+        str(x.id) : CourseExtraData(
+            short_description=x.short_description,
+            advertised_start=x.advertised_start,
+            display_org_with_default=x.display_org_with_default,
+            invitation_only=x.invitation_only,
+            effort=x.effort,
+            self_paced=x.self_paced,
+            main_classification=main_classifications.get(str(x.id), None),
+            price=modes_info[str(x.id)]['price'] if modes_info is not None else None,
+            )
+        for x in course_overviews
+        }
+
+def get_courses_extra_data_by_id(course_ids, fields=None):
+    """
+        Return the extra_data of the courses by course id, from the catalog snapshot if it is up to date
+        (see snapshot.py) and from the database for the courses not in the snapshot
+    """
+    extra_data = get_snapshot_extra_data(course_ids, fields)
+    missing_ids = [x for x in course_ids if str(x) not in extra_data]
+    if missing_ids:
+        extra_data.update(get_courses_extra_data(list(CourseOverview.objects.using(get_read_database()).filter(id__in=missing_ids)), fields=fields))
+    return extra_data
+
+def get_course_cards(course_overviews):
+    """
+        Return the course cards of the course overviews, with the same fields of the search engine course_info
+        documents after set_data_courses() except time_left and course_state, which depend on the current date.
+        It does not use the search engine or the modulestore, only one query for classifications and one for modes.
+    """
+    modes_info = get_course_modes_info(course_overviews)
+    extra_data = get_courses_extra_data(course_overviews, modes_info)
+    cards = []
+    for course in course_overviews:
+        course_id = str(course.id)
+        cards.append({
+            'id': course_id,
+            'course': course_id,
+            'content': {
+                'display_name': course.display_name,
+                'number': course.display_number_with_default,
+                'short_description': course.short_description,
+            },
+            'image_url': course.course_image_url,
+            'start': course.start.isoformat() if course.start else None,
+            'end': course.end.isoformat() if course.end else None,
+            'enrollment_start': course.enrollment_start.isoformat() if course.enrollment_start else None,
+            'enrollment_end': course.enrollment_end.isoformat() if course.enrollment_end else None,
+            'number': course.display_number_with_default,
+            'org': course.org,
+            'modes': modes_info[course_id]['modes'],
+            'language': course.language,
+            'catalog_visibility': course.catalog_visibility,
+            'extra_data': extra_data[course_id]
+        })
+    return cards
+
+def set_courses_state(cards, today):
+    """
+        Return copies of the course cards with time_left and course_state, classified and sorted like set_data_courses()
+    """
+    new_data = []
+    for card in cards:
+        try:
+            new_course = dict(card)
+            if parse_course_date(new_course['start']) is None:
+                raise ValueError('course {} does not have start date'.format(new_course['id']))
+            new_course['course_state'] = ""
+            new_data.append(new_course)
+        except Exception as e:
+            error = f'Course Discovery - Error in course_classification set_courses_state function, error: {format(str(e))}'
+            log.error(error)
+    return classify_and_sort_courses_dict(new_data, today)
+
+def get_featured_courses_cache_key(language):
+    """
+        Return the cache key of the featured courses of a language, the cards have the translated prices
+    """
+    return '{}.{}'.format(FEATURED_COURSES_CACHE_KEY, language)
+
+def rebuild_featured_courses(language=None):
+    """
+        Build and save in cache the course cards of the featured courses visible in the catalog, in a language
+        (by default the active language)
+    """
+    language = language or translation.get_language()
+    course_ids = list(CourseClassification.objects.filter(is_featured_course=True).values_list('course_id', flat=True))
+    course_overviews = list(CourseOverview.objects.filter(id__in=course_ids, catalog_visibility="both").order_by('id'))
+    with translation.override(language):
+        cards = get_course_cards(course_overviews)
+    cache.set(get_featured_courses_cache_key(language), cards, None)
+    return cards
+
+def get_featured_courses():
+    """
+        Return the featured courses of the active language from the precomputed course cards, sorted by course state
+    """
+    cards = cache.get(get_featured_courses_cache_key(translation.get_language()))
+    metrics.cache_result('featured', int(cards is not None), int(cards is None))
+    if cards is None:
+        cards = rebuild_featured_courses()
+    return set_courses_state(cards, timezone.now())
+
+def featured_courses_changed(course_ids):
+    """
+        Rebuild the precomputed featured courses of each language after the transaction if any of the courses is
+        or was featured. If there are no precomputed featured courses of a language they are built on the next read.
+    """
+    if not course_ids:
+        return
+    languages = {x[0] for x in settings.LANGUAGES}
+    languages.add(translation.get_language())
+    keys = {get_featured_courses_cache_key(x): x for x in languages}
+    cached = cache.get_many(list(keys))
+    if not cached:
+        return
+    cached_ids = {x['id'] for cards in cached.values() for x in cards}
+    if cached_ids.intersection(str(x) for x in course_ids) or CourseClassification.objects.filter(course_id__in=course_ids, is_featured_course=True).exists():
+        for key in cached:
+            transaction.on_commit(partial(rebuild_featured_courses, keys[key]))
+
+def set_data_courses(origin_courses, extra_data_fields=None, extra_data=None):
+    """
+        Return a DiscoveryResult of each search engine hit, without modifying the hits, classified and sorted by course state.
+        extra_data_fields is the set of extra_data fields to compute (see get_courses_extra_data) or None for all of them,
+        extra_data is the extra_data already computed of the courses (e.g. of several searches), by course id
         [
             {
                 "_index": "courseware_index", 
@@ -127,130 +712,58 @@ def set_data_courses(origin_courses):
         ]
     """
     courses = origin_courses
-    course_ids = [CourseKey.from_string(c['_id']) for c in origin_courses]
-    main_classifications = {
-        str(x.course_id) : {
-            'name':x.MainClass.name, 
-            'logo':'' if not x.MainClass.logo else x.MainClass.logo.url 
-            }
-        for x in CourseClassification.objects.filter(course_id__in=course_ids).exclude(MainClass=None) 
-        }
-    course_overviews = {
-        str(x['id']) : {
-            'short_description' : x['short_description'], 
-            'advertised_start' : x['advertised_start'], 
-            'display_org_with_default' : x['display_org_with_default'],
-            'invitation_only' : x['invitation_only'],
-            'effort' : x['effort'],
-            'self_paced' : x['self_paced']
-            }
-        for x in list(CourseOverview.objects.filter(id__in=course_ids).values('id', 'short_description', 'advertised_start', 'display_org_with_default','self_paced','effort','invitation_only'))
-        }
+    if extra_data is None:
+        course_ids = [CourseKey.from_string(c['_id']) for c in origin_courses]
+        extra_data = get_courses_extra_data_by_id(course_ids, extra_data_fields)
     today = timezone.now()
     new_data = []
     for course in courses:
         try:
-            course_aux = get_course_by_id(CourseKey.from_string(course['_id']))
-            course_price = get_cosmetic_display_price(course_aux)
-            new_course = course["data"]
-            course_start = new_course.get("start",None)
-            new_course['extra_data'] = course_overviews.get(course['_id'], None)
-            new_course['extra_data']['main_classification'] = main_classifications.get(course['_id'], None)
-            new_course['extra_data']['price'] = course_price
-            new_course['time_left'] = set_time_left(datetime.fromisoformat(course_start), today)
-            new_course['course_state']= ""
+            course_start = course["data"].get("start",None)
+            new_course = DiscoveryResult(course["data"], extra_data[course['_id']])
+            if parse_course_date(course_start) is None:
+                raise ValueError('course {} does not have start date'.format(course['_id']))
             new_data.append(new_course)
         except Exception as e:
             error = f'Course Discovery - Error in course_classification set_data_courses function course not found, error: {format(str(e))}'
             log.error(error)
+            metrics.inc('course_classification_enrichment_failures_total')
     new_courses_data = classify_and_sort_courses_dict(new_data, today)
     return new_courses_data
 
+def add_enrollment_status(responses, user):
+    """
+        Return copies of the discovery responses with "is_enrolled" in each result for the user, with one CourseEnrollment
+        query for all the results. The responses are the shared results of the discovery (e.g. of the discovery cache),
+        they are not modified. The results without id (e.g. not in the fields) are not marked
+        e.g. [{'results': [{'id': 'course-v1:eol+Test202+2023', ..., 'is_enrolled': True}], 'total': 1}]
+    """
+    course_ids = {x['id'] for response in responses for x in response.get('results', []) if 'id' in x}
+    enrolled_ids = set()
+    if course_ids and user.is_authenticated:
+        enrolled_ids = {
+            str(x) for x in CourseEnrollment.objects.filter(
+                user=user, course_id__in=[CourseKey.from_string(x) for x in course_ids], is_active=True
+            ).values_list('course_id', flat=True)
+        }
+    new_responses = []
+    for response in responses:
+        new_response = dict(response)
+        if 'results' in response:
+            new_response['results'] = [
+                dict(x, is_enrolled=x['id'] in enrolled_ids) if 'id' in x else x
+                for x in response['results']
+            ]
+        new_responses.append(new_response)
+    return new_responses
+
 def classify_and_sort_courses_dict(courses, today):
     """
     Classify and sort courses based on their state and proximity to the current date using a dictionary.
+    The state, time_left and sort key of all courses are computed at once by course_state.classify_courses
     """
-    # Next variables are made by course state and enrollment state
-    ongoing_enrollable_courses = []
-    upcoming_enrollable_courses = []
-    upcoming_notenrollable_courses = []
-    ongoing_notenrollable_courses = []
-    # Completed courses
-    completed_courses = []
-
-    for course in courses:
-        course_start = datetime.fromisoformat(course.get('start', None))
-        course_end = course.get('end', None)
-        if course_end is not None:
-            course_end = datetime.fromisoformat(course_end)
-        enroll_start = datetime.fromisoformat(course.get('enrollment_start')) if course.get('enrollment_start') else course_start
-        enroll_end =  datetime.fromisoformat(course.get('enrollment_end')) if course.get('enrollment_end') else course_end
-        extra_data = course.get('extra_data', None)
-        if extra_data is not None:
-            is_invitation_only = extra_data.get('invitation_only', False)
-        else:
-            is_invitation_only = False
-        # Ensure that enroll_start and enroll_end are not None before comparisons
-        # If enroll_start is None, set it to course_start
-        if enroll_start is None:
-            enroll_start = course_start
-        # If enroll_end is None, set it to course_end or a future date
-        if enroll_end is None:
-            enroll_end =  course_end if course_end else today.replace(year=today.year + 100)
-        # If the course enrollment is by invitation
-        if is_invitation_only:
-            # If course hasn't started yet
-            if course_start > today:
-                course["course_state"] = 'upcoming_notenrollable'
-                upcoming_notenrollable_courses.append(course)
-            # If course hasn't ended and already start
-            elif course_end is None or course_end > today:
-                course["course_state"] = 'ongoing_notenrollable'
-                ongoing_notenrollable_courses.append(course)
-            # If course already end
-            else:
-                course["course_state"] = 'completed'
-                completed_courses.append(course)
-        # If today is between enrollment range and the course already started 
-        elif enroll_start <= today and (enroll_end > today) and course_start <= today and (course_end is None or course_end > today):
-            course["course_state"] = 'ongoing_enrollable'
-            ongoing_enrollable_courses.append(course)
-        # If you are not within the registration deadline today and the course has already begun
-        elif enroll_start < today and (enroll_end < today) and course_start <= today and (course_end is None or course_end > today):
-            course["course_state"] = 'ongoing_notenrollable'
-            ongoing_notenrollable_courses.append(course)
-        # If you are not within the registration deadline today and the course has not yet started
-        elif enroll_start < today and (enroll_end < today) and course_start > today and (course_end is None or course_end > today):
-            course["course_state"] = 'upcoming_notenrollable'
-            upcoming_notenrollable_courses.append(course)
-        # If you are within the enrollment range today and the course has not yet started
-        elif enroll_start <= today and (enroll_end > today) and course_start > today:
-            course["course_state"] = 'upcoming_enrollable'
-            upcoming_enrollable_courses.append(course)
-        # If you are not within the enrollment range today and the course has not yet started
-        elif enroll_start > today and (enroll_end > today) and course_start > today:
-            course["course_state"] = 'upcoming_notenrollable'
-            upcoming_notenrollable_courses.append(course)
-        # If today is after the end date of the course
-        elif course_end is not None and course_end <= today:
-            course["course_state"] = 'completed'
-            completed_courses.append(course)
-        else:
-            course["course_state"] = 'other'
-            completed_courses.append(course)
-
-    ongoing_enrollable_courses.sort(key=lambda course: sort_key(course, today, key='start'))
-    upcoming_enrollable_courses.sort(key=lambda course: sort_key(course, today, key='start'))
-    upcoming_notenrollable_courses.sort(key=lambda course: sort_key(course, today, key='start'))
-    ongoing_notenrollable_courses.sort(key=lambda course: sort_key(course, today, key='start'))
-    completed_courses.sort(key=lambda course: sort_key(course, today, key='end'))
-
-    # Combine the lists
-    sorted_courses = (
-        ongoing_enrollable_courses +
-        upcoming_enrollable_courses +
-        upcoming_notenrollable_courses +
-        ongoing_notenrollable_courses +
-        completed_courses
-    )
-    return sorted_courses
+    states, time_lefts, sort_keys = classify_courses(courses, today)
+    for course, state, time_left in zip(courses, states, time_lefts):
+        course["course_state"] = state
+        course["time_left"] = time_left
+    return sort_courses_by_state(courses, states, sort_keys)
@@ -0,0 +1,114 @@
+# -*- coding:utf-8 -*-
+"""
+Invalidation of the course_classification caches.
+
+The caches include in their keys the versions of the data they use, in these namespaces:
+    taxonomy: main classifications and course categories
+    catalog: any change of the courses visible in the catalog or their classification
+    popularity: the popularity ranks of the courses (see popularity.py)
+
+The signals of the LMS and the CMS (course publish and the admin changes) call invalidate(). The versions
+invalidated in a transaction are written after it commits with one cache call, so a bulk change of many rows
+writes each version once. COURSE_CLASSIFICATION_INVALIDATION_CACHE must be shared by the LMS and the CMS.
+The rendered course cards do not need versions, their keys are a hash of the data of the course (see card_cache.py).
+"""
+# Python Standard Libraries
+import threading
+import time
+
+# Installed packages (via pip)
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+NAMESPACES = ('taxonomy', 'catalog', 'popularity')
+VERSION_CACHE_PREFIX = 'course_classification.version'
+VERSION_COUNTER_KEY = VERSION_CACHE_PREFIX + '.counter'
+# Versions invalidated in the current transaction of each thread (the pending batch)
+_pending = threading.local()
+
+
+def get_version_cache():
+    return caches[getattr(settings, "COURSE_CLASSIFICATION_INVALIDATION_CACHE", "default")]
+
+
+def get_version_key(namespace, key=None):
+    """
+    Return the cache key of the version of a namespace or of one of its keys
+    """
+    if namespace not in NAMESPACES:
+        raise ValueError('Invalid namespace {}'.format(namespace))
+    if key is None:
+        return '{}.{}'.format(VERSION_CACHE_PREFIX, namespace)
+    return '{}.{}.{}'.format(VERSION_CACHE_PREFIX, namespace, key)
+
+
+def next_version():
+    """
+    Return a new version, greater than all the previous ones
+    """
+    version_cache = get_version_cache()
+    try:
+        return version_cache.incr(VERSION_COUNTER_KEY)
+    except ValueError:
+        # The counter does not exist or was evicted, it starts after the versions of the previous counter
+        version_cache.add(VERSION_COUNTER_KEY, int(time.time() * 1000), None)
+        return version_cache.incr(VERSION_COUNTER_KEY)
+
+
+def get_versions(*names):
+    """
+    Return the versions of the namespaces or (namespace, key) tuples with one cache call,
+    e.g. get_versions('catalog', 'taxonomy') -> [1700000000012, 1700000000009]
+    """
+    keys = [get_version_key(*x) if isinstance(x, tuple) else get_version_key(x) for x in names]
+    version_cache = get_version_cache()
+    versions = version_cache.get_many(keys)
+    missing = [x for x in keys if x not in versions]
+    if missing:
+        version = next_version()
+        for key in missing:
+            version_cache.add(key, version, None)
+        versions.update(version_cache.get_many(missing))
+    return [versions.get(x) for x in keys]
+
+
+def bump_versions(names):
+    """
+    Write a new version of the (namespace, key) tuples, key None is the namespace version
+    """
+    if names:
+        version = next_version()
+        get_version_cache().set_many({get_version_key(*x): version for x in names}, None)
+
+
+class PendingInvalidations(object):
+    """
+    Versions invalidated in a transaction, written once by the first of its on_commit callbacks
+    """
+    def __init__(self):
+        self.names = set()
+        self.flushed = False
+
+    def flush(self):
+        if self.flushed:
+            return
+        self.flushed = True
+        if getattr(_pending, 'batch', None) is self:
+            _pending.batch = None
+        bump_versions(self.names)
+
+
+def invalidate(namespace, key=None):
+    """
+    Invalidate the version of a namespace or one of its keys after the transaction commits (now without transaction)
+
+    Each call registers its own on_commit callback, so the invalidation is written if its transaction commits even
+    when the batch comes from a rolled back transaction (then its versions are also written, which is harmless).
+    """
+    get_version_key(namespace)
+    batch = getattr(_pending, 'batch', None)
+    if batch is None:
+        batch = _pending.batch = PendingInvalidations()
+    batch.names.add((namespace, None if key is None else str(key)))
+    transaction.on_commit(batch.flush)
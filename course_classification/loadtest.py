@@ -0,0 +1,367 @@
+# -*- coding:utf-8 -*-
+"""
+Load test of the course discovery endpoints.
+
+The requests go through the WSGI application of the site (middlewares included) from several threads, with a
+weighted mix of request kinds, and the report has the throughput and the p50/p95/p99 latencies of each kind.
+The catalog can be generated (courses of the LOADTEST org, indexed in the search engine and removed at the end)
+or be the existing catalog. Each variant runs the same requests with other settings, to compare them side by side.
+
+The generated catalog is written to the database and the search index of the site (visible in the catalog, some
+of them featured), so it must run against a staging site or, at least, a separate search index (--index). The
+command refuses to generate it without --i-know-this-writes.
+
+    python manage.py lms loadtest_discovery --i-know-this-writes --index loadtest_index --courses 500 --requests 2000 --concurrency 16 \\
+        --variant cache:COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT=10 \\
+        --variant no_cache:COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT=0
+"""
+# Python Standard Libraries
+from datetime import timedelta
+from io import BytesIO
+import json
+import math
+import random
+import secrets
+import threading
+import time
+import urllib.parse
+from wsgiref.util import setup_testing_defaults
+
+# Installed packages (via pip)
+from django.conf import settings
+from django.core.wsgi import get_wsgi_application
+from django.db import connections
+from django.test.utils import override_settings
+from django.urls import reverse
+from django.utils import timezone
+from opaque_keys.edx.keys import CourseKey
+from search.search_engine_base import SearchEngine
+
+# Edx dependencies
+from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
+
+# Internal project dependencies
+from .fallback import get_fallback_document
+from .helpers import get_course_modes_info
+from .models import CourseCatalogChange, CourseCategory, CourseClassification, MainCourseClassification, MainCourseClassificationTemplate
+
+LOAD_TEST_ORG = 'LOADTEST'
+REQUEST_KINDS = ('empty', 'text', 'institution', 'category', 'featured', 'state')
+DEFAULT_MIX = {'empty': 4, 'text': 2, 'institution': 1, 'category': 1, 'featured': 1, 'state': 1}
+PERCENTILES = (50, 95, 99)
+# Words of the generated course names, used by the text searches
+WORDS = (
+    'introduction', 'advanced', 'data', 'science', 'history', 'chemistry', 'physics', 'law', 'medicine',
+    'economics', 'design', 'programming', 'statistics', 'education', 'music', 'biology', 'energy', 'water',
+)
+STATES = ('active', 'finished', 'coming_soon')
+
+
+def parse_mix(value):
+    """
+    Return the weights of the request kinds, e.g. 'empty=3,text=1' -> {'empty': 3, 'text': 1}
+    """
+    mix = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        kind, _, weight = item.partition('=')
+        kind = kind.strip()
+        if kind not in REQUEST_KINDS:
+            raise ValueError('Invalid request kind {}'.format(kind))
+        mix[kind] = float(weight) if weight.strip() else 1.0
+        if mix[kind] < 0:
+            raise ValueError('Invalid weight of {}'.format(kind))
+    if not any(mix.values()):
+        raise ValueError('The request mix is empty')
+    return mix
+
+
+def parse_variant(value):
+    """
+    Return the name and the settings of a variant, e.g. 'no_cache:COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT=0'
+    -> ('no_cache', {'COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT': 0}), the values are read as JSON or strings
+    """
+    name, _, overrides = value.partition(':')
+    if not name.strip():
+        raise ValueError('Invalid variant {}'.format(value))
+    variant_settings = {}
+    for item in overrides.split(','):
+        if not item.strip():
+            continue
+        key, separator, setting_value = item.partition('=')
+        if not separator or not key.strip():
+            raise ValueError('Invalid setting {} of variant {}'.format(item, name))
+        try:
+            variant_settings[key.strip()] = json.loads(setting_value)
+        except ValueError:
+            variant_settings[key.strip()] = setting_value
+    return name.strip(), variant_settings
+
+
+def percentile(values, percent):
+    """
+    Return the nearest rank percentile of the sorted values
+    """
+    if not values:
+        return None
+    return values[max(0, int(math.ceil(percent / 100.0 * len(values))) - 1)]
+
+
+class WSGIClient(object):
+    """
+    Minimal client of a WSGI application, the POST requests include a CSRF cookie and header
+    """
+    def __init__(self, application, host='localhost'):
+        self.application = application
+        self.host = host
+        self.csrf_token = secrets.token_hex(16)
+
+    def request(self, method, path, data=None):
+        """
+        Send a request and read the whole response, return its status code
+        """
+        body = urllib.parse.urlencode(data or {}).encode('utf-8') if method == 'POST' else b''
+        environ = {
+            'REQUEST_METHOD': method,
+            'PATH_INFO': path,
+            'QUERY_STRING': urllib.parse.urlencode(data or {}) if method == 'GET' else '',
+            'HTTP_HOST': self.host,
+            'SERVER_NAME': self.host,
+            'HTTP_COOKIE': '{}={}'.format(settings.CSRF_COOKIE_NAME, self.csrf_token),
+            'HTTP_X_CSRFTOKEN': self.csrf_token,
+            'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.input': BytesIO(body),
+            'wsgi.multithread': True,
+        }
+        setup_testing_defaults(environ)
+        status = []
+
+        def start_response(status_line, headers, exc_info=None):
+            status.append(int(status_line.split(' ', 1)[0]))
+            return lambda data: None
+        response = self.application(environ, start_response)
+        try:
+            for _ in response:
+                pass
+        finally:
+            if hasattr(response, 'close'):
+                response.close()
+        return status[0]
+
+
+def get_existing_catalog():
+    """
+    Return the institutions, categories and words of the text searches of the current catalog
+    """
+    names = CourseOverview.objects.filter(catalog_visibility='both').values_list('display_name', flat=True)[:200]
+    words = sorted({x.lower() for name in names for x in (name or '').split() if len(x) > 3})
+    return {
+        'course_ids': [],
+        'institutions': list(MainCourseClassification.objects.filter(is_active=True).values_list('id', flat=True)),
+        'categories': list(CourseCategory.objects.values_list('id', flat=True)),
+        'words': words or list(WORDS),
+        'generated': False,
+    }
+
+
+def create_course_overview(course_key, display_name, start, end):
+    """
+    Create the course overview of a generated course, without course in the modulestore
+    """
+    return CourseOverview.objects.create(
+        id=course_key,
+        version=CourseOverview.VERSION,
+        _location=course_key.make_usage_key('course', 'course'),
+        org=course_key.org,
+        display_name=display_name,
+        display_number_with_default=course_key.course,
+        display_org_with_default=course_key.org,
+        start=start,
+        end=end,
+        enrollment_start=start - timedelta(days=30),
+        enrollment_end=end,
+        course_image_url='',
+        catalog_visibility='both',
+        language='es',
+        _pre_requisite_courses_json='[]',
+    )
+
+
+def get_search_engine():
+    return SearchEngine.get_search_engine(getattr(settings, "COURSEWARE_INDEX_NAME", "courseware_index"))
+
+
+def generate_catalog(courses, institutions=5, categories=8, seed=0):
+    """
+    Create a catalog of courses of the LOADTEST org with their classification and categories and index them
+    in the search engine. The start dates are spread from three years ago to next year, so all the course states
+    are in the catalog. Remove it with delete_catalog(), the catalog created before an error is removed here
+    """
+    catalog = {'course_ids': [], 'institutions': [], 'categories': [], 'words': list(WORDS), 'generated': True}
+    try:
+        return _generate_catalog(catalog, courses, institutions, categories, seed)
+    except BaseException:
+        delete_catalog(catalog)
+        raise
+
+
+def _generate_catalog(catalog, courses, institutions, categories, seed):
+    rng = random.Random(seed)
+    token = secrets.token_hex(3)
+    now = timezone.now()
+    main_classifications = []
+    for number in range(institutions):
+        # The institution pages need a banner (only its name is used) and a template
+        main_classification = MainCourseClassification.objects.create(
+            name='{} {} institution {}'.format(LOAD_TEST_ORG, token, number),
+            banner='course_classification_assets/loadtest.png',
+            sequence=number,
+            visibility=2,
+            is_active=True
+        )
+        catalog['institutions'].append(main_classification.id)
+        MainCourseClassificationTemplate.objects.create(main_classification=main_classification, template='<p>Load test</p>', language='en')
+        main_classifications.append(main_classification)
+    course_categories = []
+    for number in range(categories):
+        course_category = CourseCategory.objects.create(name='{} {} category {}'.format(LOAD_TEST_ORG, token, number), sequence=number, show_opt=2)
+        catalog['categories'].append(course_category.id)
+        course_categories.append(course_category)
+    course_overviews = []
+    for number in range(courses):
+        course_key = CourseKey.from_string('course-v1:{}+LT{}{}+{}'.format(LOAD_TEST_ORG, token, number, now.year))
+        catalog['course_ids'].append(str(course_key))
+        start = now + timedelta(days=rng.randint(-3 * 365, 365))
+        display_name = ' '.join(rng.sample(WORDS, 3)).title()
+        course_overview = create_course_overview(course_key, display_name, start, start + timedelta(days=rng.randint(30, 180)))
+        course_overviews.append(course_overview)
+        classification = CourseClassification.objects.create(
+            course_id=course_key,
+            MainClass=main_classifications[number % institutions] if institutions else None,
+            is_featured_course=rng.random() < 0.1
+        )
+        if course_categories:
+            classification.course_category.add(*rng.sample(course_categories, min(2, len(course_categories))))
+    modes_info = get_course_modes_info(course_overviews)
+    searcher = get_search_engine()
+    if searcher and course_overviews:
+        searcher.index('course_info', [get_fallback_document(x, modes_info) for x in course_overviews])
+    return catalog
+
+
+def delete_catalog(catalog):
+    """
+    Remove a generated catalog from the database and the search engine, with the catalog change log of its courses
+    """
+    if not catalog.get('generated'):
+        return
+    searcher = get_search_engine()
+    if searcher and catalog['course_ids']:
+        searcher.remove('course_info', catalog['course_ids'])
+    course_keys = [CourseKey.from_string(x) for x in catalog['course_ids']]
+    CourseClassification.objects.filter(course_id__in=course_keys).delete()
+    CourseOverview.objects.filter(id__in=course_keys).delete()
+    CourseCategory.objects.filter(id__in=catalog['categories']).delete()
+    MainCourseClassification.objects.filter(id__in=catalog['institutions']).delete()
+    # Last, the signals of the deletes above log the courses too
+    CourseCatalogChange.objects.filter(course_id__in=course_keys).delete()
+
+
+def get_request(kind, rng, catalog):
+    """
+    Return the method, path and data of a request of the kind
+    """
+    search_path = reverse('course_classification:course_discovery_eol')
+    data = {'search_string': '', 'page_size': 20, 'page_index': 0}
+    if kind == 'institution' and catalog['institutions']:
+        return 'GET', reverse('course_classification:institution', kwargs={'org_id': rng.choice(catalog['institutions'])}), {}
+    if kind == 'text':
+        data['search_string'] = rng.choice(catalog['words'])
+    elif kind == 'category' and catalog['categories']:
+        data['category'] = rng.choice(catalog['categories'])
+    elif kind == 'featured':
+        data['featured'] = 1
+    elif kind == 'state':
+        data['state'] = rng.choice(STATES)
+    return 'POST', search_path, data
+
+
+def run_requests(client, requests, concurrency):
+    """
+    Send the requests from the threads, return the (kind, seconds, status) of each request and the total seconds
+    """
+    samples = []
+    position = [0]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            with lock:
+                if position[0] >= len(requests):
+                    return
+                kind, method, path, data = requests[position[0]]
+                position[0] += 1
+            started = time.monotonic()
+            try:
+                status = client.request(method, path, data)
+            except Exception:  # pylint: disable=broad-except
+                status = None
+            samples.append((kind, time.monotonic() - started, status))
+
+    def thread_worker():
+        try:
+            worker()
+        finally:
+            connections.close_all()
+    started = time.monotonic()
+    if concurrency <= 1:
+        worker()
+    else:
+        threads = [threading.Thread(target=thread_worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return samples, time.monotonic() - started
+
+
+def get_report_row(variant, kind, samples, seconds):
+    latencies = sorted(x[1] for x in samples)
+    row = {
+        'variant': variant,
+        'kind': kind,
+        'requests': len(samples),
+        'errors': len([x for x in samples if x[2] is None or x[2] >= 400]),
+        'throughput': round(len(samples) / seconds, 2) if seconds else None,
+    }
+    for percent in PERCENTILES:
+        value = percentile(latencies, percent)
+        row['p{}'.format(percent)] = round(value * 1000, 2) if value is not None else None
+    return row
+
+
+def run_load_test(catalog, requests=500, concurrency=8, mix=None, variants=None, warmup=20, seed=0, host='localhost'):
+    """
+    Run the same requests with each variant ({name: settings}) and return the report rows: the total and each
+    request kind of each variant, with the latencies in milliseconds and the throughput in requests per second
+    """
+    mix = mix or DEFAULT_MIX
+    variants = variants or {'default': {}}
+    rng = random.Random(seed)
+    kinds = [x for x in REQUEST_KINDS if mix.get(x)]
+    planned = [
+        (kind,) + get_request(kind, rng, catalog)
+        for kind in rng.choices(kinds, weights=[mix[x] for x in kinds], k=warmup + requests)
+    ]
+    client = WSGIClient(get_wsgi_application(), host)
+    rows = []
+    for name, variant_settings in variants.items():
+        with override_settings(**variant_settings):
+            run_requests(client, planned[:warmup], concurrency)
+            samples, seconds = run_requests(client, planned[warmup:], concurrency)
+        rows.append(get_report_row(name, 'total', samples, seconds))
+        for kind in kinds:
+            rows.append(get_report_row(name, kind, [x for x in samples if x[0] == kind], seconds))
+    return rows
@@ -0,0 +1,30 @@
+# -*- coding:utf-8 -*-
+# Python Standard Libraries
+import logging
+
+# Installed packages (via pip)
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Internal project dependencies
+from course_classification.helpers import get_snapshot_rows, iter_catalog_rows
+from course_classification.invalidation import get_versions
+from course_classification.snapshot import write_catalog_snapshot
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Write the catalog snapshot read by the course discovery, run it periodically (e.g. every 5 minutes with cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--path', default=None, help='Snapshot file, by default COURSE_CLASSIFICATION_SNAPSHOT_PATH')
+
+    def handle(self, *args, **options):
+        path = options['path'] or getattr(settings, 'COURSE_CLASSIFICATION_SNAPSHOT_PATH', None)
+        if not path:
+            raise CommandError('COURSE_CLASSIFICATION_SNAPSHOT_PATH is not configured')
+        # The versions are read before the catalog, a change during the build makes the snapshot stale
+        versions = [x or 0 for x in get_versions('catalog', 'taxonomy')]
+        total = write_catalog_snapshot(path, iter_catalog_rows(options['chunk_size'], get_snapshot_rows), versions)
+        logger.info('BuildCatalogSnapshot - %s courses written to %s', total, path)
@@ -0,0 +1,43 @@
+# -*- coding:utf-8 -*-
+# Python Standard Libraries
+import logging
+
+# Installed packages (via pip)
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+# Internal project dependencies
+from course_classification.helpers import CATALOG_EXPORT_FORMATS, iter_catalog_export
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Export all courses visible in the catalog with their classification, categories and price'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--export-format', choices=CATALOG_EXPORT_FORMATS, default='jsonl')
+        parser.add_argument('--output', default=None, help='File path, defaults to stdout')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=getattr(settings, 'COURSE_CLASSIFICATION_EXPORT_CHUNK_SIZE', 500)
+        )
+
+    def handle(self, *args, **options):
+        lines = iter_catalog_export(options['export_format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                total = self.write_lines(output, lines)
+            logger.info('ExportCourseCatalog - %s lines written to %s', total, options['output'])
+        else:
+            self.write_lines(self.stdout, lines)
+
+    def write_lines(self, output, lines):
+        total = 0
+        for line in lines:
+            if output is self.stdout:
+                output.write(line, ending='')
+            else:
+                output.write(line)
+            total += 1
+        return total
@@ -0,0 +1,86 @@
+# -*- coding:utf-8 -*-
+# Python Standard Libraries
+import json
+import logging
+
+# Installed packages (via pip)
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+
+# Internal project dependencies
+from course_classification.loadtest import PERCENTILES, delete_catalog, generate_catalog, get_existing_catalog, parse_mix, parse_variant, run_load_test
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Load test of the course discovery and institution endpoints, report the throughput and latency percentiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--courses', type=int, default=200, help='Courses of the generated catalog, 0 to use the existing catalog')
+        parser.add_argument('--institutions', type=int, default=5)
+        parser.add_argument('--categories', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=500, help='Measured requests of each variant')
+        parser.add_argument('--warmup', type=int, default=20, help='Requests of each variant before the measured requests')
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--mix', default='empty=4,text=2,institution=1,category=1,featured=1,state=1')
+        parser.add_argument(
+            '--variant',
+            action='append',
+            default=[],
+            help='name:SETTING=value,SETTING=value, repeat it to compare settings'
+        )
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--host', default='localhost', help='Host header, must be in ALLOWED_HOSTS')
+        parser.add_argument('--keep-catalog', action='store_true', help='Do not remove the generated catalog')
+        parser.add_argument('--index', help='Search index of the load test instead of COURSEWARE_INDEX_NAME, e.g. loadtest_index')
+        parser.add_argument(
+            '--i-know-this-writes',
+            action='store_true',
+            help='Required to generate the catalog, it is written to the database and the search index'
+        )
+        parser.add_argument('--json', action='store_true', help='Write the report as JSON lines')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+            variants = dict(parse_variant(x) for x in options['variant']) or None
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['courses'] > 0 and not options['i_know_this_writes']:
+            raise CommandError(
+                'The generated catalog is written to the database and the search index, use a staging site or --index '
+                'and confirm it with --i-know-this-writes, or use the existing catalog with --courses 0'
+            )
+        index_settings = {'COURSEWARE_INDEX_NAME': options['index']} if options['index'] else {}
+        with override_settings(**index_settings):
+            rows = self.run_with_catalog(mix, variants, options)
+        if options['json']:
+            for row in rows:
+                self.stdout.write(json.dumps(row))
+            return
+        columns = ['variant', 'kind', 'requests', 'errors', 'throughput'] + ['p{}'.format(x) for x in PERCENTILES]
+        self.stdout.write('  '.join('{:>12}'.format(x) for x in columns))
+        for row in rows:
+            self.stdout.write('  '.join('{:>12}'.format('-' if row[x] is None else str(row[x])) for x in columns))
+
+    def run_with_catalog(self, mix, variants, options):
+        catalog = None
+        try:
+            if options['courses'] > 0:
+                catalog = generate_catalog(options['courses'], options['institutions'], options['categories'], options['seed'])
+                logger.info('LoadTestDiscovery - %s courses generated', options['courses'])
+            else:
+                catalog = get_existing_catalog()
+            return run_load_test(
+                catalog,
+                requests=options['requests'],
+                concurrency=options['concurrency'],
+                mix=mix,
+                variants=variants,
+                warmup=options['warmup'],
+                seed=options['seed'],
+                host=options['host']
+            )
+        finally:
+            if catalog is not None and not options['keep_catalog']:
+                delete_catalog(catalog)
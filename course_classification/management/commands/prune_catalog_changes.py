@@ -0,0 +1,25 @@
+# -*- coding:utf-8 -*-
+# Python Standard Libraries
+import logging
+
+# Installed packages (via pip)
+from django.core.management.base import BaseCommand, CommandError
+
+# Internal project dependencies
+from course_classification.helpers import get_catalog_changes_retention, prune_catalog_changes
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Remove the catalog changes older than the retention days, run it periodically (e.g. daily with cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help='Retention days, by default COURSE_CLASSIFICATION_CHANGES_RETENTION_DAYS')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        retention_days = options['days'] or get_catalog_changes_retention()
+        if not retention_days:
+            raise CommandError('COURSE_CLASSIFICATION_CHANGES_RETENTION_DAYS is not configured')
+        removed = prune_catalog_changes(retention_days, options['chunk_size'])
+        logger.info('PruneCatalogChanges - %s catalog changes older than %s days removed', removed, retention_days)
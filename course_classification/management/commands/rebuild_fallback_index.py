@@ -0,0 +1,24 @@
+# -*- coding:utf-8 -*-
+# Python Standard Libraries
+import logging
+
+# Installed packages (via pip)
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Internal project dependencies
+from course_classification.fallback import rebuild_fallback_index
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Index all course overviews in the fallback search engine of the course discovery'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'COURSE_CLASSIFICATION_FALLBACK_INDEX_PATH', None):
+            raise CommandError('COURSE_CLASSIFICATION_FALLBACK_INDEX_PATH is not configured')
+        total = rebuild_fallback_index(options['chunk_size'])
+        logger.info('RebuildFallbackIndex - %s courses indexed', total)
@@ -0,0 +1,25 @@
+# -*- coding:utf-8 -*-
+# Python Standard Libraries
+import logging
+
+# Installed packages (via pip)
+from django.core.management.base import BaseCommand
+
+# Internal project dependencies
+from course_classification.popularity import reconcile_enrollment_counts, update_popularity_ranks
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+    help = 'Count the active enrollments of the courses by batches, fix the materialized counts and compute the popularity ranks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500)
+        parser.add_argument('--ranks-only', action='store_true', help='Only compute the ranks from the materialized counts')
+
+    def handle(self, *args, **options):
+        if not options['ranks_only']:
+            changed = reconcile_enrollment_counts(options['chunk_size'])
+            logger.info('ReconcileEnrollmentCounts - %s enrollment counts fixed', changed)
+        ranked = update_popularity_ranks(options['chunk_size'])
+        logger.info('ReconcileEnrollmentCounts - %s popularity ranks changed', ranked)
@@ -0,0 +1,298 @@
+# -*- coding:utf-8 -*-
+"""
+Metrics of the course discovery in the Prometheus text format.
+
+Each process keeps its counters and histograms in memory. With COURSE_CLASSIFICATION_METRICS_DIR every process
+writes its metrics to its own file of that directory (at most every COURSE_CLASSIFICATION_METRICS_FLUSH_INTERVAL
+seconds) and the metrics endpoint adds the files of all the processes, so the metrics of all the gunicorn workers
+are exposed by any of them. The files of the processes that ended (e.g. recycled workers) are removed when the
+metrics are collected, their counters are dropped like a restart. Without the directory only the metrics of the
+process of the request are exposed.
+"""
+# Python Standard Libraries
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+# Installed packages (via pip)
+from django.conf import settings
+from django.db import connections
+
+
+log = logging.getLogger(__name__)
+# Histogram buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# name: (type, help)
+METRICS = {
+    'course_classification_request_duration_seconds': ('histogram', 'Latency of the course_classification endpoints'),
+    'course_classification_stage_duration_seconds': ('histogram', 'Latency of the stages of the course discovery'),
+    'course_classification_sql_queries_total': ('counter', 'SQL queries of the course_classification endpoints'),
+    'course_classification_engine_errors_total': ('counter', 'Errors of the search engine'),
+    'course_classification_fallback_searches_total': ('counter', 'Searches answered by the fallback search engine'),
+    'course_classification_enrichment_failures_total': ('counter', 'Courses of the search engine results dropped by the enrichment'),
+    'course_classification_cache_requests_total': ('counter', 'Reads of the course_classification caches by result (hit or miss)'),
+    'course_classification_prefetches_total': ('counter', 'Prefetches of the next page of the discovery searches by result (scheduled or skipped)'),
+}
+# Endpoint of the request of each thread being tracked, the nested tracked views (e.g. the discovery of the
+# institution pages) are observed only in the endpoint of the request
+_active = threading.local()
+
+
+def format_labels(labels, extra=()):
+    """
+    Return the labels of a sample, e.g. (('endpoint', 'discovery'),) -> '{endpoint="discovery"}'
+    """
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    values = []
+    for key, value in items:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        values.append('{}="{}"'.format(key, value))
+    return '{' + ','.join(values) + '}'
+
+
+def is_process_alive(pid):
+    """
+    Check if a process of this host exists
+    """
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Process of other user
+        return True
+    return True
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry(object):
+    """
+    Counters and histograms of the process, by metric name and labels
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        self.counters = {}
+        # (name, labels) -> [count of each bucket..., sum, count]
+        self.histograms = {}
+        self.flushed_at = 0
+
+    @staticmethod
+    def get_key(name, labels):
+        if name not in METRICS:
+            raise ValueError('Invalid metric {}'.format(name))
+        return (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+    def inc(self, name, value=1, **labels):
+        key = self.get_key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.maybe_flush()
+
+    def observe(self, name, value, **labels):
+        key = self.get_key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [0] * (len(self.buckets) + 2)
+            for position, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    histogram[position] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+        self.maybe_flush()
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'buckets': list(self.buckets),
+                'counters': [[name, labels, value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, labels, list(values)] for (name, labels), values in self.histograms.items()],
+            }
+
+    def clear(self):
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+
+    @staticmethod
+    def get_directory():
+        return getattr(settings, "COURSE_CLASSIFICATION_METRICS_DIR", None)
+
+    def get_path(self, directory):
+        return os.path.join(directory, 'metrics_{}.json'.format(os.getpid()))
+
+    def maybe_flush(self, force=False):
+        """
+        Write the metrics of the process to its file of the metrics directory, at most every flush interval
+        """
+        directory = self.get_directory()
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self.flushed_at < getattr(settings, "COURSE_CLASSIFICATION_METRICS_FLUSH_INTERVAL", 5):
+            return
+        self.flushed_at = now
+        path = self.get_path(directory)
+        try:
+            with open(path + '.tmp', 'w') as metrics_file:
+                json.dump(self.snapshot(), metrics_file)
+            os.replace(path + '.tmp', path)
+        except (OSError, ValueError) as e:
+            log.warning("Course Classification Metrics - Error writing the metrics file {}, error: {}".format(path, str(e)))
+
+    def collect(self):
+        """
+        Return the metrics of the process plus the metrics files of the other processes, the files of the
+        processes that ended are removed
+        """
+        snapshots = [self.snapshot()]
+        directory = self.get_directory()
+        if directory:
+            own_path = self.get_path(directory)
+            for path in glob.glob(os.path.join(directory, 'metrics_*.json')):
+                if path == own_path:
+                    continue
+                pid = os.path.basename(path)[len('metrics_'):-len('.json')]
+                if not pid.isdigit() or not is_process_alive(int(pid)):
+                    try:
+                        os.remove(path)
+                    except OSError as e:
+                        log.warning("Course Classification Metrics - Error removing the metrics file {}, error: {}".format(path, str(e)))
+                    continue
+                try:
+                    with open(path) as metrics_file:
+                        snapshots.append(json.load(metrics_file))
+                except (OSError, ValueError) as e:
+                    log.warning("Course Classification Metrics - Error reading the metrics file {}, error: {}".format(path, str(e)))
+        counters = {}
+        histograms = {}
+        for snapshot in snapshots:
+            if snapshot.get('buckets') != list(self.buckets):
+                continue
+            for name, labels, value in snapshot['counters']:
+                key = (name, tuple(tuple(x) for x in labels))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, values in snapshot['histograms']:
+                key = (name, tuple(tuple(x) for x in labels))
+                histogram = histograms.setdefault(key, [0] * len(values))
+                for position, value in enumerate(values):
+                    histogram[position] += value
+        return counters, histograms
+
+    def render(self):
+        """
+        Return the metrics of all the processes in the Prometheus text format
+        """
+        counters, histograms = self.collect()
+        lines = []
+        for name, (metric_type, description) in sorted(METRICS.items()):
+            samples = counters if metric_type == 'counter' else histograms
+            keys = sorted(key for key in samples if key[0] == name)
+            if not keys:
+                continue
+            lines.append('# HELP {} {}'.format(name, description))
+            lines.append('# TYPE {} {}'.format(name, metric_type))
+            for key in keys:
+                labels = key[1]
+                if metric_type == 'counter':
+                    lines.append('{}{} {}'.format(name, format_labels(labels), format_value(samples[key])))
+                    continue
+                values = samples[key]
+                for bucket, value in zip(self.buckets + (float('inf'),), values[:-2] + [values[-1]]):
+                    lines.append('{}_bucket{} {}'.format(name, format_labels(labels, [('le', format_value(float(bucket)))]), value))
+                lines.append('{}_sum{} {}'.format(name, format_labels(labels), format_value(values[-2])))
+                lines.append('{}_count{} {}'.format(name, format_labels(labels), values[-1]))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def is_enabled():
+    return getattr(settings, "COURSE_CLASSIFICATION_METRICS_ENABLED", True)
+
+
+def inc(name, value=1, **labels):
+    if is_enabled():
+        registry.inc(name, value, **labels)
+
+
+def observe(name, value, **labels):
+    if is_enabled():
+        registry.observe(name, value, **labels)
+
+
+def cache_result(cache_name, hits, misses=0):
+    """
+    Count the hits and misses of a cache
+    """
+    if hits:
+        inc('course_classification_cache_requests_total', hits, cache=cache_name, result='hit')
+    if misses:
+        inc('course_classification_cache_requests_total', misses, cache=cache_name, result='miss')
+
+
+def get_endpoint(default):
+    """
+    Return the endpoint of the request tracked in this thread (see track_endpoint), or default if there is none
+    (e.g. a prefetch thread or a view that is not tracked)
+    """
+    return getattr(_active, 'endpoint', None) or default
+
+
+@contextmanager
+def stage_timer(endpoint, stage):
+    """
+    Observe the latency of a stage of an endpoint, e.g. with stage_timer('discovery', 'engine'): ...
+    """
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        observe('course_classification_stage_duration_seconds', time.monotonic() - started, endpoint=endpoint, stage=stage)
+
+
+def track_endpoint(endpoint):
+    """
+    Decorator of the views, observe the latency and count the SQL queries of each request
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not is_enabled() or getattr(_active, 'endpoint', None):
+                return view(*args, **kwargs)
+            queries = [0]
+
+            def count_query(execute, sql, params, many, context):
+                queries[0] += 1
+                return execute(sql, params, many, context)
+            _active.endpoint = endpoint
+            started = time.monotonic()
+            try:
+                with ExitStack() as stack:
+                    for connection in connections.all():
+                        stack.enter_context(connection.execute_wrapper(count_query))
+                    return view(*args, **kwargs)
+            finally:
+                _active.endpoint = None
+                observe('course_classification_request_duration_seconds', time.monotonic() - started, endpoint=endpoint)
+                inc('course_classification_sql_queries_total', queries[0], endpoint=endpoint)
+        return wrapper
+    return decorator
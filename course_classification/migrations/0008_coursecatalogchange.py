@@ -0,0 +1,25 @@
+# Generated by Django 2.2.24 on 2026-10-19 12:00
+
+from django.db import migrations, models
+import opaque_keys.edx.django.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_classification', '0007_courseclassification_is_featured_course'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseCatalogChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course_id', opaque_keys.edx.django.models.CourseKeyField(db_index=True, max_length=255, verbose_name='course')),
+                ('created', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 2.2.24 on 2026-10-19 14:00
+
+from django.db import migrations, models
+import opaque_keys.edx.django.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('course_classification', '0008_coursecatalogchange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseEnrollmentCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('course_id', opaque_keys.edx.django.models.CourseKeyField(max_length=255, unique=True, verbose_name='course')),
+                ('count', models.IntegerField(default=0)),
+                ('rank', models.IntegerField(blank=True, db_index=True, null=True)),
+                ('modified', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ('rank',),
+            },
+        ),
+    ]
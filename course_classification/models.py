@@ -108,3 +108,26 @@ class CourseClassification(models.Model):
 
     class Meta(object):
         ordering = ('course_id',)
+
+class CourseCatalogChange(models.Model):
+    """
+        Append only log of the courses whose catalog data changed, used by the catalog change feed
+    """
+    course_id = CourseKeyField(max_length=255, db_index=True, verbose_name=_('course'))
+    created = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta(object):
+        ordering = ('id',)
+
+class CourseEnrollmentCount(models.Model):
+    """
+        Materialized active enrollment count of each course, updated by the enrollment signals and reconciled
+        by the reconcile_enrollment_counts command, which also computes the popularity rank (1 is the most popular)
+    """
+    course_id = CourseKeyField(max_length=255, unique=True, verbose_name=_('course'))
+    count = models.IntegerField(default=0)
+    rank = models.IntegerField(blank=True, null=True, db_index=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta(object):
+        ordering = ('rank',)
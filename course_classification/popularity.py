@@ -0,0 +1,134 @@
+# -*- coding:utf-8 -*-
+"""
+Popularity of the courses for the order_by "popular" of the course discovery.
+
+The active enrollments of each course are materialized in CourseEnrollmentCount:
+    - the enrollment signals add or subtract one enrollment of the course (see signals.py)
+    - the reconcile_enrollment_counts command counts the enrollments of the courses by batches and sets the
+      counts (e.g. daily), with --ranks-only it only computes the ranks from the counts (e.g. every 10 minutes)
+
+The ranks are computed by the command, never in the requests. Each process keeps the ranks of all the courses
+in memory and reads them again when the command writes new ranks (the "popularity" invalidation version).
+"""
+# Python Standard Libraries
+import logging
+import threading
+
+# Installed packages (via pip)
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+# Edx dependencies
+from common.djangoapps.student.models import CourseEnrollment
+from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
+
+# Internal project dependencies
+from .invalidation import get_versions, invalidate
+from .models import CourseEnrollmentCount
+
+log = logging.getLogger(__name__)
+
+
+def add_enrollments(course_id, delta):
+    """
+    Add delta (1 or -1) to the enrollment count of a course, with an atomic update of the row
+    """
+    if CourseEnrollmentCount.objects.filter(course_id=course_id).update(count=F('count') + delta):
+        return
+    try:
+        with transaction.atomic():
+            CourseEnrollmentCount.objects.create(course_id=course_id, count=max(delta, 0))
+    except IntegrityError:
+        # Created by other request
+        CourseEnrollmentCount.objects.filter(course_id=course_id).update(count=F('count') + delta)
+
+
+def reconcile_enrollment_counts(chunk_size=500):
+    """
+    Count the active enrollments of the courses by chunks of course overviews and set the materialized counts,
+    return the number of counts changed. Each chunk is one transaction: the counts of the chunk are locked
+    (select_for_update) before the enrollments are counted, so the count update of a concurrent enrollment waits
+    for the transaction and is added to the counted value, or it was committed before and it is counted
+    """
+    course_ids = list(CourseOverview.objects.order_by('id').values_list('id', flat=True))
+    changed = 0
+    for position in range(0, len(course_ids), chunk_size):
+        chunk = course_ids[position:position + chunk_size]
+        with transaction.atomic():
+            existing = {
+                str(course_id): count
+                for course_id, count in CourseEnrollmentCount.objects.select_for_update().filter(course_id__in=chunk).values_list('course_id', 'count')
+            }
+            created = [CourseEnrollmentCount(course_id=x, count=0) for x in chunk if str(x) not in existing]
+            if created:
+                # The rows created by concurrent enrollments are not replaced, they are locked and set like the others
+                CourseEnrollmentCount.objects.bulk_create(created, batch_size=chunk_size, ignore_conflicts=True)
+                existing.update(
+                    (str(course_id), count)
+                    for course_id, count in CourseEnrollmentCount.objects.select_for_update().filter(
+                        course_id__in=[x.course_id for x in created]
+                    ).values_list('course_id', 'count')
+                )
+            counts = {
+                str(x['course_id']): x['count']
+                for x in CourseEnrollment.objects.filter(
+                    course_id__in=chunk, is_active=True
+                ).values('course_id').annotate(count=Count('id')).order_by()
+            }
+            changed_ids = {str(x.course_id) for x in created}
+            for course_id in chunk:
+                count = counts.get(str(course_id), 0)
+                if existing.get(str(course_id), None) != count:
+                    CourseEnrollmentCount.objects.filter(course_id=course_id).update(count=count)
+                    changed_ids.add(str(course_id))
+        changed += len(changed_ids)
+    return changed
+
+
+def update_popularity_ranks(chunk_size=500):
+    """
+    Compute the rank of each course from the materialized counts, the ties by course id
+    """
+    rows = list(CourseEnrollmentCount.objects.order_by('-count', 'course_id').values_list('id', 'rank'))
+    updated = [
+        CourseEnrollmentCount(id=row_id, rank=position)
+        for position, (row_id, rank) in enumerate(rows, 1) if rank != position
+    ]
+    if updated:
+        CourseEnrollmentCount.objects.bulk_update(updated, ['rank'], batch_size=chunk_size)
+        invalidate('popularity')
+    return len(updated)
+
+
+class PopularityRanks(object):
+    """
+    Ranks of the courses of the process, read again when the popularity version changes
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.ranks = {}
+
+    def get(self):
+        version = get_versions('popularity')[0]
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.ranks = {
+                        str(course_id): rank
+                        for course_id, rank in CourseEnrollmentCount.objects.exclude(rank=None).values_list('course_id', 'rank')
+                    }
+                    self.version = version
+        return self.ranks
+
+
+popularity_ranks = PopularityRanks()
+
+
+def sort_by_popularity(course_ids):
+    """
+    Return the course ids sorted by popularity rank, the courses without rank last by course id
+    """
+    ranks = popularity_ranks.get()
+    no_rank = len(ranks) + 1
+    return sorted(course_ids, key=lambda x: (ranks.get(str(x), no_rank), str(x)))
@@ -0,0 +1,236 @@
+# -*- coding:utf-8 -*-
+"""
+Profiling of slow course discovery requests.
+
+With COURSE_CLASSIFICATION_PROFILE_DIR the views decorated with profile_endpoint() are profiled:
+
+    - a fraction of the requests (COURSE_CLASSIFICATION_PROFILE_SAMPLE_RATE) with cProfile, saved as profile.prof
+      (e.g. python -m pstats profile.prof or snakeviz)
+    - with COURSE_CLASSIFICATION_PROFILE_SLOW_SECONDS, the other requests are sampled by one thread of the process
+      that reads their stacks every COURSE_CLASSIFICATION_PROFILE_SAMPLE_INTERVAL seconds, and the requests slower
+      than the threshold are saved as stacks.txt (collapsed stacks, e.g. for flamegraph.pl or speedscope)
+
+Each profile is a zip file with the profile and request.json (endpoint, parameters, user, latency) in the
+directory, which keeps the last COURSE_CLASSIFICATION_PROFILE_MAX_FILES profiles. Staff users download them from
+the admin of the course classifications.
+"""
+# Python Standard Libraries
+from collections import Counter
+import cProfile
+from datetime import datetime, timezone
+from functools import wraps
+import io
+import json
+import logging
+import marshal
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zipfile
+
+# Installed packages (via pip)
+from django.conf import settings
+
+log = logging.getLogger(__name__)
+# e.g. 1700000000123456789_discovery_2450ms_stacks_1234.zip
+PROFILE_NAME_RE = re.compile(r'^(?P<timestamp>\d+)_(?P<endpoint>[a-z_]+)_(?P<elapsed>\d+)ms_(?P<kind>cprofile|stacks)_\d+\.zip$')
+# Parameters not saved with the profiles
+EXCLUDED_PARAMS = ('csrfmiddlewaretoken',)
+# Requests of each thread in profiling, the nested profiled views (e.g. the discovery of the institution pages) are not profiled again
+_active = threading.local()
+
+
+def get_profile_directory():
+    return getattr(settings, "COURSE_CLASSIFICATION_PROFILE_DIR", None)
+
+
+def get_frame_name(frame):
+    code = frame.f_code
+    return '{}:{}'.format(code.co_filename, code.co_name)
+
+
+def get_stack(frame):
+    """
+    Return the collapsed stack of a frame, from the outermost call, e.g. 'views.py:get;api.py:course_discovery_search_eol'
+    """
+    names = []
+    while frame is not None:
+        names.append(get_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler(object):
+    """
+    Thread that reads the stacks of the registered threads at an interval while there are threads registered
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def start(self, thread_id):
+        with self.lock:
+            self.samples[thread_id] = Counter()
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='course_classification_stack_sampler', daemon=True)
+                self.thread.start()
+        self.wakeup.set()
+
+    def stop(self, thread_id):
+        """
+        Unregister a thread and return its stacks and how many times each one was read
+        """
+        with self.lock:
+            return self.samples.pop(thread_id, Counter())
+
+    def run(self):
+        while True:
+            with self.lock:
+                thread_ids = list(self.samples)
+            if not thread_ids:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+            time.sleep(getattr(settings, "COURSE_CLASSIFICATION_PROFILE_SAMPLE_INTERVAL", 0.01))
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            with self.lock:
+                for thread_id in thread_ids:
+                    if thread_id in self.samples and thread_id in frames:
+                        self.samples[thread_id][get_stack(frames[thread_id])] += 1
+
+
+sampler = StackSampler()
+
+
+def get_request_params(request):
+    """
+    Return the parameters of a request saved with its profile
+    """
+    params = {}
+    for name, values in (('GET', request.GET), ('POST', request.POST)):
+        params[name] = {key: values.getlist(key) for key in values if key not in EXCLUDED_PARAMS}
+    return {
+        'method': request.method,
+        'path': request.path,
+        'params': params,
+        'user_id': getattr(getattr(request, 'user', None), 'id', None),
+    }
+
+
+def prune_profiles(directory, max_files):
+    """
+    Remove the oldest profiles of the directory over max_files
+    """
+    names = sorted(x for x in os.listdir(directory) if PROFILE_NAME_RE.match(x))
+    for name in names[:max(0, len(names) - max_files)]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            # Removed by other process
+            pass
+
+
+def save_profile(endpoint, kind, elapsed, request_data, data):
+    """
+    Write a profile and its request to the directory of the profiles and remove the oldest ones
+    """
+    directory = get_profile_directory()
+    name = '{}_{}_{}ms_{}_{}.zip'.format(time.time_ns(), endpoint, int(elapsed * 1000), kind, os.getpid())
+    path = os.path.join(directory, name)
+    request_data = dict(request_data, endpoint=endpoint, kind=kind, elapsed=elapsed, timestamp=time.time())
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with zipfile.ZipFile(path + '.tmp', 'w', zipfile.ZIP_DEFLATED) as profile_file:
+            profile_file.writestr('request.json', json.dumps(request_data, indent=2))
+            profile_file.writestr('profile.prof' if kind == 'cprofile' else 'stacks.txt', data)
+        os.replace(path + '.tmp', path)
+        prune_profiles(directory, getattr(settings, "COURSE_CLASSIFICATION_PROFILE_MAX_FILES", 50))
+    except (OSError, ValueError) as e:
+        log.warning("Course Classification Profiling - Error writing the profile {}, error: {}".format(path, str(e)))
+
+
+def list_profiles():
+    """
+    Return the profiles of the directory, the newest first,
+    e.g. [{'name': '..._discovery_2450ms_stacks_1234.zip', 'endpoint': 'discovery', 'elapsed': 2.45, ...}]
+    """
+    directory = get_profile_directory()
+    if not directory or not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        match = PROFILE_NAME_RE.match(name)
+        if not match:
+            continue
+        try:
+            size = os.path.getsize(os.path.join(directory, name))
+        except OSError:
+            continue
+        profiles.append({
+            'name': name,
+            'endpoint': match.group('endpoint'),
+            'kind': match.group('kind'),
+            'elapsed': int(match.group('elapsed')) / 1000.0,
+            'created': datetime.fromtimestamp(int(match.group('timestamp')) / 1e9, tz=timezone.utc),
+            'size': size,
+        })
+    return profiles
+
+
+def get_profile_path(name):
+    """
+    Return the path of a profile of the directory, or None if the name is not a profile
+    """
+    directory = get_profile_directory()
+    if not directory or not PROFILE_NAME_RE.match(name):
+        return None
+    path = os.path.join(directory, name)
+    return path if os.path.isfile(path) else None
+
+
+def profile_endpoint(endpoint):
+    """
+    Decorator of the views, profile a fraction of the requests and the requests slower than the threshold
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            sample_rate = getattr(settings, "COURSE_CLASSIFICATION_PROFILE_SAMPLE_RATE", 0.0)
+            slow_seconds = getattr(settings, "COURSE_CLASSIFICATION_PROFILE_SLOW_SECONDS", None)
+            if not get_profile_directory() or getattr(_active, 'request', False) or not (sample_rate or slow_seconds):
+                return view(request, *args, **kwargs)
+            profiler = cProfile.Profile() if sample_rate and random.random() < sample_rate else None
+            if profiler is None and slow_seconds is None:
+                return view(request, *args, **kwargs)
+            # The class based views receive self first
+            http_request = request if hasattr(request, 'method') else args[0]
+            thread_id = threading.get_ident()
+            _active.request = True
+            started = time.monotonic()
+            try:
+                if profiler is not None:
+                    profiler.enable()
+                else:
+                    sampler.start(thread_id)
+                return view(request, *args, **kwargs)
+            finally:
+                elapsed = time.monotonic() - started
+                _active.request = False
+                if profiler is not None:
+                    profiler.disable()
+                    profiler.create_stats()
+                    save_profile(endpoint, 'cprofile', elapsed, get_request_params(http_request), marshal.dumps(profiler.stats))
+                else:
+                    stacks = sampler.stop(thread_id)
+                    if elapsed >= slow_seconds:
+                        data = io.StringIO()
+                        for stack, count in stacks.most_common():
+                            data.write('{} {}\n'.format(stack, count))
+                        save_profile(endpoint, 'stacks', elapsed, get_request_params(http_request), data.getvalue())
+        return wrapper
+    return decorator
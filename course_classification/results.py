@@ -0,0 +1,257 @@
+# -*- coding:utf-8 -*-
+"""
+Typed records of the course discovery results and their JSON serialization.
+
+The records have __slots__ and are read as dictionaries (course['course_state'], course.get('extra_data'), ...),
+so the templates and callers of the discovery results work with them. DiscoveryResult keeps the document of the
+search engine hit without copying or changing it. The responses are written in one pass with orjson if it is
+installed, or with the json module otherwise.
+"""
+# Python Standard Libraries
+from collections.abc import Mapping
+import json
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# Installed packages (via pip)
+from django.http import HttpResponse
+
+# Edx dependencies
+from common.djangoapps.util.json_request import EDXJSONEncoder
+
+# Fields of the discovery results computed by set_data_courses, the others come from the search engine
+RESULT_FIELDS = ('extra_data', 'course_state', 'time_left')
+# Search engine fields always read, used by the course state classification and the cursor pagination
+REQUIRED_SOURCE_FIELDS = ('id', 'start', 'end', 'enrollment_start', 'enrollment_end')
+# Named field lists of the fields parameter, None is all the fields
+DISCOVERY_FIELD_PRESETS = {
+    'card': (
+        'id',
+        'content.display_name',
+        'content.number',
+        'image_url',
+        'start',
+        'end',
+        'org',
+        'course_state',
+        'time_left',
+        'extra_data.main_classification',
+        'extra_data.price',
+        'extra_data.advertised_start',
+        'extra_data.display_org_with_default',
+    ),
+    'full': None,
+}
+
+
+class Record(Mapping):
+    """
+    Record with the fields in __slots__, read only as a dictionary
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join('{}={!r}'.format(key, self[key]) for key in self))
+
+    def to_dict(self):
+        return {key: self[key] for key in self}
+
+
+class CourseExtraData(Record):
+    """
+    extra_data of a course in the discovery results and course cards
+    """
+    __slots__ = (
+        'short_description',
+        'advertised_start',
+        'display_org_with_default',
+        'invitation_only',
+        'effort',
+        'self_paced',
+        'main_classification',
+        'price',
+    )
+    short_description: Optional[str]
+    advertised_start: Optional[str]
+    display_org_with_default: str
+    invitation_only: bool
+    effort: Optional[str]
+    self_paced: bool
+    main_classification: Optional[Dict[str, str]]
+    price: str
+
+    def __init__(self, short_description, advertised_start, display_org_with_default, invitation_only, effort, self_paced, main_classification, price):
+        self.short_description = short_description
+        self.advertised_start = advertised_start
+        self.display_org_with_default = display_org_with_default
+        self.invitation_only = invitation_only
+        self.effort = effort
+        self.self_paced = self_paced
+        self.main_classification = main_classification
+        self.price = price
+
+
+class DiscoveryResult(Record):
+    """
+    Course of the discovery results: the fields of the search engine document plus extra_data, course_state
+    and time_left. Only course_state and time_left can be set, the document is not modified
+    """
+    __slots__ = ('data', 'extra_data', 'course_state', 'time_left')
+    RESULT_FIELDS = RESULT_FIELDS
+    data: Dict[str, Any]
+    extra_data: CourseExtraData
+    course_state: str
+    time_left: Optional[List]
+
+    def __init__(self, data, extra_data, course_state="", time_left=None):
+        self.data = data
+        self.extra_data = extra_data
+        self.course_state = course_state
+        self.time_left = time_left
+
+    def __getitem__(self, key):
+        if key in self.RESULT_FIELDS:
+            return getattr(self, key)
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        if key not in ('course_state', 'time_left'):
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __iter__(self):
+        for key in self.data:
+            if key not in self.RESULT_FIELDS:
+                yield key
+        for key in self.RESULT_FIELDS:
+            yield key
+
+    def __len__(self):
+        return len(self.data) + len([x for x in self.RESULT_FIELDS if x not in self.data])
+
+    def to_dict(self):
+        result = dict(self.data)
+        result['extra_data'] = self.extra_data
+        result['course_state'] = self.course_state
+        result['time_left'] = self.time_left
+        return result
+
+
+def get_discovery_fields(value):
+    """
+    Return the tuple of fields of the fields parameter or None for all the fields. The value has preset names
+    and fields separated by commas, e.g. 'card' or 'id,content.display_name,extra_data.price'.
+    Fields included by other field of the value are removed, e.g. 'extra_data.price,extra_data' -> ('extra_data',)
+    """
+    fields = []
+    for name in (value or '').split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name in DISCOVERY_FIELD_PRESETS:
+            if DISCOVERY_FIELD_PRESETS[name] is None:
+                return None
+            fields.extend(DISCOVERY_FIELD_PRESETS[name])
+        elif all(name.split('.')):
+            fields.append(name)
+        else:
+            raise ValueError('Invalid field {}'.format(name))
+    if not fields:
+        return None
+    unique_fields = set(fields)
+    return tuple(sorted(
+        x for x in unique_fields
+        if not any('.'.join(x.split('.')[:position]) in unique_fields for position in range(1, x.count('.') + 1))
+    ))
+
+
+def get_source_fields(fields):
+    """
+    Return the search engine fields needed by the fields of the results
+    """
+    source_fields = set(REQUIRED_SOURCE_FIELDS)
+    source_fields.update(x for x in fields if x.split('.')[0] not in RESULT_FIELDS)
+    return sorted(source_fields)
+
+
+def get_extra_data_fields(fields):
+    """
+    Return the extra_data fields needed by the fields of the results, or None for all of them
+    """
+    if fields is None or 'extra_data' in fields:
+        return None
+    return {x.split('.')[1] for x in fields if x.startswith('extra_data.')}
+
+
+def project_result(result, fields):
+    """
+    Return a dictionary with only the fields of a discovery result, the missing fields are not included
+    e.g. ('id', 'content.display_name') -> {'id': 'course-v1:eol+Test+2023', 'content': {'display_name': 'Test'}}
+    """
+    projected = {}
+    for field in fields:
+        keys = field.split('.')
+        value = result
+        for key in keys:
+            if not isinstance(value, Mapping) or key not in value:
+                break
+            value = value[key]
+        else:
+            target = projected
+            for key in keys[:-1]:
+                target = target.setdefault(key, {})
+            target[keys[-1]] = value
+    return projected
+
+
+class DiscoveryJSONEncoder(EDXJSONEncoder):
+    """
+    EDXJSONEncoder with the discovery records
+    """
+    def default(self, o):  # pylint: disable=method-hidden
+        if isinstance(o, Record):
+            return o.to_dict()
+        return super(DiscoveryJSONEncoder, self).default(o)
+
+
+_encoder = DiscoveryJSONEncoder()
+
+
+def dumps_discovery_json(data, sort_keys=False):
+    """
+    Return the JSON bytes of data, which can include discovery records. The dates and other values without
+    JSON type are written like DjangoJSONEncoder, with orjson or the json module
+    """
+    if orjson is not None:
+        option = orjson.OPT_PASSTHROUGH_DATETIME
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(data, default=_encoder.default, option=option)
+        except TypeError:
+            # e.g. integers over 64 bits or keys that are not strings, supported by the json module
+            pass
+    return json.dumps(data, cls=DiscoveryJSONEncoder, ensure_ascii=False, sort_keys=sort_keys).encode('utf-8')
+
+
+class DiscoveryJsonResponse(HttpResponse):
+    """
+    JSON response of the discovery results, serialized by dumps_discovery_json
+    """
+    def __init__(self, data, status=None):
+        super(DiscoveryJsonResponse, self).__init__(dumps_discovery_json(data), content_type='application/json', status=status)
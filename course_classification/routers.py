@@ -0,0 +1,108 @@
+# -*- coding:utf-8 -*-
+"""
+Database router of the course discovery reads.
+
+With COURSE_CLASSIFICATION_READ_REPLICA set to a database alias, the reads of the course_classification models
+go to that replica. The course overviews and course modes are shared with the rest of the LMS (enrollment, checkout,
+course publishing), so they are not routed: only the discovery code reads them from the replica, with
+.using(get_read_database()). After a write of the course_classification models (e.g. in the admin) all these reads
+go to the primary database during COURSE_CLASSIFICATION_REPLICA_PIN_SECONDS, in every process, so the editors see
+their own changes while the replica catches up.
+
+    DATABASE_ROUTERS = ['course_classification.routers.CourseClassificationRouter', ...]
+    COURSE_CLASSIFICATION_READ_REPLICA = 'read_replica'
+"""
+# Python Standard Libraries
+import time
+
+# Installed packages (via pip)
+from django.conf import settings
+from django.core.cache import cache
+
+REPLICA_PIN_CACHE_KEY = 'course_classification.replica_pinned_until'
+# Seconds between reads of the pin of the other processes in the cache
+PIN_CHECK_INTERVAL = 1
+# Models read from the replica, as app_label.model_name
+REPLICA_MODELS = (
+    'course_classification.maincourseclassification',
+    'course_classification.maincourseclassificationtemplate',
+    'course_classification.courseclassification',
+    'course_classification.coursecategory',
+)
+# Models edited in the admin, their writes pin the reads to the primary database
+PIN_MODELS = (
+    'course_classification.maincourseclassification',
+    'course_classification.maincourseclassificationtemplate',
+    'course_classification.courseclassification',
+    'course_classification.coursecategory',
+)
+
+
+def get_replica():
+    return getattr(settings, "COURSE_CLASSIFICATION_READ_REPLICA", None)
+
+
+class ReplicaPin(object):
+    """
+    Pin window of the reads to the primary database after a write, shared by the processes through the cache
+    """
+    def __init__(self):
+        self.pinned_until = 0
+        self.checked_at = 0
+
+    def pin_primary(self):
+        """
+        Read from the primary database during the pin window, in this process and in the others through the cache
+        """
+        pin_seconds = getattr(settings, "COURSE_CLASSIFICATION_REPLICA_PIN_SECONDS", 5)
+        self.pinned_until = time.time() + pin_seconds
+        cache.set(REPLICA_PIN_CACHE_KEY, self.pinned_until, pin_seconds)
+
+    def is_pinned(self):
+        now = time.time()
+        if now < self.pinned_until:
+            return True
+        if now - self.checked_at >= PIN_CHECK_INTERVAL:
+            self.checked_at = now
+            self.pinned_until = max(self.pinned_until, cache.get(REPLICA_PIN_CACHE_KEY, 0))
+        return now < self.pinned_until
+
+
+replica_pin = ReplicaPin()
+
+
+def get_read_database():
+    """
+    Return the database alias of the discovery reads of the course overviews and course modes, the replica
+    or "default" without replica or during the pin window
+    """
+    replica = get_replica()
+    if replica and not replica_pin.is_pinned():
+        return replica
+    return 'default'
+
+
+class CourseClassificationRouter(object):
+    """
+    Send the reads of the course_classification models to the read replica, except during the pin window after a write
+    """
+    def __init__(self, pin=None):
+        self.pin = pin or replica_pin
+
+    def db_for_read(self, model, **hints):
+        replica = get_replica()
+        if replica and model._meta.label_lower in REPLICA_MODELS and not self.pin.is_pinned():
+            return replica
+        return None
+
+    def db_for_write(self, model, **hints):
+        if get_replica() and model._meta.label_lower in PIN_MODELS:
+            self.pin.pin_primary()
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica has the same rows of the primary database
+        replica = get_replica()
+        if replica and {obj1._state.db, obj2._state.db} <= {'default', replica}:
+            return True
+        return None
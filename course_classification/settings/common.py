@@ -1,2 +1,64 @@
 def plugin_settings(settings):
-    pass
+    # Number of course overviews enriched at once by the catalog export
+    settings.COURSE_CLASSIFICATION_EXPORT_CHUNK_SIZE = 500
+    # Maximum number of change log entries read by each request to the catalog change feed
+    settings.COURSE_CLASSIFICATION_CHANGES_PAGE_SIZE = 1000
+    # Days the catalog change log is kept by the prune_catalog_changes command (None to keep it forever)
+    settings.COURSE_CLASSIFICATION_CHANGES_RETENTION_DAYS = 30
+    # Maximum number of course ids of each request to the course cards endpoint
+    settings.COURSE_CLASSIFICATION_BATCH_MAX_COURSES = 100
+    # SQLite file of the fallback search engine, used when the search engine fails or is slow (None to disable)
+    settings.COURSE_CLASSIFICATION_FALLBACK_INDEX_PATH = None
+    # Consecutive search engine errors or slow searches that open the circuit breaker
+    settings.COURSE_CLASSIFICATION_FALLBACK_FAILURE_THRESHOLD = 3
+    # Seconds after which a search engine search is considered slow
+    settings.COURSE_CLASSIFICATION_FALLBACK_LATENCY_BUDGET = 2.0
+    # Seconds between probes of the search engine while the circuit breaker is open
+    settings.COURSE_CLASSIFICATION_FALLBACK_PROBE_INTERVAL = 30
+    # Database alias of the read replica of the discovery reads, used with course_classification.routers.CourseClassificationRouter
+    settings.COURSE_CLASSIFICATION_READ_REPLICA = None
+    # Seconds the discovery reads use the primary database after a write of the course_classification models
+    settings.COURSE_CLASSIFICATION_REPLICA_PIN_SECONDS = 5
+    # Seconds the results of identical discovery searches are shared between requests (0 disables the coalescing)
+    settings.COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT = 0
+    # Maximum seconds a worker waits for the same discovery search computed by other worker
+    settings.COURSE_CLASSIFICATION_DISCOVERY_LOCK_TIMEOUT = 10
+    # Search engine parameter of the source filtering of the discovery fields ("_source_includes" in Elasticsearch 7)
+    settings.COURSE_CLASSIFICATION_SOURCE_FILTER_PARAM = "_source_include"
+    # Seconds the rendered course cards of the institution pages are cached (0 to disable)
+    settings.COURSE_CLASSIFICATION_CARD_CACHE_TIMEOUT = 3600
+    # Cache alias of the versions of the course_classification caches, it must be shared by the LMS and the CMS
+    settings.COURSE_CLASSIFICATION_INVALIDATION_CACHE = "default"
+    # Metrics of the course discovery in the Prometheus text format at course_classification/metrics/
+    settings.COURSE_CLASSIFICATION_METRICS_ENABLED = True
+    # Directory shared by the processes (e.g. gunicorn workers) of a host to expose the metrics of all of them (None for one process)
+    settings.COURSE_CLASSIFICATION_METRICS_DIR = None
+    # Minimum seconds between the writes of the metrics of each process to its file
+    settings.COURSE_CLASSIFICATION_METRICS_FLUSH_INTERVAL = 5
+    # Token of the metrics endpoint for the scrapers without staff user (None to allow only staff users)
+    settings.COURSE_CLASSIFICATION_METRICS_TOKEN = None
+    # Directory of the profiles of the discovery requests, downloaded in the admin (None to disable the profiling)
+    settings.COURSE_CLASSIFICATION_PROFILE_DIR = None
+    # Fraction of the discovery requests profiled with cProfile
+    settings.COURSE_CLASSIFICATION_PROFILE_SAMPLE_RATE = 0.0
+    # Seconds after which the stacks sampled of a discovery request are saved (None to disable the stack sampling)
+    settings.COURSE_CLASSIFICATION_PROFILE_SLOW_SECONDS = None
+    # Seconds between the stack samples of the requests
+    settings.COURSE_CLASSIFICATION_PROFILE_SAMPLE_INTERVAL = 0.01
+    # Profiles kept in the directory, the oldest are removed
+    settings.COURSE_CLASSIFICATION_PROFILE_MAX_FILES = 50
+    # Maximum matching courses of a discovery search counted in its classification and category facets, and maximum
+    # distinct start and end dates counted in its year and state facets
+    settings.COURSE_CLASSIFICATION_FACET_MAX_COURSES = 1000
+    # Maximum matching courses of a discovery search sorted by the popular order
+    settings.COURSE_CLASSIFICATION_POPULAR_MAX_COURSES = 10000
+    # Maximum discovery searches of a request to course_classification/multi_search/
+    settings.COURSE_CLASSIFICATION_MULTI_SEARCH_MAX_QUERIES = 10
+    # Compute the next page of the discovery searches in the background and cache it (it needs COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT)
+    settings.COURSE_CLASSIFICATION_DISCOVERY_PREFETCH = False
+    # Maximum next pages computed at a time in each process, the other prefetches are skipped
+    settings.COURSE_CLASSIFICATION_DISCOVERY_PREFETCH_CONCURRENCY = 2
+    # Catalog snapshot written by the build_catalog_snapshot command and read by the course discovery, None to read the database
+    settings.COURSE_CLASSIFICATION_SNAPSHOT_PATH = None
+    # Seconds between the checks of a new snapshot file in each process
+    settings.COURSE_CLASSIFICATION_SNAPSHOT_CHECK_INTERVAL = 5
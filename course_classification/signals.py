@@ -0,0 +1,121 @@
+# -*- coding:utf-8 -*-
+# Python Standard Libraries
+import logging
+
+# Installed packages (via pip)
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+# Edx dependencies
+from common.djangoapps.student.models import EnrollStatusChange
+from common.djangoapps.student.signals import ENROLL_STATUS_CHANGE
+from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
+from xmodule.modulestore.django import SignalHandler
+
+# Internal project dependencies
+from .fallback import sync_fallback_index
+from .helpers import featured_courses_changed, log_catalog_changes
+from .invalidation import invalidate
+from .models import MainCourseClassification, MainCourseClassificationTemplate, CourseClassification, CourseCategory
+from .popularity import add_enrollments
+
+
+log = logging.getLogger(__name__)
+
+@receiver(post_save, sender=CourseClassification)
+@receiver(post_delete, sender=CourseClassification)
+def course_classification_changed(sender, instance, **kwargs):
+    """
+        Log the course of a created, updated or deleted course classification
+        and update the featured courses if it is or was featured
+    """
+    log_catalog_changes([instance.course_id])
+    featured_courses_changed([instance.course_id])
+    invalidate('catalog')
+
+@receiver(m2m_changed, sender=CourseClassification.course_category.through)
+def course_classification_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+        Log the courses whose categories changed, from the course classification or from the category side
+    """
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        course_ids = [instance.course_id]
+    elif action == 'pre_clear':
+        course_ids = list(instance.courseclassification_set.values_list('course_id', flat=True))
+    elif pk_set:
+        course_ids = list(CourseClassification.objects.filter(id__in=pk_set).values_list('course_id', flat=True))
+    else:
+        return
+    log_catalog_changes(course_ids)
+    invalidate('catalog')
+
+@receiver(post_save, sender=MainCourseClassification)
+def main_classification_changed(sender, instance, **kwargs):
+    """
+        Log the courses of an updated main classification (name, logo, visibility)
+        the deleted ones are logged by the cascade delete of their course classifications
+    """
+    course_ids = list(CourseClassification.objects.filter(MainClass=instance).values_list('course_id', flat=True))
+    log_catalog_changes(course_ids)
+    featured_courses_changed(course_ids)
+    invalidate('catalog')
+    invalidate('taxonomy')
+
+@receiver(post_delete, sender=MainCourseClassification)
+def main_classification_deleted(sender, instance, **kwargs):
+    """
+        Invalidate the taxonomy and the catalog of a deleted main classification
+    """
+    invalidate('taxonomy')
+    invalidate('catalog')
+
+@receiver(post_save, sender=MainCourseClassificationTemplate)
+@receiver(post_delete, sender=MainCourseClassificationTemplate)
+def main_classification_template_changed(sender, instance, **kwargs):
+    """
+        Invalidate the taxonomy of a created, updated or deleted template, the logos link to the institutions with template
+    """
+    invalidate('taxonomy')
+
+@receiver(post_save, sender=CourseCategory)
+@receiver(pre_delete, sender=CourseCategory)
+def course_category_changed(sender, instance, **kwargs):
+    """
+        Log and invalidate the courses of an updated or deleted course category
+    """
+    course_ids = list(instance.courseclassification_set.values_list('course_id', flat=True))
+    log_catalog_changes(course_ids)
+    invalidate('catalog')
+    invalidate('taxonomy')
+
+@receiver(post_save, sender=CourseOverview)
+@receiver(post_delete, sender=CourseOverview)
+def course_overview_changed(sender, instance, **kwargs):
+    """
+        Log the course of a published or deleted course overview, the catalog visibility and dates come from there
+    """
+    log_catalog_changes([instance.id])
+    sync_fallback_index([instance.id])
+    featured_courses_changed([instance.id])
+    invalidate('catalog')
+
+@receiver(SignalHandler.course_published)
+def course_published(sender, course_key, **kwargs):
+    """
+        Invalidate the catalog of a course published in Studio, before the course overview is updated
+    """
+    invalidate('catalog')
+
+@receiver(ENROLL_STATUS_CHANGE)
+def enrollment_status_changed(sender, event=None, course_id=None, **kwargs):
+    """
+        Update the materialized enrollment count of the course of an enrollment or unenrollment
+    """
+    if event not in (EnrollStatusChange.enroll, EnrollStatusChange.unenroll) or course_id is None:
+        return
+    try:
+        add_enrollments(course_id, 1 if event == EnrollStatusChange.enroll else -1)
+    except Exception as e:
+        log.error("Course Classification - Error updating the enrollment count of {}, error: {}".format(course_id, str(e)))
@@ -0,0 +1,353 @@
+# -*- coding:utf-8 -*-
+"""
+Binary snapshot of the enriched catalog, shared by the processes of a host.
+
+The build_catalog_snapshot command (e.g. every few minutes with cron) writes the extra_data, dates, main
+classification and categories of the courses of the catalog to COURSE_CLASSIFICATION_SNAPSHOT_PATH. Each process
+maps the file read only (the pages are shared by all the processes through the page cache) and reads the courses
+from it without copying or parsing the whole file. A new file replaces the previous one atomically and the
+processes map the new file when it changes.
+
+The snapshot has the catalog and taxonomy versions of its build (see invalidation.py). After a change of the
+catalog the snapshot is not used, the enrichment reads the database until the next build.
+
+File layout (little endian):
+    header: magic, catalog version, taxonomy version, build time, counts and offsets of the sections
+    courses: fixed size records sorted by course id (binary search)
+    main classifications: fixed size records
+    categories: the category ids of the courses (uint32)
+    strings: UTF-8 strings referenced by (offset, length), length NONE_LENGTH is None
+"""
+# Python Standard Libraries
+import hashlib
+import logging
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
+
+# Installed packages (via pip)
+from django.conf import settings
+from django.utils.translation import ugettext as _
+
+# Internal project dependencies
+from . import metrics
+from .course_state import EPOCH, NAT_VALUE, ONE_MICROSECOND, parse_course_date
+from .invalidation import get_versions
+from .results import CourseExtraData
+
+log = logging.getLogger(__name__)
+MAGIC = b'CCSNAP01'
+# magic, catalog version, taxonomy version, built at, courses, main classifications, categories, offsets of the sections
+HEADER = struct.Struct('<8sqqdIIIQQQQ')
+# id, start, end, enrollment_start, enrollment_end, flags, main classification index, categories (offset, count),
+# short_description, advertised_start, display_org_with_default, effort, price
+COURSE_RECORD = struct.Struct('<IIqqqqBiII' + 'II' * 5)
+# id, name, logo
+CLASSIFICATION_RECORD = struct.Struct('<iIIII')
+CATEGORY = struct.Struct('<I')
+NONE_LENGTH = 0xFFFFFFFF
+DATE_FIELDS = ('start', 'end', 'enrollment_start', 'enrollment_end')
+TEXT_FIELDS = ('short_description', 'advertised_start', 'display_org_with_default', 'effort', 'price')
+FLAG_INVITATION_ONLY = 1
+FLAG_SELF_PACED = 2
+FLAG_FREE = 4
+
+
+def encode_date(value):
+    value = parse_course_date(value)
+    if value is None:
+        return NAT_VALUE
+    return (value - EPOCH) // ONE_MICROSECOND
+
+
+def decode_date(value):
+    if value == NAT_VALUE:
+        return None
+    return EPOCH + value * ONE_MICROSECOND
+
+
+class StringTable(object):
+    """
+    UTF-8 strings of the snapshot written to a temporary file, each distinct string is written once (the strings
+    are found by their digest, they are not kept in memory)
+    """
+    def __init__(self, strings_file):
+        self.file = strings_file
+        self.size = 0
+        self.offsets = {}
+
+    def add(self, value):
+        if value is None:
+            return 0, NONE_LENGTH
+        encoded = str(value).encode('utf-8')
+        key = hashlib.sha1(encoded).digest()
+        if key not in self.offsets:
+            self.offsets[key] = self.size
+            self.file.write(encoded)
+            self.size += len(encoded)
+        return self.offsets[key], len(encoded)
+
+    def get(self, offset, length):
+        self.file.seek(offset)
+        value = self.file.read(length)
+        self.file.seek(self.size)
+        return value
+
+
+def sort_course_records(snapshot_file, strings, course_count):
+    """
+    Sort the course records written in the snapshot file by the UTF-8 bytes of their ids, for the binary search
+    of CatalogSnapshot.find. Only the records are kept in memory
+    """
+    snapshot_file.seek(HEADER.size)
+    records = []
+    for _ in range(course_count):
+        record = snapshot_file.read(COURSE_RECORD.size)
+        records.append((strings.get(*struct.unpack_from('<II', record)), record))
+    records.sort(key=lambda x: x[0])
+    snapshot_file.seek(HEADER.size)
+    for _, record in records:
+        snapshot_file.write(record)
+
+
+def write_catalog_snapshot(path, rows, versions):
+    """
+    Write the snapshot of the courses rows (e.g. helpers.iter_catalog_rows(chunk_size, helpers.get_snapshot_rows))
+    to a temporary file and replace the snapshot of the path with it. versions are the catalog and taxonomy versions
+    read before the rows.
+
+    The course records are written as the rows are read, the categories and strings to temporary files copied after
+    the records, and the header last. The rows should be sorted by the UTF-8 bytes of the ids, if they are not (e.g.
+    the collation of the database orders them in other way) the records are sorted in the file at the end
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    temporary_path = '{}.{}.tmp'.format(path, os.getpid())
+    classifications = {}
+    course_count = 0
+    category_count = 0
+    previous_id = None
+    unsorted = False
+    with open(temporary_path, 'w+b') as snapshot_file, \
+            tempfile.TemporaryFile(dir=directory) as categories_file, \
+            tempfile.TemporaryFile(dir=directory) as strings_file:
+        strings = StringTable(strings_file)
+        snapshot_file.seek(HEADER.size)
+        for row in rows:
+            encoded_id = row['id'].encode('utf-8')
+            if previous_id is not None and encoded_id < previous_id:
+                unsorted = True
+            previous_id = encoded_id
+            classification = row['main_classification']
+            classification_index = -1
+            if classification is not None:
+                classification_index = classifications.setdefault(classification['id'], (len(classifications), classification))[0]
+            flags = (
+                (FLAG_INVITATION_ONLY if row['invitation_only'] else 0) |
+                (FLAG_SELF_PACED if row['self_paced'] else 0) |
+                (FLAG_FREE if row['is_free'] else 0)
+            )
+            snapshot_file.write(COURSE_RECORD.pack(
+                *strings.add(row['id']),
+                *[encode_date(row[x]) for x in DATE_FIELDS],
+                flags,
+                classification_index,
+                category_count,
+                len(row['categories']),
+                *[x for field in TEXT_FIELDS for x in strings.add(None if field == 'price' and row['is_free'] else row[field])]
+            ))
+            categories_file.write(struct.pack('<{}I'.format(len(row['categories'])), *row['categories']))
+            category_count += len(row['categories'])
+            course_count += 1
+        if unsorted:
+            log.warning("Catalog snapshot - The course rows are not sorted by the UTF-8 bytes of the ids, sorting the records")
+            sort_course_records(snapshot_file, strings, course_count)
+        classifications_offset = snapshot_file.tell()
+        for _, classification in sorted(classifications.values(), key=lambda x: x[0]):
+            snapshot_file.write(CLASSIFICATION_RECORD.pack(
+                classification['id'], *strings.add(classification['name']), *strings.add(classification['logo'])
+            ))
+        categories_offset = snapshot_file.tell()
+        categories_file.seek(0)
+        shutil.copyfileobj(categories_file, snapshot_file)
+        strings_offset = snapshot_file.tell()
+        strings_file.seek(0)
+        shutil.copyfileobj(strings_file, snapshot_file)
+        snapshot_file.seek(0)
+        snapshot_file.write(HEADER.pack(
+            MAGIC, versions[0], versions[1], time.time(), course_count, len(classifications), category_count,
+            HEADER.size, classifications_offset, categories_offset, strings_offset
+        ))
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temporary_path, path)
+    return course_count
+
+
+class CatalogSnapshot(object):
+    """
+    Read only view of a snapshot file, the courses are read from the mapped file when they are requested
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as snapshot_file:
+            self.buffer = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        (
+            magic, catalog_version, taxonomy_version, self.built_at, self.course_count, self.classification_count,
+            self.category_count, self.courses_offset, self.classifications_offset, self.categories_offset, self.strings_offset
+        ) = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError('Invalid catalog snapshot {}'.format(path))
+        self.versions = [catalog_version, taxonomy_version]
+
+    def __len__(self):
+        return self.course_count
+
+    def get_bytes(self, offset, length):
+        return self.buffer[self.strings_offset + offset:self.strings_offset + offset + length]
+
+    def get_string(self, offset, length):
+        if length == NONE_LENGTH:
+            return None
+        return self.get_bytes(offset, length).decode('utf-8')
+
+    def find(self, course_id):
+        """
+        Return the position of the course in the snapshot or -1, with a binary search of the sorted ids
+        """
+        target = str(course_id).encode('utf-8')
+        low, high = 0, self.course_count
+        while low < high:
+            middle = (low + high) // 2
+            offset, length = struct.unpack_from('<II', self.buffer, self.courses_offset + middle * COURSE_RECORD.size)
+            value = self.get_bytes(offset, length)
+            if value < target:
+                low = middle + 1
+            elif value > target:
+                high = middle
+            else:
+                return middle
+        return -1
+
+    def get_course(self, course_id):
+        """
+        Return the data of a course in the snapshot or None,
+        e.g. {'id': ..., 'start': datetime, ..., 'main_classification': {'id': 1, 'name': 'MCC1', 'logo': ''}, 'categories': [2]}
+        """
+        position = self.find(course_id)
+        if position < 0:
+            return None
+        values = COURSE_RECORD.unpack_from(self.buffer, self.courses_offset + position * COURSE_RECORD.size)
+        course = {'id': str(course_id)}
+        for field, value in zip(DATE_FIELDS, values[2:6]):
+            course[field] = decode_date(value)
+        flags, classification_index, categories_offset, categories_count = values[6:10]
+        for position, field in enumerate(TEXT_FIELDS):
+            course[field] = self.get_string(values[10 + position * 2], values[11 + position * 2])
+        course['invitation_only'] = bool(flags & FLAG_INVITATION_ONLY)
+        course['self_paced'] = bool(flags & FLAG_SELF_PACED)
+        if flags & FLAG_FREE:
+            course['price'] = _('Free')
+        course['main_classification'] = None
+        if classification_index >= 0:
+            classification_id, name_offset, name_length, logo_offset, logo_length = CLASSIFICATION_RECORD.unpack_from(
+                self.buffer, self.classifications_offset + classification_index * CLASSIFICATION_RECORD.size
+            )
+            course['main_classification'] = {
+                'id': classification_id,
+                'name': self.get_string(name_offset, name_length),
+                'logo': self.get_string(logo_offset, logo_length),
+            }
+        course['categories'] = list(struct.unpack_from(
+            '<{}I'.format(categories_count), self.buffer, self.categories_offset + categories_offset * CATEGORY.size
+        ))
+        return course
+
+    def get_extra_data(self, course_id, fields=None):
+        """
+        Return the extra_data of a course like helpers.get_courses_extra_data, or None if it is not in the snapshot
+        """
+        course = self.get_course(course_id)
+        if course is None:
+            return None
+        main_classification = None
+        if course['main_classification'] is not None and (fields is None or 'main_classification' in fields):
+            main_classification = {'name': course['main_classification']['name'], 'logo': course['main_classification']['logo']}
+        return CourseExtraData(
+            short_description=course['short_description'],
+            advertised_start=course['advertised_start'],
+            display_org_with_default=course['display_org_with_default'],
+            invitation_only=course['invitation_only'],
+            effort=course['effort'],
+            self_paced=course['self_paced'],
+            main_classification=main_classification,
+            price=course['price'] if fields is None or 'price' in fields else None,
+        )
+
+
+class SnapshotHolder(object):
+    """
+    Snapshot of the process, mapped again when the file of the path changes
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.file_id = None
+        self.checked_at = 0
+
+    def get(self, path):
+        now = time.monotonic()
+        if now - self.checked_at < getattr(settings, "COURSE_CLASSIFICATION_SNAPSHOT_CHECK_INTERVAL", 5):
+            return self.snapshot
+        with self.lock:
+            self.checked_at = now
+            try:
+                stat = os.stat(path)
+            except OSError:
+                self.snapshot, self.file_id = None, None
+                return None
+            file_id = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            if file_id != self.file_id:
+                try:
+                    # The previous map is closed when the requests reading it finish
+                    self.snapshot, self.file_id = CatalogSnapshot(path), file_id
+                except (OSError, ValueError, struct.error) as e:
+                    log.error("Course Discovery - Error reading the catalog snapshot {}, error: {}".format(path, str(e)))
+                    self.snapshot, self.file_id = None, file_id
+            return self.snapshot
+
+
+snapshot_holder = SnapshotHolder()
+
+
+def get_catalog_snapshot():
+    """
+    Return the current catalog snapshot of the process, or None without snapshot
+    """
+    path = getattr(settings, "COURSE_CLASSIFICATION_SNAPSHOT_PATH", None)
+    if not path:
+        return None
+    return snapshot_holder.get(path)
+
+
+def get_snapshot_extra_data(course_ids, fields=None):
+    """
+    Return the extra_data of the courses in the snapshot by course id, the courses not in the snapshot are
+    not included. The snapshot is not used if the catalog changed after its build
+    """
+    snapshot = get_catalog_snapshot()
+    if snapshot is None:
+        return {}
+    if snapshot.versions != get_versions('catalog', 'taxonomy'):
+        metrics.cache_result('snapshot', 0, len(course_ids))
+        return {}
+    extra_data = {}
+    for course_id in course_ids:
+        course_extra_data = snapshot.get_extra_data(course_id, fields)
+        if course_extra_data is not None:
+            extra_data[str(course_id)] = course_extra_data
+    metrics.cache_result('snapshot', len(extra_data), len(course_ids) - len(extra_data))
+    return extra_data
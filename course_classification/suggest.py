@@ -0,0 +1,172 @@
+# -*- coding:utf-8 -*-
+"""
+Per process prefix index for the type-ahead suggestions of the discovery search box.
+
+The index is a sorted array of normalized terms searched with bisect, the best ranked entries of the prefix range
+are selected with a bounded heap. Each process keeps its own copy,
+when the catalog or taxonomy versions (see invalidation) change the next suggestion of each process updates
+only the courses of the catalog change log since its last update (and the small taxonomy lists).
+"""
+# Python Standard Libraries
+from bisect import bisect_left
+import heapq
+import logging
+import threading
+import unicodedata
+
+# Edx dependencies
+from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
+
+# Internal project dependencies
+from .helpers import is_catalog_change_pruned
+from .invalidation import get_versions
+from .models import MainCourseClassification, CourseCategory, CourseCatalogChange
+
+log = logging.getLogger(__name__)
+# Suggestion types in order of priority
+SUGGEST_TYPES = ('classification', 'category', 'course')
+# Upper bound of the terms starting with a prefix
+MAX_CHARACTER = '\U0010ffff'
+
+
+def normalize_term(value):
+    """
+    Lowercase the value and remove accents, e.g. 'Introducción' -> 'introduccion'
+    """
+    value = unicodedata.normalize('NFKD', value or '')
+    return ''.join(x for x in value if not unicodedata.combining(x)).lower().strip()
+
+
+def get_terms(label):
+    """
+    Return the normalized label and its suffixes starting at each word, so any word can be used as prefix
+    e.g. 'Introducción a Python' -> ['introduccion a python', 'a python', 'python']
+    """
+    words = normalize_term(label).split()
+    return [' '.join(words[position:]) for position in range(len(words))]
+
+
+class SuggestIndex(object):
+    """
+    Sorted array of (term, word match, type priority, label length, suggestion) for the courses visible in the catalog,
+    the active main classifications and the visible course categories
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.last_change_id = 0
+        self.course_entries = {}
+        self.taxonomy_entries = []
+        # (keys, entries) replaced at once, so the suggestions never see a partial update
+        self.sorted_entries = ([], [])
+
+    @staticmethod
+    def get_entries(suggestion_type, value, label, extra_labels=()):
+        priority = SUGGEST_TYPES.index(suggestion_type)
+        suggestion = {'type': suggestion_type, 'id': value, 'label': label}
+        entries = []
+        for position, text in enumerate((label,) + tuple(extra_labels)):
+            for index, term in enumerate(get_terms(text)):
+                # Prefixes of the whole label rank before prefixes of other words
+                entries.append((term, int(index > 0 or position > 0), priority, len(label), suggestion))
+        return entries
+
+    def get_course_entries(self, course_overviews):
+        return {
+            str(x.id): self.get_entries('course', str(x.id), x.display_name or str(x.id), [x.display_number_with_default or ''])
+            for x in course_overviews
+        }
+
+    def get_taxonomy_entries(self):
+        entries = []
+        for x in MainCourseClassification.objects.filter(is_active=True, visibility__in=[1, 2]):
+            entries.extend(self.get_entries('classification', x.id, x.name))
+        for x in CourseCategory.objects.filter(show_opt__in=[1, 2]):
+            entries.extend(self.get_entries('category', x.id, x.name))
+        return entries
+
+    def sort_entries(self):
+        entries = list(self.taxonomy_entries)
+        for course_entries in self.course_entries.values():
+            entries.extend(course_entries)
+        entries.sort(key=lambda entry: entry[:4])
+        self.sorted_entries = ([entry[0] for entry in entries], entries)
+
+    def load(self, version):
+        """
+        Build the whole index
+        """
+        last_change = CourseCatalogChange.objects.order_by('-id').values_list('id', flat=True).first()
+        self.course_entries = self.get_course_entries(CourseOverview.objects.filter(catalog_visibility="both"))
+        self.taxonomy_entries = self.get_taxonomy_entries()
+        self.last_change_id = last_change or 0
+        self.version = version
+        self.sort_entries()
+
+    def update(self, version):
+        """
+        Update the courses of the catalog change log since the last update and the taxonomy
+        """
+        changes = list(CourseCatalogChange.objects.filter(id__gt=self.last_change_id).values_list('id', 'course_id'))
+        course_ids = {x[1] for x in changes}
+        for course_id in course_ids:
+            self.course_entries.pop(str(course_id), None)
+        self.course_entries.update(
+            self.get_course_entries(CourseOverview.objects.filter(id__in=course_ids, catalog_visibility="both"))
+        )
+        self.taxonomy_entries = self.get_taxonomy_entries()
+        if changes:
+            self.last_change_id = changes[-1][0]
+        self.version = version
+        self.sort_entries()
+
+    def refresh(self):
+        """
+        Load or update the index if the catalog or taxonomy versions changed
+        """
+        version = tuple(get_versions('catalog', 'taxonomy'))
+        if version == self.version:
+            return
+        with self.lock:
+            if self.version is None or is_catalog_change_pruned(self.last_change_id):
+                self.load(version)
+            elif version != self.version:
+                self.update(version)
+
+    def suggest(self, term, limit=8):
+        """
+        Return the suggestions whose label or any of its words start with the term, ranked by
+        whole label match, type (classification, category, course) and label length
+        """
+        prefix = ' '.join(normalize_term(term).split())
+        if not prefix:
+            return []
+        keys, entries = self.sorted_entries
+        matches = range(bisect_left(keys, prefix), bisect_left(keys, prefix + MAX_CHARACTER))
+        # A suggestion can have several entries (e.g. its label and its words), more entries are ranked if the
+        # best ones have less than limit different suggestions
+        size = limit * len(SUGGEST_TYPES)
+        while True:
+            suggestions = []
+            seen = set()
+            for position in heapq.nsmallest(size, matches, key=lambda position: entries[position][1:4]):
+                suggestion = entries[position][4]
+                if (suggestion['type'], suggestion['id']) not in seen:
+                    seen.add((suggestion['type'], suggestion['id']))
+                    suggestions.append(suggestion)
+                    if len(suggestions) == limit:
+                        return suggestions
+            if size >= len(matches):
+                return suggestions
+            size *= 2
+
+
+suggest_index = SuggestIndex()
+
+
+def get_suggestions(term, limit=8):
+    """
+    Return the suggestions of the per process index for the search box term
+    """
+    suggest_index.refresh()
+    return suggest_index.suggest(term, limit)
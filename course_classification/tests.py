@@ -1,24 +1,41 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 # Python Standard Libraries
-from datetime import datetime
+from datetime import datetime, timedelta
+from io import StringIO
 import copy
+import itertools
 import json
+import os
+import tempfile
+import threading
+import time
+import unittest
 import urllib.parse
+import zipfile
 
 # Installed packages (via pip)
+from django.contrib import admin
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.http import HttpResponseRedirect
-from django.test import Client
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connections, transaction
+from django.db.utils import ConnectionRouter
+from django.http import Http404, HttpResponseRedirect, QueryDict
+from django.test import Client, RequestFactory, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
 from django.test.utils import override_settings
 from django.urls import reverse
-from django.utils import timezone
+from django.utils import timezone, translation
 from mock import patch, MagicMock
-from search.api import NoSearchEngineError
+from search.api import NoSearchEngineError, QueryParseError
 from search.elastic import ElasticSearchEngine
 from search.tests.utils import SearcherMixin, TEST_INDEX_NAME
+from search.utils import DateRange
 
 # Edx dependencies
+from common.djangoapps.student.models import CourseEnrollment
 from common.djangoapps.student.tests.factories import UserFactory, CourseEnrollmentFactory
 from openedx.core.djangoapps.content.course_overviews.models import CourseOverview
 from xmodule.modulestore.tests.django_utils import ModuleStoreTestCase
@@ -26,10 +43,14 @@ from xmodule.modulestore.tests.factories import CourseFactory
 from opaque_keys.edx.keys import CourseKey, UsageKey
 
 # Internal project dependencies
-from . import utils, helpers
-from .models import MainCourseClassification, CourseClassification, MainCourseClassificationTemplate, CourseCategory
+from . import api, card_cache, course_state, discovery_cache, fallback, invalidation, loadtest, metrics, popularity, profiling, snapshot, suggest, utils, helpers
+from .admin import CourseClassificationAdmin
+from .models import MainCourseClassification, CourseClassification, MainCourseClassificationTemplate, CourseCategory, CourseCatalogChange, CourseEnrollmentCount
 from .views import CourseClassificationView, course_discovery_eol
 from .api import course_discovery_search_eol
+from .fallback import search_with_fallback
+from .results import CourseExtraData, DiscoveryResult, dumps_discovery_json, get_discovery_fields, project_result
+from .routers import CourseClassificationRouter, ReplicaPin, REPLICA_PIN_CACHE_KEY, get_read_database
 
 class TestRequest(object):
     # pylint: disable=too-few-public-methods
@@ -40,7 +61,17 @@ class TestRequest(object):
     body = None
     success = None
     COOKIES = {}
-    POST = {}
+    _post = {}
+
+    @property
+    def POST(self):
+        return self._post
+
+    @POST.setter
+    def POST(self, data):
+        # Like the requests, the views read the lists of values
+        self._post = QueryDict(mutable=True)
+        self._post.update(data)
 
 class TestCourseClassification(ModuleStoreTestCase):
     def setUp(self):
@@ -263,6 +294,60 @@ class TestCourseClassification(ModuleStoreTestCase):
         self.assertEqual(len(response), 2)
         self.assertEqual(response, expected)
 
+    def test_helpers_get_catalog_taxonomy(self):
+        """
+            Test get_catalog_taxonomy() returns the same values of the separate helpers
+        """
+        mcc1 = MainCourseClassification(
+            name="MCC1",
+            logo=SimpleUploadedFile(
+                "test.png",
+                b"test"
+            ),
+            sequence=2,
+            visibility=2,
+            is_active=True
+            )
+        mcc1.save()
+        mcc2 = MainCourseClassification(
+            name="MCC2",
+            logo=SimpleUploadedFile(
+                "test2.png",
+                b"test2"
+            ),
+            sequence=1,
+            visibility=0,
+            is_active=True
+            )
+        mcc2.save()
+        MainCourseClassificationTemplate(
+            main_classification=mcc1,
+            template="hello world",
+            language="en"
+        ).save()
+        cc1 = CourseCategory(
+            name="CC1",
+            sequence=1,
+            show_opt=2
+            )
+        cc1.save()
+        cc2 = CourseCategory(
+            name="CC2",
+            sequence=2,
+            show_opt=1
+            )
+        cc2.save()
+        classification1 = CourseClassification.objects.create(course_id=self.course.id, MainClass=mcc1)
+        classification2 = CourseClassification.objects.create(course_id=self.course3.id, MainClass=mcc2)
+        classification1.course_category.add(cc1)
+        classification2.course_category.add(cc2)
+        response = helpers.get_catalog_taxonomy()
+        self.assertEqual(response['logos'], helpers.get_all_logos())
+        self.assertEqual(response['main_classifications'], helpers.get_all_main_classifications())
+        self.assertEqual(response['main_classifications'], [[mcc1.id, "MCC1"]])
+        self.assertEqual(response['course_categories'], helpers.get_all_course_categories())
+        self.assertEqual(response['course_categories'], [[cc1.id, "CC1"]])
+
     def test_helpers_get_courses_by_category(self):
         """
             Test get_courses_by_category() normal process
@@ -335,6 +420,37 @@ class TestCourseClassification(ModuleStoreTestCase):
         response = helpers.get_courses_by_classification(999)
         self.assertEqual(response, [])
     
+    def test_get_classified_courses(self):
+        """
+            Test the classification and category filters with lists of ids and any/all matches
+        """
+        mcc1 = MainCourseClassification.objects.create(name="MCC1", sequence=1, visibility=2, is_active=True)
+        mcc2 = MainCourseClassification.objects.create(name="MCC2", sequence=2, visibility=2, is_active=True)
+        cc1 = CourseCategory.objects.create(name="CC1", sequence=1, show_opt=2)
+        cc2 = CourseCategory.objects.create(name="CC2", sequence=2, show_opt=2)
+        CourseClassification.objects.create(course_id=self.course.id, MainClass=mcc1).course_category.add(cc1, cc2)
+        CourseClassification.objects.create(course_id=self.course2.id, MainClass=mcc2).course_category.add(cc1)
+        CourseClassification.objects.create(course_id=self.course3.id, MainClass=mcc2)
+
+        def get_courses(*args):
+            return sorted(str(x['course_id']) for x in helpers.get_classified_courses(*args))
+        self.assertEqual(get_courses([mcc1.id, mcc2.id]), sorted([str(self.course.id), str(self.course2.id), str(self.course3.id)]))
+        self.assertEqual(get_courses([mcc1.id, mcc2.id], [cc1.id, cc2.id]), sorted([str(self.course.id), str(self.course2.id)]))
+        self.assertEqual(get_courses([], [cc1.id, cc2.id], 'any', 'all'), [str(self.course.id)])
+        self.assertEqual(get_courses([mcc2.id], [cc1.id, cc2.id], 'any', 'all'), [])
+        self.assertEqual(get_courses([mcc1.id, mcc2.id], [], 'all'), [])
+        with self.assertRaises(ValueError):
+            helpers.get_classified_courses([mcc1.id], [], 'some')
+        self.assertEqual(helpers.parse_filter_ids(' 3,1, 3'), [1, 3])
+        self.assertEqual(helpers.parse_filter_ids(['2', '1,4']), [1, 2, 4])
+        self.assertEqual(helpers.parse_filter_ids(5), [5])
+        with self.assertRaises(ValueError):
+            helpers.parse_filter_ids('1,a')
+        self.assertEqual(
+            discovery_cache.get_discovery_params(classification='3, 1', category=[2])['classification'],
+            discovery_cache.get_discovery_params(classification=[1, 3], category='2')['classification']
+        )
+
     def test_set_data_courses(self):
         """
             test set data course normal process
@@ -376,7 +492,22 @@ class TestCourseClassification(ModuleStoreTestCase):
                         'id': str(self.course3.id),
                         'start': str(self.course3.start_date)
                     }}])
+        # courses with the same state are sorted by the proximity of the start date to today
         expected = [
+            {'id':str(self.course3.id),'start': str(self.course3.start_date), 
+             'time_left':helpers.set_time_left(datetime.fromisoformat(str(self.course3.start_date)), today),
+             'course_state': 'ongoing_enrollable',
+             'extra_data':{
+                                            'short_description' : None, 
+                                            'advertised_start' : None, 
+                                            'display_org_with_default' : 'MCC1',
+                                            'invitation_only': False,
+                                            'main_classification': None,
+                                            'effort': None,
+                                            'self_paced': False,
+                                            'price': 'Free'
+                                        }
+                                    },
             {'id':str(self.course.id), 'start': str(self.course.start_date),
              'time_left':helpers.set_time_left(datetime.fromisoformat(str(self.course.start_date)), today),
              'course_state': 'ongoing_enrollable',
@@ -412,23 +543,275 @@ class TestCourseClassification(ModuleStoreTestCase):
                                             'price': 'Free'
                                         }
                                     },
-            {'id':str(self.course3.id),'start': str(self.course3.start_date), 
-             'time_left':helpers.set_time_left(datetime.fromisoformat(str(self.course3.start_date)), today),
-             'course_state': 'ongoing_enrollable',
-             'extra_data':{
-                                            'short_description' : None, 
-                                            'advertised_start' : None, 
-                                            'display_org_with_default' : 'MCC1',
-                                            'invitation_only': False,
-                                            'main_classification': None,
-                                            'effort': None,
-                                            'self_paced': False,
-                                            'price': 'Free'
-                                        }
-                                    },
             ]
         self.assertEqual(response, expected)
 
+    def test_set_data_courses_extra_data_fields(self):
+        """
+            Test set_data_courses does not read the classifications and modes of the extra_data fields not requested
+        """
+        with patch('course_classification.helpers.get_course_modes_info') as mock_modes, \
+                patch('course_classification.helpers.CourseClassification.objects.filter') as mock_classifications:
+            response = helpers.set_data_courses([{'_id': str(self.course.id), 'data': {
+                'id': str(self.course.id),
+                'start': str(self.course.start_date)
+            }}], extra_data_fields=set())
+        self.assertFalse(mock_modes.called)
+        self.assertFalse(mock_classifications.called)
+        self.assertEqual(response[0]['course_state'], 'ongoing_enrollable')
+        self.assertEqual(response[0]['extra_data']['price'], None)
+
+    def test_course_card_fragments(self):
+        """
+            Test the course cards are rendered again only when the course data or the language change
+        """
+        cache.clear()
+        courses = [
+            {'id': str(self.course.id), 'course_state': 'ongoing_enrollable'},
+            {'id': str(self.course2.id), 'course_state': 'completed'}
+        ]
+        expected = ['<card {}>'.format(self.course.id), '<card {}>'.format(self.course2.id)]
+        with patch('course_classification.card_cache.render_to_string', side_effect=lambda template, context: '<card {}>'.format(context['course']['id'])) as mock_render:
+            self.assertEqual(card_cache.get_course_card_fragments(courses), expected)
+            self.assertEqual(card_cache.get_course_card_fragments(courses), expected)
+            self.assertEqual(mock_render.call_count, 2)
+            courses[1]['course_state'] = 'ongoing_enrollable'
+            self.assertEqual(card_cache.get_course_card_fragments(courses), expected)
+            self.assertEqual(mock_render.call_count, 3)
+            with translation.override('es-419'):
+                card_cache.get_course_card_fragments(courses)
+            self.assertEqual(mock_render.call_count, 5)
+
+    def test_invalidation_coalesced(self):
+        """
+            Test the versions invalidated in a transaction are written once after it commits
+        """
+        versions = invalidation.get_versions('catalog', 'taxonomy', 'popularity')
+        callbacks = []
+        with patch('course_classification.invalidation.transaction.on_commit', side_effect=callbacks.append):
+            for _ in range(500):
+                invalidation.invalidate('catalog')
+                invalidation.invalidate('popularity')
+        self.assertEqual(invalidation.get_versions('catalog', 'taxonomy', 'popularity'), versions)
+        with patch.object(invalidation.get_version_cache(), 'set_many', wraps=invalidation.get_version_cache().set_many) as mock_set_many:
+            for callback in callbacks:
+                callback()
+        self.assertEqual(mock_set_many.call_count, 1)
+        new_versions = invalidation.get_versions('catalog', 'taxonomy', 'popularity')
+        self.assertGreater(new_versions[0], versions[0])
+        self.assertEqual(new_versions[1], versions[1])
+        self.assertGreater(new_versions[2], versions[2])
+        with self.assertRaises(ValueError):
+            invalidation.invalidate('other')
+
+    def test_invalidation_rollback(self):
+        """
+            Test an invalidation after a rolled back transaction is written when its transaction commits
+        """
+        versions = invalidation.get_versions('catalog', 'taxonomy')
+        callbacks = []
+        with patch('course_classification.invalidation.transaction.on_commit', side_effect=callbacks.append):
+            # The callbacks of the rolled back transaction are discarded
+            invalidation.invalidate('catalog')
+            callbacks.clear()
+            invalidation.invalidate('taxonomy')
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        new_versions = invalidation.get_versions('catalog', 'taxonomy')
+        self.assertGreater(new_versions[1], versions[1])
+        self.assertIsNone(getattr(invalidation._pending, 'batch', None))
+
+    def test_invalidation_signals(self):
+        """
+            Test the admin changes invalidate the taxonomy and catalog versions
+        """
+        with patch('course_classification.invalidation.transaction.on_commit', side_effect=lambda func: func()):
+            versions = invalidation.get_versions('taxonomy', 'catalog')
+            mcc1 = MainCourseClassification(name="MCC1", sequence=1, visibility=2, is_active=True)
+            mcc1.save()
+            new_versions = invalidation.get_versions('taxonomy', 'catalog')
+            self.assertGreater(new_versions[0], versions[0])
+            self.assertGreater(new_versions[1], versions[1])
+            MainCourseClassificationTemplate(main_classification=mcc1, template="hello world", language="en").save()
+            versions = new_versions
+            new_versions = invalidation.get_versions('taxonomy', 'catalog')
+            self.assertGreater(new_versions[0], versions[0])
+            self.assertEqual(new_versions[1], versions[1])
+            CourseClassification.objects.create(course_id=self.course.id, MainClass=mcc1)
+            versions = new_versions
+            new_versions = invalidation.get_versions('taxonomy', 'catalog')
+            self.assertEqual(new_versions[0], versions[0])
+            self.assertGreater(new_versions[1], versions[1])
+
+    def test_course_classification_metrics(self):
+        """
+            Test the metrics endpoint exposes the discovery metrics to staff users or with the token
+        """
+        metrics.registry.clear()
+        with patch('course_classification.views.coalesced_discovery_search', return_value={'results': [], 'total': 0}):
+            result = self.client.post(reverse('course_classification:course_discovery_eol'), {'search_string': ''})
+        self.assertEqual(result.status_code, 200)
+        result = self.client.get(reverse('course_classification:course_classification_metrics'))
+        self.assertEqual(result.status_code, 200)
+        self.assertTrue(result['Content-Type'].startswith('text/plain; version=0.0.4'))
+        content = result.content.decode()
+        self.assertIn('course_classification_request_duration_seconds_count{endpoint="discovery"} 1', content)
+        self.assertIn('course_classification_sql_queries_total{endpoint="discovery"}', content)
+
+        result = self.student_client.get(reverse('course_classification:course_classification_metrics'))
+        self.assertEqual(result.status_code, 403)
+        with override_settings(COURSE_CLASSIFICATION_METRICS_TOKEN='secret'):
+            result = self.student_client.get(reverse('course_classification:course_classification_metrics'), HTTP_AUTHORIZATION='Bearer secret')
+            self.assertEqual(result.status_code, 200)
+            result = self.student_client.get(reverse('course_classification:course_classification_metrics'), HTTP_AUTHORIZATION='Bearer other')
+            self.assertEqual(result.status_code, 403)
+
+    def test_loadtest_discovery(self):
+        """
+            Test the load test sends the request mix through the WSGI application and reports each variant
+        """
+        mcc1 = MainCourseClassification.objects.create(name="MCC1", banner="banner.png", sequence=1, visibility=2, is_active=True)
+        MainCourseClassificationTemplate(main_classification=mcc1, template="hello world", language="en").save()
+        CourseCategory.objects.create(name="CC1", sequence=1, show_opt=2)
+        catalog = loadtest.get_existing_catalog()
+        self.assertEqual(catalog['institutions'], [mcc1.id])
+        variants = {'cache': {}, 'no_cache': {'COURSE_CLASSIFICATION_CARD_CACHE_TIMEOUT': 0}}
+        with patch('course_classification.views.coalesced_discovery_search', return_value={'results': [], 'total': 0}) as search:
+            rows = loadtest.run_load_test(catalog, requests=12, concurrency=1, variants=variants, warmup=2, host='testserver')
+        self.assertEqual(search.call_count, 2 * 14)
+        totals = [x for x in rows if x['kind'] == 'total']
+        self.assertEqual([x['variant'] for x in totals], ['cache', 'no_cache'])
+        for row in totals:
+            self.assertEqual(row['requests'], 12)
+            self.assertEqual(row['errors'], 0)
+            self.assertTrue(row['p50'] <= row['p95'] <= row['p99'])
+        self.assertEqual(sum(x['requests'] for x in rows if x['variant'] == 'cache' and x['kind'] != 'total'), 12)
+
+    def test_loadtest_generated_catalog(self):
+        """
+            Test the generated catalog needs --i-know-this-writes and is removed with its catalog changes
+        """
+        with self.assertRaises(CommandError):
+            call_command('loadtest_discovery', courses=2)
+        changes = CourseCatalogChange.objects.count()
+        catalog = loadtest.generate_catalog(3, institutions=1, categories=2)
+        self.assertEqual(CourseOverview.objects.filter(org=loadtest.LOAD_TEST_ORG).count(), 3)
+        self.assertGreater(CourseCatalogChange.objects.count(), changes)
+        loadtest.delete_catalog(catalog)
+        self.assertFalse(CourseOverview.objects.filter(org=loadtest.LOAD_TEST_ORG).exists())
+        self.assertEqual(CourseCatalogChange.objects.count(), changes)
+        with patch('course_classification.loadtest.get_course_modes_info', side_effect=ValueError('error')):
+            with self.assertRaises(ValueError):
+                loadtest.generate_catalog(2, institutions=1, categories=1)
+        self.assertFalse(CourseOverview.objects.filter(org=loadtest.LOAD_TEST_ORG).exists())
+        self.assertFalse(CourseCategory.objects.filter(name__startswith=loadtest.LOAD_TEST_ORG).exists())
+
+    def test_profile_discovery(self):
+        """
+            Test the sampled and the slow discovery requests are saved in the profiles ring buffer and downloaded by staff
+        """
+        with tempfile.TemporaryDirectory() as directory, patch('course_classification.views.coalesced_discovery_search', return_value={'results': [], 'total': 0}):
+            with override_settings(COURSE_CLASSIFICATION_PROFILE_DIR=directory, COURSE_CLASSIFICATION_PROFILE_SAMPLE_RATE=1.0):
+                result = self.client.post(reverse('course_classification:course_discovery_eol'), {'search_string': 'test', 'state': 'active'})
+            self.assertEqual(result.status_code, 200)
+            profiles = os.listdir(directory)
+            self.assertEqual(len(profiles), 1)
+            with zipfile.ZipFile(os.path.join(directory, profiles[0])) as profile_file:
+                self.assertEqual(sorted(profile_file.namelist()), ['profile.prof', 'request.json'])
+                request_data = json.loads(profile_file.read('request.json').decode())
+            self.assertEqual(request_data['endpoint'], 'discovery')
+            self.assertEqual(request_data['params']['POST'], {'search_string': ['test'], 'state': ['active']})
+            self.assertEqual(request_data['user_id'], self.user_staff.id)
+
+            with override_settings(COURSE_CLASSIFICATION_PROFILE_DIR=directory, COURSE_CLASSIFICATION_PROFILE_SLOW_SECONDS=0, COURSE_CLASSIFICATION_PROFILE_MAX_FILES=1):
+                self.client.post(reverse('course_classification:course_discovery_eol'), {'search_string': ''})
+                profiles = profiling.list_profiles()
+                self.assertEqual([x['kind'] for x in profiles], ['stacks'])
+                self.assertEqual(profiles[0]['endpoint'], 'discovery')
+                request = RequestFactory().get('/')
+                request.user = self.user_staff
+                response = CourseClassificationAdmin(CourseClassification, admin.site).profile_download_view(request, profiles[0]['name'])
+                self.assertEqual(response['Content-Type'], 'application/zip')
+                response.close()
+                with self.assertRaises(Http404):
+                    CourseClassificationAdmin(CourseClassification, admin.site).profile_download_view(request, '..')
+
+    def test_get_discovery_facets(self):
+        """
+            Test the facet counts by classification and category of the courses
+        """
+        mcc1 = MainCourseClassification.objects.create(name="MCC1", sequence=1, visibility=2, is_active=True)
+        mcc2 = MainCourseClassification.objects.create(name="MCC2", sequence=2, visibility=0, is_active=True)
+        cc1 = CourseCategory.objects.create(name="CC1", sequence=1, show_opt=2)
+        CourseClassification.objects.create(course_id=self.course.id, MainClass=mcc1).course_category.add(cc1)
+        CourseClassification.objects.create(course_id=self.course2.id, MainClass=mcc2).course_category.add(cc1)
+        with self.assertNumQueries(2):
+            facets = helpers.get_discovery_facets([str(self.course.id), str(self.course2.id)])
+        self.assertEqual(facets['classification'], {'terms': {str(mcc1.id): 1}, 'total': 1, 'other': 0})
+        self.assertEqual(facets['category'], {'terms': {str(cc1.id): 2}, 'total': 2, 'other': 0})
+        self.assertEqual(helpers.get_discovery_facets([])['classification'], {'terms': {}, 'total': 0, 'other': 0})
+
+    def test_get_date_facets(self):
+        """
+            Test the year and state counts from the start and end date facets of the search engine, without queries
+        """
+        past = datetime(2020, 3, 1, tzinfo=timezone.utc)
+        future = timezone.now() + timedelta(days=400)
+        start_facet = {'terms': {int(past.timestamp() * 1000): 3, future.isoformat(): 2}}
+        end_facet = {'terms': {int((past + timedelta(days=90)).timestamp() * 1000): 1}}
+        with self.assertNumQueries(0):
+            facets = helpers.get_date_facets(start_facet, end_facet)
+        self.assertEqual(facets['year'], {'terms': {str(future.year): 2, '2020': 3}, 'total': 5, 'other': 0})
+        self.assertEqual(facets['state'], {'terms': {'active': 2, 'finished': 1, 'coming_soon': 2}, 'total': 5, 'other': 0})
+        self.assertEqual(helpers.get_date_facets(None, None)['year'], {'terms': {}, 'total': 0, 'other': 0})
+
+    def test_course_discovery_multi_search(self):
+        """
+            Test the searches are enriched in one batch and returned in the order of the queries
+        """
+        def get_hit(course):
+            return {'_id': str(course.id), 'data': {'id': str(course.id), 'start': '2023-03-01T00:00:00+00:00'}}
+        engine_results = [
+            {'results': [get_hit(self.course)], 'total': 1},
+            ValueError('Invalid cursor value'),
+            {'results': [get_hit(self.course), get_hit(self.course2)], 'total': 2},
+        ]
+        queries = [{'featured': True}, {'cursor': 'x'}, {'fields': ('id', 'extra_data.price')}]
+        with patch('course_classification.api.search_discovery_engine', side_effect=engine_results), \
+                patch('course_classification.helpers.get_courses_extra_data', wraps=helpers.get_courses_extra_data) as mock_extra_data:
+            responses = api.course_discovery_multi_search_eol(queries)
+        self.assertEqual(mock_extra_data.call_count, 1)
+        self.assertEqual(len(mock_extra_data.call_args[0][0]), 2)
+        self.assertEqual([x['id'] for x in responses[0]['results']], [str(self.course.id)])
+        self.assertEqual(responses[0]['results'][0]['extra_data']['display_org_with_default'], 'MCC1')
+        self.assertIn('Invalid cursor value', responses[1]['error'])
+        self.assertEqual(
+            sorted(responses[2]['results'], key=lambda x: x['id']),
+            sorted([{'id': str(x.id), 'extra_data': {'price': 'Free'}} for x in (self.course, self.course2)], key=lambda x: x['id'])
+        )
+
+    def test_course_discovery_multi_search_view(self):
+        """
+            Test the multi search endpoint reads the queries of the JSON body with the params of the discovery search
+        """
+        url = reverse('course_classification:course_discovery_multi_search')
+        body = {'queries': [{'search_string': 'test', 'page_size': 8, 'page_index': 1, 'classification': [1, 2]}, {'fields': 'card'}]}
+        with patch('course_classification.discovery_cache.course_discovery_multi_search_eol', return_value=[{'results': []}, {'results': []}]) as mock_search:
+            result = self.client.post(url, json.dumps(body), content_type='application/json')
+        self.assertEqual(result.status_code, 200)
+        self.assertEqual(json.loads(result.content.decode()), {'responses': [{'results': []}, {'results': []}]})
+        queries = mock_search.call_args[0][0]
+        self.assertEqual((queries[0]['search_term'], queries[0]['size'], queries[0]['from_'], queries[0]['classification']), ('test', 8, 8, [1, 2]))
+        self.assertEqual(queries[1]['fields'], get_discovery_fields('card'))
+
+        invalid_queries = (
+            {'queries': []}, {'queries': [{'other': 1}]}, {'queries': [{}] * 11}, [], {'queries': [{'page_size': 'x'}]},
+            {'queries': [{'page_size': 0}]}, {'queries': [{'page_size': 101}]}, {'queries': [{'page_index': -1}]},
+        )
+        for invalid in invalid_queries:
+            result = self.client.post(url, json.dumps(invalid), content_type='application/json')
+            self.assertEqual(result.status_code, 400)
+
     def test_set_data_courses_no_courses(self):
         """
             test set data courses when course id from elasticsearch doesn't exists in course overviews.
@@ -581,6 +964,424 @@ class TestCourseClassification(ModuleStoreTestCase):
         self.assertEqual(result.status_code, 302)
         self.assertEqual(request.path, '/')
 
+    def test_course_catalog_export(self):
+        """
+            Test catalog export in jsonl and csv format
+        """
+        mcc1 = MainCourseClassification(
+            name="MCC1",
+            sequence=1,
+            visibility=2,
+            is_active=True
+            )
+        mcc1.save()
+        cc1 = CourseCategory(
+            name="CC1",
+            sequence=1,
+            show_opt=2
+            )
+        cc1.save()
+        classification = CourseClassification.objects.create(course_id=self.course.id, MainClass=mcc1, is_featured_course=True)
+        classification.course_category.add(cc1)
+        result = self.client.get(reverse('course_classification:course_catalog_export'))
+        self.assertEqual(result.status_code, 200)
+        rows = [json.loads(x) for x in b''.join(result.streaming_content).decode().splitlines()]
+        self.assertEqual(len(rows), 2)
+        rows = {x['id']: x for x in rows}
+        self.assertEqual(rows[str(self.course.id)]['main_classification'], 'MCC1')
+        self.assertEqual(rows[str(self.course.id)]['categories'], ['CC1'])
+        self.assertEqual(rows[str(self.course.id)]['price'], 'Free')
+        self.assertTrue(rows[str(self.course.id)]['is_featured_course'])
+        self.assertEqual(rows[str(self.course2.id)]['main_classification'], None)
+        self.assertEqual(rows[str(self.course2.id)]['categories'], [])
+        self.assertFalse(str(self.course3.id) in rows)
+
+        result = self.client.get(reverse('course_classification:course_catalog_export'), {'export_format': 'csv'})
+        self.assertEqual(result.status_code, 200)
+        lines = b''.join(result.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(lines[0], ','.join(helpers.CATALOG_EXPORT_FIELDS))
+
+        result = self.client.get(reverse('course_classification:course_catalog_export'), {'export_format': 'xml'})
+        self.assertEqual(result.status_code, 400)
+
+    def test_course_catalog_export_student(self):
+        """
+            Test catalog export is only available to staff users
+        """
+        result = self.student_client.get(reverse('course_classification:course_catalog_export'))
+        self.assertEqual(result.status_code, 403)
+
+    def test_export_course_catalog_command(self):
+        """
+            Test export_course_catalog command with chunks smaller than the catalog
+        """
+        out = StringIO()
+        call_command('export_course_catalog', '--chunk-size', '1', stdout=out)
+        rows = [json.loads(x) for x in out.getvalue().splitlines()]
+        self.assertEqual(sorted(x['id'] for x in rows), sorted([str(self.course.id), str(self.course2.id)]))
+
+    def test_course_catalog_changes(self):
+        """
+            Test catalog change feed returns upserts and deletions since the token
+        """
+        result = self.client.get(reverse('course_classification:course_catalog_changes'))
+        self.assertEqual(result.status_code, 200)
+        since = json.loads(result.content.decode())['next_since']
+        mcc1 = MainCourseClassification(
+            name="MCC1",
+            sequence=1,
+            visibility=2,
+            is_active=True
+            )
+        mcc1.save()
+        classification = CourseClassification.objects.create(course_id=self.course.id, MainClass=mcc1)
+        CourseClassification.objects.create(course_id=self.course3.id, MainClass=mcc1)
+        result = self.client.get(reverse('course_classification:course_catalog_changes'), {'since': since})
+        response = json.loads(result.content.decode())
+        self.assertEqual([x['id'] for x in response['upserts']], [str(self.course.id)])
+        self.assertEqual(response['upserts'][0]['main_classification'], 'MCC1')
+        self.assertEqual(response['deletions'], [str(self.course3.id)])
+        self.assertFalse(response['has_more'])
+
+        # category changes are logged for its courses
+        since = response['next_since']
+        cc1 = CourseCategory(
+            name="CC1",
+            sequence=1,
+            show_opt=2
+            )
+        cc1.save()
+        classification.course_category.add(cc1)
+        response = helpers.get_catalog_changes(since, 1)
+        self.assertEqual([x['id'] for x in response['upserts']], [str(self.course.id)])
+        self.assertEqual(response['upserts'][0]['categories'], ['CC1'])
+        response = helpers.get_catalog_changes(response['next_since'])
+        self.assertEqual(response['upserts'], [])
+        self.assertEqual(response['deletions'], [])
+
+        result = self.client.get(reverse('course_classification:course_catalog_changes'), {'since': 'yesterday'})
+        self.assertEqual(result.status_code, 400)
+        result = self.student_client.get(reverse('course_classification:course_catalog_changes'))
+        self.assertEqual(result.status_code, 403)
+
+    def test_prune_catalog_changes(self):
+        """
+            Test the old catalog changes are removed, keeping the last one, and the feed asks for a resync
+            when since is older than the kept changes
+        """
+        since = helpers.get_catalog_changes()['next_since']
+        for course in (self.course, self.course2, self.course3):
+            CourseClassification.objects.create(course_id=course.id)
+        last_change = CourseCatalogChange.objects.order_by('-id').first()
+        CourseCatalogChange.objects.update(created=timezone.now() - timedelta(days=40))
+        with override_settings(COURSE_CLASSIFICATION_CHANGES_RETENTION_DAYS=30):
+            call_command('prune_catalog_changes', chunk_size=1)
+            self.assertEqual(list(CourseCatalogChange.objects.all()), [last_change])
+            response = helpers.get_catalog_changes(since)
+            self.assertTrue(response['resync'])
+            self.assertEqual(response['next_since'], str(last_change.id))
+            self.assertEqual(response['upserts'], [])
+            response = helpers.get_catalog_changes(str(last_change.id - 1))
+            self.assertFalse(response['resync'])
+            self.assertEqual(response['deletions'], [str(last_change.course_id)])
+            response = helpers.get_catalog_changes((timezone.now() - timedelta(days=31)).isoformat())
+            self.assertTrue(response['resync'])
+        with override_settings(COURSE_CLASSIFICATION_CHANGES_RETENTION_DAYS=None):
+            with self.assertRaises(CommandError):
+                call_command('prune_catalog_changes')
+
+    def test_featured_courses(self):
+        """
+            Test featured courses are precomputed and rebuilt when the featured flag changes
+        """
+        mcc1 = MainCourseClassification(
+            name="MCC1",
+            sequence=1,
+            visibility=2,
+            is_active=True
+            )
+        mcc1.save()
+        with patch('course_classification.helpers.transaction.on_commit', side_effect=lambda func: func()):
+            classification = CourseClassification.objects.create(course_id=self.course.id, MainClass=mcc1, is_featured_course=True)
+            CourseClassification.objects.create(course_id=self.course3.id, MainClass=mcc1, is_featured_course=True)
+            result = self.client.get(reverse('course_classification:course_featured_courses'))
+            self.assertEqual(result.status_code, 200)
+            response = json.loads(result.content.decode())
+            self.assertEqual(response['total'], 1)
+            self.assertEqual(response['results'][0]['id'], str(self.course.id))
+            self.assertEqual(response['results'][0]['course_state'], 'ongoing_enrollable')
+            self.assertEqual(response['results'][0]['extra_data']['main_classification'], {'name': 'MCC1', 'logo': ''})
+            self.assertEqual(response['results'][0]['extra_data']['price'], 'Free')
+            # the precomputed courses are served without queries
+            with self.assertNumQueries(0):
+                self.assertEqual(len(helpers.get_featured_courses()), 1)
+            # course2 is now featured
+            CourseClassification.objects.create(course_id=self.course2.id, MainClass=mcc1, is_featured_course=True)
+            self.assertEqual(len(utils.get_course_ctgs()), 2)
+            classification.is_featured_course = False
+            classification.save()
+            self.assertEqual([x['id'] for x in helpers.get_featured_courses()], [str(self.course2.id)])
+            # each language has its own cards, with the translated prices, rebuilt after a change
+            with translation.override('es-419'):
+                self.assertEqual([x['id'] for x in helpers.get_featured_courses()], [str(self.course2.id)])
+                self.assertIsNotNone(cache.get(helpers.get_featured_courses_cache_key('es-419')))
+            classification.is_featured_course = True
+            classification.save()
+            with translation.override('es-419'), self.assertNumQueries(0):
+                self.assertEqual(len(helpers.get_featured_courses()), 2)
+
+    def test_course_cards(self):
+        """
+            Test course cards of a list of course ids with per course errors
+        """
+        mcc1 = MainCourseClassification(
+            name="MCC1",
+            sequence=1,
+            visibility=2,
+            is_active=True
+            )
+        mcc1.save()
+        CourseClassification.objects.create(course_id=self.course2.id, MainClass=mcc1)
+        course_ids = '{},{},invalid-key,course-v1:eol+Test+2023,{}'.format(self.course2.id, self.course.id, self.course3.id)
+        result = self.client.post(reverse('course_classification:course_cards'), {'course_ids': course_ids})
+        self.assertEqual(result.status_code, 200)
+        response = json.loads(result.content.decode())
+        self.assertEqual([x['id'] for x in response['results']], [str(self.course2.id), str(self.course.id)])
+        self.assertEqual(response['results'][0]['extra_data']['main_classification'], {'name': 'MCC1', 'logo': ''})
+        self.assertEqual(response['results'][0]['course_state'], 'ongoing_enrollable')
+        self.assertEqual(response['results'][1]['extra_data']['main_classification'], None)
+        # course3 is not visible in the catalog
+        self.assertEqual(response['errors'], {
+            'invalid-key': 'Invalid course key',
+            'course-v1:eol+Test+2023': 'Course not found',
+            str(self.course3.id): 'Course not found'
+        })
+
+        result = self.client.post(reverse('course_classification:course_cards'), {})
+        self.assertEqual(result.status_code, 400)
+        with override_settings(COURSE_CLASSIFICATION_BATCH_MAX_COURSES=1):
+            result = self.client.post(reverse('course_classification:course_cards'), {'course_ids': course_ids})
+            self.assertEqual(result.status_code, 400)
+
+    def test_catalog_snapshot(self):
+        """
+            Test the extra_data is read from the catalog snapshot without queries until the catalog changes
+        """
+        mcc1 = MainCourseClassification(
+            name="MCC1",
+            sequence=1,
+            visibility=2,
+            is_active=True
+            )
+        mcc1.save()
+        classification = CourseClassification.objects.create(course_id=self.course.id, MainClass=mcc1)
+        hits = [{'_id': str(x.id), 'data': {'id': str(x.id), 'start': '2023-03-01T00:00:00+00:00'}} for x in (self.course, self.course2)]
+        expected = helpers.get_courses_extra_data([self.course, self.course2])
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(COURSE_CLASSIFICATION_SNAPSHOT_PATH=os.path.join(directory, 'catalog.snapshot'), COURSE_CLASSIFICATION_SNAPSHOT_CHECK_INTERVAL=0), \
+                patch('course_classification.snapshot.snapshot_holder', snapshot.SnapshotHolder()), \
+                patch('course_classification.invalidation.transaction.on_commit', side_effect=lambda func: func()):
+            self.assertEqual(helpers.get_courses_extra_data_by_id([str(self.course.id)]), {str(self.course.id): expected[str(self.course.id)]})
+            call_command('build_catalog_snapshot')
+            catalog_snapshot = snapshot.get_catalog_snapshot()
+            self.assertEqual(len(catalog_snapshot), CourseOverview.objects.filter(catalog_visibility="both").count())
+            self.assertEqual(catalog_snapshot.get_course(self.course.id)['main_classification'], {'id': mcc1.id, 'name': 'MCC1', 'logo': ''})
+            self.assertEqual(catalog_snapshot.get_course(self.course.id)['start'], self.course.start)
+            self.assertIsNone(catalog_snapshot.get_course('course-v1:eol+Test+2023'))
+            self.assertEqual(snapshot.get_snapshot_extra_data([str(self.course.id), str(self.course2.id)]), expected)
+            with self.assertNumQueries(0):
+                self.assertEqual([x['id'] for x in helpers.set_data_courses(hits)], [str(self.course.id), str(self.course2.id)])
+            # the catalog changed after the snapshot, the database is read until the next build
+            classification.MainClass = None
+            classification.save()
+            self.assertEqual(snapshot.get_snapshot_extra_data([str(self.course.id)]), {})
+            self.assertIsNone(helpers.get_courses_extra_data_by_id([str(self.course.id)])[str(self.course.id)]['main_classification'])
+
+    def test_catalog_snapshot_unsorted_rows(self):
+        """
+            Test the snapshot is written from a stream of rows and the binary search finds the courses when the
+            rows are not in the UTF-8 order of the ids (e.g. a case insensitive collation of the database)
+        """
+        course_ids = ['course-v1:eol+A+2023', 'course-v1:UChile+B+2023', 'course-v1:eol+C+2023', 'course-v1:Ñuble+D+2023']
+        def get_rows():
+            for position, course_id in enumerate(course_ids):
+                yield {
+                    'id': course_id, 'start': datetime(2023, 3, 1, tzinfo=timezone.utc), 'end': None, 'enrollment_start': None,
+                    'enrollment_end': None, 'short_description': 'Course {}'.format(position), 'advertised_start': None,
+                    'display_org_with_default': 'eol', 'invitation_only': False, 'effort': None, 'self_paced': True,
+                    'main_classification': {'id': 7, 'name': 'MCC', 'logo': ''} if position % 2 else None,
+                    'categories': list(range(position)), 'is_free': False, 'price': None,
+                }
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'catalog.snapshot')
+            self.assertEqual(snapshot.write_catalog_snapshot(path, get_rows(), [1, 2]), 4)
+            catalog_snapshot = snapshot.CatalogSnapshot(path)
+            self.assertEqual(catalog_snapshot.versions, [1, 2])
+            for position, course_id in enumerate(course_ids):
+                course = catalog_snapshot.get_course(course_id)
+                self.assertEqual(course['short_description'], 'Course {}'.format(position))
+                self.assertEqual(course['categories'], list(range(position)))
+                self.assertEqual(course['main_classification'], {'id': 7, 'name': 'MCC', 'logo': ''} if position % 2 else None)
+            self.assertIsNone(catalog_snapshot.get_course('course-v1:eol+B+2023'))
+            self.assertEqual(os.listdir(directory), ['catalog.snapshot'])
+
+    def test_enrollment_counts(self):
+        """
+            Test the enrollment counts are updated by the enrollments, reconciled in batches and ranked by the command
+        """
+        def get_count(course_id):
+            return CourseEnrollmentCount.objects.get(course_id=course_id)
+        with patch('course_classification.invalidation.transaction.on_commit', side_effect=lambda func: func()):
+            call_command('reconcile_enrollment_counts', chunk_size=2)
+            self.assertEqual([get_count(x.id).count for x in (self.course, self.course2, self.course3)], [1, 1, 0])
+            # the ties by course id
+            self.assertEqual([get_count(x.id).rank for x in (self.course, self.course2, self.course3)], [2, 1, 3])
+            CourseEnrollment.enroll(self.user_staff, self.course.id)
+            self.assertEqual(get_count(self.course.id).count, 2)
+            self.assertEqual(get_count(self.course.id).rank, 2)
+            call_command('reconcile_enrollment_counts', ranks_only=True)
+            self.assertEqual(get_count(self.course.id).rank, 1)
+            self.assertEqual(
+                popularity.sort_by_popularity(['course-v1:eol+Test+2023', str(self.course2.id), str(self.course.id)]),
+                [str(self.course.id), str(self.course2.id), 'course-v1:eol+Test+2023']
+            )
+            CourseEnrollment.unenroll(self.user_staff, self.course.id)
+            self.assertEqual(get_count(self.course.id).count, 1)
+            CourseEnrollmentCount.objects.filter(course_id=self.course2.id).update(count=10)
+            call_command('reconcile_enrollment_counts')
+            self.assertEqual(get_count(self.course2.id).count, 1)
+            # the ranks did not change
+            versions = invalidation.get_versions('popularity')
+            self.assertEqual(popularity.update_popularity_ranks(), 0)
+            self.assertEqual(invalidation.get_versions('popularity'), versions)
+
+    def test_reconcile_concurrent_enrollment(self):
+        """
+            Test an enrollment during the reconcile of its course is not lost
+        """
+        call_command('reconcile_enrollment_counts', chunk_size=5)
+        CourseEnrollmentCount.objects.filter(course_id=self.course2.id).update(count=10)
+        count_enrollments = CourseEnrollment.objects.filter
+        enrolled = []
+
+        def enroll_and_count(*args, **kwargs):
+            # The enrollment of other request (with its signal), after the materialized counts are read
+            if not enrolled:
+                enrolled.append(True)
+                CourseEnrollment.enroll(self.user_staff, self.course2.id)
+            return count_enrollments(*args, **kwargs)
+        with patch('course_classification.popularity.CourseEnrollment.objects.filter', side_effect=enroll_and_count):
+            popularity.reconcile_enrollment_counts()
+        self.assertTrue(enrolled)
+        # the active enrollment and the concurrent one, counted once
+        self.assertEqual(CourseEnrollment.objects.filter(course_id=self.course2.id, is_active=True).count(), 2)
+        self.assertEqual(CourseEnrollmentCount.objects.get(course_id=self.course2.id).count, 2)
+
+    def test_course_discovery_popular(self):
+        """
+            Test the popular order requests the page of the matching courses sorted by rank by id
+        """
+        CourseEnrollmentCount.objects.create(course_id=self.course.id, count=5, rank=1)
+        CourseEnrollmentCount.objects.create(course_id=self.course2.id, count=1, rank=2)
+        def get_hit(course):
+            return {'_id': str(course.id), 'data': {'id': str(course.id), 'start': '2023-03-01T00:00:00+00:00'}}
+        engine_results = [
+            {'total': 2, 'results': [], 'facets': {'id': {'terms': {str(self.course2.id): 1, str(self.course.id): 1}}}},
+            {'total': 1, 'results': [get_hit(self.course2)]},
+        ]
+        with patch('course_classification.invalidation.transaction.on_commit', side_effect=lambda func: func()):
+            invalidation.invalidate('popularity')
+        with patch('course_classification.api.search_with_fallback', side_effect=engine_results) as mock_search:
+            results = course_discovery_search_eol(size=1, order_by='popular', cursor=helpers.encode_discovery_cursor({'order': 'popular', 'offset': 1}))
+        self.assertEqual(mock_search.call_args_list[0][1]['size'], 0)
+        self.assertEqual(mock_search.call_args_list[1][1]['filter_dictionary'], {'id': [str(self.course2.id)]})
+        self.assertEqual([x['id'] for x in results['results']], [str(self.course2.id)])
+        self.assertEqual(results['total'], 2)
+        self.assertIsNone(results['next_cursor'])
+        self.assertNotIn('id', results['facets'])
+        with self.assertRaises(ValueError):
+            course_discovery_search_eol(order_by='popular', cursor=helpers.encode_discovery_cursor({'order': 'start'}))
+
+    def test_add_enrollment_status(self):
+        """
+            Test the enrollments of the user are added to copies of the shared results with one query
+        """
+        def get_result(course):
+            return DiscoveryResult({'id': str(course.id), 'start': '2023-03-01T00:00:00+00:00'}, None)
+        shared = {'results': [get_result(self.course), get_result(self.course3), {'content': {}}], 'total': 3}
+        with self.assertNumQueries(1):
+            responses = helpers.add_enrollment_status([shared, {'error': 'error'}], self.student)
+        self.assertEqual([x.get('is_enrolled') for x in responses[0]['results']], [True, False, None])
+        self.assertEqual(responses[0]['results'][0]['start'], '2023-03-01T00:00:00+00:00')
+        self.assertEqual(responses[1], {'error': 'error'})
+        self.assertNotIn('is_enrolled', shared['results'][0])
+
+        shared = {'results': [{'id': str(self.course.id)}], 'total': 1}
+        with patch('course_classification.views.coalesced_discovery_search', return_value=shared):
+            result = self.student_client.post(reverse('course_classification:course_discovery_eol'), {'enrollment_status': 'true'})
+            self.assertEqual(json.loads(result.content.decode())['results'], [{'id': str(self.course.id), 'is_enrolled': True}])
+            result = self.client.post(reverse('course_classification:course_discovery_eol'), {'enrollment_status': 'true'})
+            self.assertEqual(json.loads(result.content.decode())['results'], [{'id': str(self.course.id), 'is_enrolled': False}])
+            result = self.student_client.post(reverse('course_classification:course_discovery_eol'))
+            self.assertEqual(json.loads(result.content.decode())['results'], [{'id': str(self.course.id)}])
+
+    def test_course_discovery_suggest(self):
+        """
+            Test suggestions of classifications, categories and courses with incremental updates
+        """
+        mcc1 = MainCourseClassification(
+            name="Universidad de Chile",
+            sequence=1,
+            visibility=2,
+            is_active=True
+            )
+        mcc1.save()
+        cc1 = CourseCategory(
+            name="Matemáticas",
+            sequence=1,
+            show_opt=2
+            )
+        cc1.save()
+        with patch('course_classification.suggest.suggest_index', suggest.SuggestIndex()), \
+                patch('course_classification.invalidation.transaction.on_commit', side_effect=lambda func: func()):
+            result = self.client.get(reverse('course_classification:course_discovery_suggest'), {'q': 'chile'})
+            self.assertEqual(result.status_code, 200)
+            response = json.loads(result.content.decode())
+            self.assertEqual(response['results'], [{'type': 'classification', 'id': mcc1.id, 'label': 'Universidad de Chile'}])
+            response = suggest.get_suggestions('MATE')
+            self.assertEqual(response, [{'type': 'category', 'id': cc1.id, 'label': 'Matemáticas'}])
+            response = suggest.get_suggestions('202')
+            self.assertEqual([x['id'] for x in response], [str(self.course.id), str(self.course2.id)])
+            response = suggest.get_suggestions('999')
+            self.assertEqual([x['id'] for x in response], [str(self.course.id)])
+            self.assertEqual(suggest.get_suggestions(''), [])
+            # the index is updated with the new category
+            cc2 = CourseCategory(
+                name="Matemática",
+                sequence=2,
+                show_opt=2
+                )
+            cc2.save()
+            response = suggest.get_suggestions('matem', 1)
+            self.assertEqual(response, [{'type': 'category', 'id': cc2.id, 'label': 'Matemática'}])
+
+    def test_suggest_ranking(self):
+        """
+            Test the best ranked suggestions are returned even after many entries of the prefix
+        """
+        suggest_index = suggest.SuggestIndex()
+        suggest_index.course_entries = {
+            'course-v1:eol+M{}+2023'.format(x): suggest_index.get_entries('course', 'course-v1:eol+M{}+2023'.format(x), 'Matemática {}'.format(x))
+            for x in range(300)
+        }
+        suggest_index.taxonomy_entries = suggest_index.get_entries('classification', 1, 'Matemáticas') + suggest_index.get_entries('category', 2, 'Cálculo y matemáticas')
+        suggest_index.sort_entries()
+        response = suggest_index.suggest('matem', 3)
+        self.assertEqual([x['id'] for x in response], [1, 'course-v1:eol+M0+2023', 'course-v1:eol+M1+2023'])
+        self.assertEqual(len(suggest_index.suggest('matem', 400)), 302)
+        self.assertEqual(suggest_index.suggest('mates'), [])
+
     def test_redirect_when_banner_empty(self):
         """ Check if redirect properly when banner is empty"""
         mock_classification = MagicMock()
@@ -732,4 +1533,741 @@ class TestMockCourseDiscoverySearch(ModuleStoreTestCase, SearcherMixin):  # pyli
         response = utils.get_courses_filtered_by_course_state(["upcoming_notenrollable"])
         self.assertEqual(len(response), 0)
 
-   
\ No newline at end of file
+   
+    def test_course_discovery_cursor(self):
+        """
+            Test cursor pagination returns next_cursor only when there are more results
+        """
+        results = course_discovery_search_eol(size=2, cursor='')
+        self.assertEqual(results["total"], 3)
+        self.assertIsNotNone(results["next_cursor"])
+        cursor = helpers.decode_discovery_cursor(results["next_cursor"])
+        self.assertEqual(cursor['order'], 'start')
+        results = course_discovery_search_eol(size=20, cursor='')
+        self.assertIsNone(results["next_cursor"])
+        all_ids = [x['id'] for x in results['results']]
+        results = course_discovery_search_eol(size=20)
+        self.assertFalse('next_cursor' in results)
+        # one course by page
+        ids = []
+        cursor = ''
+        while cursor is not None:
+            results = course_discovery_search_eol(size=1, cursor=cursor)
+            ids.extend(x['id'] for x in results['results'])
+            cursor = results['next_cursor']
+        self.assertEqual(ids, all_ids)
+
+    def test_course_discovery_eol_invalid_cursor(self):
+        """
+            Test course_discovery_eol with a malformed cursor or a cursor of another order
+        """
+        request = TestRequest()
+        request.method = 'POST'
+        request.POST = {
+            'search_string': '',
+            'page_size': '20',
+            'cursor': 'not a cursor'
+        }
+        response = course_discovery_eol(request)
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(json.loads(response.content.decode('utf-8')), {"error": "Invalid cursor value"})
+        request.POST = {
+            'search_string': '',
+            'order_by': 'newer',
+            'page_size': '20',
+            'cursor': helpers.encode_discovery_cursor({'order': 'start', 'start': None, 'skip': 0})
+        }
+        response = course_discovery_eol(request)
+        self.assertEqual(response.status_code, 500)
+
+    def test_helpers_get_next_discovery_cursor(self):
+        """
+            Test get_next_discovery_cursor() counts the courses with the same start date of the previous pages
+        """
+        hits = [
+            {'data': {'id': 'course-v1:eol+A+2023', 'start': '2023-01-01T00:00:00+00:00'}},
+            {'data': {'id': 'course-v1:eol+B+2023', 'start': '2023-02-01T00:00:00+00:00'}},
+            {'data': {'id': 'course-v1:eol+C+2023', 'start': '2023-02-01T00:00:00+00:00'}},
+        ]
+        self.assertIsNone(helpers.get_next_discovery_cursor(hits, 4, 'start'))
+        cursor = helpers.decode_discovery_cursor(helpers.get_next_discovery_cursor(hits, 3, 'start'))
+        self.assertEqual(cursor, {'order': 'start', 'start': '2023-02-01T00:00:00+00:00', 'skip': 2})
+        next_hits = [{'data': {'id': 'course-v1:eol+D+2023', 'start': '2023-02-01T00:00:00+00:00'}}]
+        cursor = helpers.decode_discovery_cursor(helpers.get_next_discovery_cursor(next_hits, 1, 'start', cursor))
+        self.assertEqual(cursor['skip'], 3)
+        next_hits = [{'data': {'id': 'course-v1:eol+E+2023', 'start': '2023-03-01T00:00:00+00:00'}}]
+        cursor = helpers.decode_discovery_cursor(helpers.get_next_discovery_cursor(next_hits, 1, 'start', cursor))
+        self.assertEqual(cursor, {'order': 'start', 'start': '2023-03-01T00:00:00+00:00', 'skip': 1})
+        with self.assertRaises(ValueError):
+            helpers.decode_discovery_cursor(helpers.encode_discovery_cursor({'order': 'start', 'skip': -1}))
+
+    def test_course_discovery_fallback(self):
+        """
+            Test the discovery uses the fallback engine when the search engine fails and stops calling it
+            while the circuit breaker is open
+        """
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(COURSE_CLASSIFICATION_FALLBACK_INDEX_PATH=os.path.join(directory, 'fallback.db')), \
+                patch('course_classification.fallback._circuit_breaker', fallback.CircuitBreaker(failure_threshold=1)):
+            call_command('rebuild_fallback_index')
+            with patch('search.tests.mock_search_engine.MockSearchEngine.search', side_effect=ConnectionError('timeout')) as mock_search:
+                results = course_discovery_search_eol()
+                self.assertEqual(results['total'], 1)
+                self.assertEqual(results['results'][0]['id'], str(self.course.id))
+                self.assertEqual(results['results'][0]['course_state'], 'ongoing_enrollable')
+                results = course_discovery_search_eol(search_term='2020')
+                self.assertEqual(results['total'], 1)
+                self.assertEqual(mock_search.call_count, 1)
+
+    @override_settings(COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT=10)
+    def test_course_discovery_eol_coalesced(self):
+        """
+            Test identical searches after normalization use the results of the first one
+        """
+        cache.clear()
+        request = TestRequest()
+        request.method = 'POST'
+        request.POST = {'search_string': '', 'page_size': '20', 'page_index': '0'}
+        with patch('course_classification.discovery_cache.course_discovery_search_eol', wraps=course_discovery_search_eol) as mock_search:
+            response = course_discovery_eol(request)
+            self.assertEqual(json.loads(response.content.decode('utf-8'))['total'], 3)
+            request.POST = {'search_string': '  ', 'page_size': '20', 'page_index': '0', 'order_by': ''}
+            response = course_discovery_eol(request)
+            self.assertEqual(json.loads(response.content.decode('utf-8'))['total'], 3)
+            self.assertEqual(mock_search.call_count, 1)
+            request.POST = {'search_string': '', 'page_size': '20', 'page_index': '0', 'order_by': 'newer'}
+            course_discovery_eol(request)
+            self.assertEqual(mock_search.call_count, 2)
+            # the prices are translated, each language has its own results
+            with translation.override('es-419'):
+                course_discovery_eol(request)
+            self.assertEqual(mock_search.call_count, 3)
+        self.assertNotEqual(
+            discovery_cache.get_discovery_params(search_term='Python AND Django')['search_term'],
+            discovery_cache.get_discovery_params(search_term='python and django')['search_term']
+        )
+        self.assertEqual(discovery_cache.get_discovery_params(search_term=' Python  AND Django')['search_term'], 'Python AND Django')
+
+    @override_settings(COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT=10)
+    def test_course_discovery_multi_search_coalesced(self):
+        """
+            Test the queries of the multi search share the cached results of the discovery searches and the missing
+            ones are searched in one batch
+        """
+        cache.clear()
+        discovery_cache.coalesced_discovery_search(search_term='2020')
+        with patch('course_classification.discovery_cache.course_discovery_multi_search_eol', wraps=api.course_discovery_multi_search_eol) as mock_search:
+            responses = discovery_cache.coalesced_discovery_multi_search([
+                {'search_term': ' 2020'}, {'featured': True}, {'state': 'active'}, {'featured': True}
+            ])
+            self.assertEqual(mock_search.call_count, 1)
+            self.assertEqual(mock_search.call_args[0][0], [{'featured': True}, {'state': 'active'}])
+            self.assertEqual(responses[0], discovery_cache.coalesced_discovery_search(search_term='2020'))
+            self.assertEqual(responses[1], responses[3])
+            discovery_cache.coalesced_discovery_multi_search([{'featured': True}, {'state': 'active'}])
+            self.assertEqual(mock_search.call_count, 1)
+
+    @override_settings(COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT=10)
+    def test_course_discovery_coalesced_other_worker(self):
+        """
+            Test a search computed by other worker (holding the cache lock) is not computed again
+        """
+        cache.clear()
+        params = discovery_cache.get_discovery_params(search_term='2020')
+        params['versions'] = invalidation.get_versions('catalog', 'taxonomy')
+        cache_key = discovery_cache.get_discovery_cache_key(params)
+        cache.add(cache_key + '.lock', 1, 10)
+        with patch('course_classification.discovery_cache.time.sleep', side_effect=lambda seconds: cache.set(cache_key, {'total': 7, 'results': []})), \
+                patch('course_classification.discovery_cache.course_discovery_search_eol') as mock_search:
+            results = discovery_cache.coalesced_discovery_search(search_term='2020')
+        self.assertEqual(results['total'], 7)
+        self.assertFalse(mock_search.called)
+
+    @override_settings(COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT=10, COURSE_CLASSIFICATION_DISCOVERY_PREFETCH=True)
+    def test_course_discovery_prefetch(self):
+        """
+            Test the next page of a search is computed after the page and the next request is a cache hit
+        """
+        cache.clear()
+        with patch('course_classification.discovery_cache.course_discovery_search_eol', side_effect=lambda **kwargs: {'total': 25, 'results': [kwargs['from_']]}) as mock_search, \
+                patch('course_classification.discovery_cache.run_in_background', side_effect=lambda func: func() or True) as mock_background:
+            self.assertEqual(discovery_cache.coalesced_discovery_search(size=10, from_=0)['results'], [0])
+            self.assertEqual(mock_search.call_count, 2)
+            self.assertEqual(discovery_cache.coalesced_discovery_search(size=10, from_=10)['results'], [10])
+            self.assertEqual(mock_search.call_count, 3)
+            self.assertEqual(discovery_cache.coalesced_discovery_search(size=10, from_=20)['results'], [20])
+            self.assertEqual(mock_search.call_count, 3)
+            self.assertEqual(mock_background.call_count, 2)
+        # the background thread computes the page in the language of the request
+        with patch('course_classification.discovery_cache.course_discovery_search_eol', side_effect=lambda **kwargs: {'total': 25, 'results': [translation.get_language()]}), \
+                patch('course_classification.discovery_cache.run_in_background', side_effect=lambda func: threading.Thread(target=func).start() or True), \
+                translation.override('es-419'):
+            cache.clear()
+            discovery_cache.coalesced_discovery_search(size=10, from_=0)
+            params = discovery_cache.get_discovery_params(size=10, from_=10)
+            params['versions'] = invalidation.get_versions('catalog', 'taxonomy')
+            cache_key = discovery_cache.get_discovery_cache_key(params)
+            for _ in range(100):
+                if cache.get(cache_key) is not None:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(cache.get(cache_key)['results'], ['es-419'])
+        self.assertIsNone(discovery_cache.get_next_page_kwargs({'size': 10, 'cursor': ''}, {'total': 25, 'next_cursor': None}))
+        self.assertEqual(discovery_cache.get_next_page_kwargs({'size': 10, 'cursor': ''}, {'total': 25, 'next_cursor': 'abc'})['cursor'], 'abc')
+
+        prefetcher = discovery_cache.Prefetcher()
+        prefetcher.running = 1
+        self.assertFalse(prefetcher.submit(lambda: None, 1))
+
+    def test_course_discovery_fields(self):
+        """
+            Test the fields projection reads only the needed fields from the search engine and returns only the fields
+        """
+        course = DiscoveryResult(
+            {'id': 'course-v1:eol+Test+2023', 'start': '2023-01-01T00:00:00+00:00', 'content': {'display_name': 'Test', 'overview': 'overview'}},
+            CourseExtraData(None, None, 'eol', False, None, False, None, 'Free'),
+            'ongoing_enrollable'
+        )
+        with patch('course_classification.api.search_with_fallback', wraps=search_with_fallback) as mock_search, \
+                patch('course_classification.api.set_data_courses', return_value=[course]) as mock_set_data:
+            results = course_discovery_search_eol(fields=get_discovery_fields('card'))
+        self.assertEqual(results['total'], 3)
+        source_fields = mock_search.call_args[1]['_source_include']
+        self.assertIn('content.display_name', source_fields)
+        self.assertIn('enrollment_start', source_fields)
+        self.assertNotIn('extra_data.price', source_fields)
+        self.assertEqual(mock_set_data.call_args[0][1], {'main_classification', 'price', 'advertised_start', 'display_org_with_default'})
+        self.assertEqual(results['results'], [{
+            'id': 'course-v1:eol+Test+2023',
+            'content': {'display_name': 'Test'},
+            'start': '2023-01-01T00:00:00+00:00',
+            'course_state': 'ongoing_enrollable',
+            'time_left': None,
+            'extra_data': {'main_classification': None, 'price': 'Free', 'advertised_start': None, 'display_org_with_default': 'eol'}
+        }])
+
+    def test_course_discovery_facets(self):
+        """
+            Test the facets are computed for the ids of all the matching courses returned by the same search
+        """
+        facets = {'classification': {'terms': {'1': 3}, 'total': 3, 'other': 0}}
+        with patch('course_classification.api.get_discovery_facets', return_value=facets) as mock_facets:
+            results = course_discovery_search_eol(size=1, facets=True)
+        self.assertEqual(len(results['results']), 1)
+        self.assertEqual(len(mock_facets.call_args[0][0]), 3)
+        self.assertEqual(results['facets']['classification'], facets['classification'])
+        self.assertEqual(results['facets']['year']['total'], 3)
+        self.assertEqual(results['facets']['state']['total'], 3)
+        for facet in ('id', 'start', 'end'):
+            self.assertNotIn(facet, results['facets'])
+        with patch('course_classification.api.get_discovery_facets') as mock_facets:
+            course_discovery_search_eol(size=1)
+        mock_facets.assert_not_called()
+
+    def test_course_homepage_data(self):
+        """
+            Test homepage data endpoint returns all sections with an ETag
+        """
+        response = self.client.get(reverse('course_classification:course_homepage_data'))
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(
+            set(data.keys()),
+            {'logos', 'main_classifications', 'course_categories', 'featured_courses', 'courses_by_state', 'version'}
+        )
+        self.assertEqual(response['ETag'], '"{}"'.format(data['version']))
+        with patch('course_classification.views.get_homepage_discovery_data') as mock_data:
+            response = self.client.get(reverse('course_classification:course_homepage_data'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(mock_data.called)
+        etag = response['ETag']
+        with patch('course_classification.invalidation.transaction.on_commit', side_effect=lambda func: func()):
+            CourseCategory.objects.create(name="CC1", sequence=1, show_opt=2)
+        response = self.client.get(reverse('course_classification:course_homepage_data'), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+class TestCourseState(unittest.TestCase):
+    """
+    Tests the vectorized course state classification against the rules of one course
+    """
+    def setUp(self):
+        self.today = timezone.now()
+        offsets = [None, -800, -40, -1, 0, 1, 29, 31, 200, 364, 365, 390, 800]
+        self.courses = [
+            {
+                'start': self.date(start),
+                'end': self.date(end),
+                'enrollment_start': self.date(enroll_start),
+                'enrollment_end': self.date(enroll_end),
+                'extra_data': {'invitation_only': invitation_only}
+            }
+            for start, end, enroll_start, enroll_end, invitation_only in itertools.product(offsets, offsets, offsets, offsets, [False, True])
+        ]
+
+    def date(self, offset):
+        if offset is None:
+            return None
+        return (self.today + timedelta(days=offset, hours=-3)).isoformat()
+
+    @unittest.skipIf(course_state.np is None, 'NumPy is not installed')
+    def test_classify_courses_equivalence(self):
+        """
+            Test the NumPy classification returns the same states, time_left and sort keys of the course by course rules
+        """
+        states, time_lefts, sort_keys = course_state.classify_courses(self.courses, self.today)
+        for course, state, time_left, key in zip(self.courses, states, time_lefts, sort_keys):
+            dates = [course_state.parse_course_date(course[x]) for x in ('start', 'end', 'enrollment_start', 'enrollment_end')]
+            self.assertEqual(state, course_state.get_course_state(*dates, course['extra_data']['invitation_only'], self.today))
+            if dates[0] is not None:
+                self.assertEqual(time_left, helpers.set_time_left(dates[0], self.today))
+        self.assertEqual(
+            (states, time_lefts, sort_keys),
+            course_state.classify_courses(self.courses, self.today, use_numpy=False)
+        )
+
+    def test_classify_and_sort_courses_dict(self):
+        """
+            Test courses are sorted by state and by the proximity of the start date
+        """
+        courses = [
+            {'id': 'completed', 'start': self.date(-800), 'end': self.date(-40)},
+            {'id': 'ongoing_far', 'start': self.date(-800)},
+            {'id': 'upcoming', 'start': self.date(40)},
+            {'id': 'ongoing_near', 'start': self.date(-40)},
+        ]
+        response = helpers.classify_and_sort_courses_dict(courses, self.today)
+        self.assertEqual([x['id'] for x in response], ['ongoing_near', 'ongoing_far', 'upcoming', 'completed'])
+        self.assertEqual([x['course_state'] for x in response], ['ongoing_enrollable', 'ongoing_enrollable', 'upcoming_notenrollable', 'completed'])
+        self.assertEqual(response[2]['time_left'], [1, 'm'])
+
+
+class TestFallbackSearchEngine(unittest.TestCase):
+    """
+    Tests the SQLite search engine and the circuit breaker of the course discovery fallback
+    """
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.engine = fallback.FallbackSearchEngine(index='courseware_index', path=os.path.join(directory.name, 'fallback.db'))
+        self.engine.index('course_info', [
+            {'id': 'course-v1:eol+Python+2023', 'content': {'display_name': 'Introducción a Python', 'number': 'PY1'}, 'org': 'eol', 'start': '2023-01-01T00:00:00+00:00'},
+            {'id': 'course-v1:eol+Data+2024', 'content': {'display_name': 'Ciencia de Datos', 'number': 'DATA'}, 'org': 'eol', 'start': '2024-01-01T00:00:00+00:00'},
+            {'id': 'course-v1:uchile+Python2+2022', 'content': {'display_name': 'Python avanzado', 'number': 'PY2'}, 'org': 'uchile', 'start': '2022-01-01T00:00:00+00:00'},
+        ])
+
+    def get_ids(self, **kwargs):
+        return [x['_id'] for x in self.engine.search(**kwargs)['results']]
+
+    def test_search(self):
+        """
+            Test text search without accents, filters, exclusions, sort and pagination
+        """
+        self.assertEqual(self.get_ids(query_string='introduccion'), ['course-v1:eol+Python+2023'])
+        self.assertEqual(sorted(self.get_ids(query_string='pyth')), ['course-v1:eol+Python+2023', 'course-v1:uchile+Python2+2022'])
+        self.assertEqual(self.get_ids(query_string='" OR'), [])
+        self.assertEqual(
+            self.get_ids(sort='start:desc,id'),
+            ['course-v1:eol+Data+2024', 'course-v1:eol+Python+2023', 'course-v1:uchile+Python2+2022']
+        )
+        self.assertEqual(self.get_ids(sort='start', size=1, from_=1), ['course-v1:eol+Python+2023'])
+        self.assertEqual(self.get_ids(field_dictionary={'org': 'uchile'}), ['course-v1:uchile+Python2+2022'])
+        self.assertEqual(
+            self.get_ids(field_dictionary={'start': DateRange(datetime(2023, 1, 1), None)}, sort='start'),
+            ['course-v1:eol+Python+2023', 'course-v1:eol+Data+2024']
+        )
+        self.assertEqual(
+            self.get_ids(exclude_dictionary={'_id': ['course-v1:eol+Data+2024'], 'org': 'uchile'}),
+            ['course-v1:eol+Python+2023']
+        )
+        self.engine.remove('course_info', ['course-v1:eol+Python+2023'])
+        self.assertEqual(self.engine.search(query_string='python')['total'], 1)
+
+    def test_search_facets(self):
+        """
+            Test the terms facets are counted over all the matching documents
+        """
+        results = self.engine.search(size=1, facet_terms={'org': {}, 'id': {'size': 1}})
+        self.assertEqual(len(results['results']), 1)
+        self.assertEqual(results['facets']['org'], {'terms': {'eol': 2, 'uchile': 1}, 'total': 3, 'other': 0})
+        self.assertEqual(results['facets']['id']['total'], 1)
+        self.assertEqual(results['facets']['id']['other'], 2)
+
+    def test_circuit_breaker(self):
+        """
+            Test the circuit breaker opens after consecutive failures or slow searches and closes after a good probe
+        """
+        circuit_breaker = fallback.CircuitBreaker(failure_threshold=2, latency_budget=1.0, probe_interval=30)
+        circuit_breaker.record_failure()
+        circuit_breaker.record_success(0.1)
+        circuit_breaker.record_failure()
+        self.assertFalse(circuit_breaker.is_open)
+        circuit_breaker.record_success(5.0)
+        self.assertTrue(circuit_breaker.is_open)
+        self.assertFalse(circuit_breaker.allow_request())
+        with patch('course_classification.fallback.time.monotonic', return_value=circuit_breaker.opened_at + 31):
+            self.assertTrue(circuit_breaker.allow_request())
+            # Only one probe at a time
+            self.assertFalse(circuit_breaker.allow_request())
+        circuit_breaker.record_success(0.1)
+        self.assertTrue(circuit_breaker.allow_request())
+
+    def test_circuit_breaker_interrupted_probe(self):
+        """
+            Test a probe interrupted without result does not leave the circuit breaker without probes
+        """
+        circuit_breaker = fallback.CircuitBreaker(failure_threshold=1, probe_interval=30)
+        circuit_breaker.record_failure()
+        searcher = MagicMock(index_name='courseware_index')
+        searcher.search.side_effect = KeyboardInterrupt
+        with patch('course_classification.fallback.FallbackSearchEngine.get_fallback_engine', return_value=self.engine), \
+                patch('course_classification.fallback._circuit_breaker', circuit_breaker), \
+                patch('course_classification.fallback.time.monotonic', return_value=circuit_breaker.opened_at + 31):
+            with self.assertRaises(KeyboardInterrupt):
+                fallback.search_with_fallback(searcher, query_string='python')
+            self.assertFalse(circuit_breaker.probing)
+            searcher.search.side_effect = None
+            searcher.search.return_value = {'total': 0, 'results': []}
+            self.assertEqual(fallback.search_with_fallback(searcher, query_string='python')['total'], 0)
+        self.assertFalse(circuit_breaker.is_open)
+
+    def test_search_without_fallback(self):
+        """
+            Test the errors of the search engine are counted without fallback engine
+        """
+        registry = metrics.MetricsRegistry()
+        searcher = MagicMock(index_name='courseware_index')
+        searcher.search.side_effect = ConnectionError('timeout')
+        with patch('course_classification.fallback.FallbackSearchEngine.get_fallback_engine', return_value=None), \
+                patch('course_classification.metrics.registry', registry):
+            with self.assertRaises(ConnectionError):
+                fallback.search_with_fallback(searcher, query_string='python')
+        self.assertIn('course_classification_engine_errors_total{engine="primary"} 1', registry.render())
+
+    def test_search_client_error(self):
+        """
+            Test the errors caused by the search are raised without opening the circuit breaker
+        """
+        circuit_breaker = fallback.CircuitBreaker(failure_threshold=1)
+        searcher = MagicMock(index_name='courseware_index')
+        searcher.search.side_effect = QueryParseError('Malformed search query.')
+        with patch('course_classification.fallback.FallbackSearchEngine.get_fallback_engine', return_value=self.engine), \
+                patch('course_classification.fallback._circuit_breaker', circuit_breaker):
+            with self.assertRaises(QueryParseError):
+                fallback.search_with_fallback(searcher, query_string='"python')
+            self.assertFalse(circuit_breaker.is_open)
+            searcher.search.side_effect = ConnectionError('timeout')
+            self.assertIn('total', fallback.search_with_fallback(searcher, query_string='python'))
+            self.assertTrue(circuit_breaker.is_open)
+        self.assertFalse(fallback.is_client_error(MagicMock(status_code=429)))
+        self.assertTrue(fallback.is_client_error(MagicMock(status_code=400)))
+
+    def test_search_creates_tables_once(self):
+        """
+            Test the tables of the fallback index are created once by the process, not on every search
+        """
+        statements = []
+        connect = fallback.sqlite3.connect
+
+        def traced_connect(*args, **kwargs):
+            connection = connect(*args, **kwargs)
+            connection.set_trace_callback(statements.append)
+            return connection
+        with patch('course_classification.fallback.sqlite3.connect', side_effect=traced_connect):
+            self.get_ids(query_string='python')
+            self.get_ids(query_string='python')
+        self.assertFalse([x for x in statements if x.startswith('CREATE')])
+
+    def test_search_excluded_ids(self):
+        """
+            Test the exclusion of many ids and the matchers of the search dictionaries
+        """
+        excluded = ['course-v1:eol+Other{}+2023'.format(x) for x in range(1000)] + ['course-v1:eol+Data+2024']
+        self.assertEqual(
+            sorted(self.get_ids(exclude_dictionary={'_id': excluded})),
+            ['course-v1:eol+Python+2023', 'course-v1:uchile+Python2+2022']
+        )
+        self.assertTrue(fallback.value_matches(['a', 'b'], {'b', 'c'}))
+        self.assertFalse(fallback.value_matches(None, DateRange(datetime(2023, 1, 1), None)))
+
+
+@override_settings(COURSE_CLASSIFICATION_READ_REPLICA='read_replica', COURSE_CLASSIFICATION_REPLICA_PIN_SECONDS=5)
+class TestCourseClassificationRouter(unittest.TestCase):
+    """
+    Tests the discovery reads are routed to the read replica except after the writes of the admin models
+    """
+    def setUp(self):
+        cache.delete(REPLICA_PIN_CACHE_KEY)
+        self.router = ConnectionRouter([CourseClassificationRouter(ReplicaPin())])
+
+    def test_db_for_read(self):
+        """
+            Test only the course_classification models are routed to the replica, the models shared with the LMS are not
+        """
+        self.assertEqual(self.router.db_for_read(CourseCategory), 'read_replica')
+        self.assertEqual(self.router.db_for_read(CourseOverview), 'default')
+        self.assertEqual(self.router.db_for_read(CourseCatalogChange), 'default')
+        self.assertEqual(self.router.db_for_write(CourseOverview), 'default')
+        self.assertEqual(self.router.db_for_read(CourseClassification), 'read_replica')
+        with override_settings(COURSE_CLASSIFICATION_READ_REPLICA=None):
+            self.assertEqual(self.router.db_for_read(CourseClassification), 'default')
+            self.assertEqual(get_read_database(), 'default')
+
+    def test_pin_primary_after_write(self):
+        """
+            Test the reads of this and other processes use the primary database during the pin window after a write
+        """
+        self.assertEqual(self.router.db_for_write(MainCourseClassification), 'default')
+        self.assertEqual(self.router.db_for_read(CourseClassification), 'default')
+        other_router = ConnectionRouter([CourseClassificationRouter(ReplicaPin())])
+        self.assertEqual(other_router.db_for_read(CourseClassification), 'default')
+        with patch('course_classification.routers.time.time', return_value=cache.get(REPLICA_PIN_CACHE_KEY) + 1):
+            self.assertEqual(self.router.db_for_read(CourseClassification), 'read_replica')
+
+
+@override_settings(COURSE_CLASSIFICATION_READ_REPLICA='read_replica')
+class TestReadReplicaQueries(TransactionTestCase):
+    """
+    Tests the discovery reads query the replica alias, a second connection to the test database
+    """
+    databases = {'default', 'read_replica'}
+
+    @classmethod
+    def setUpClass(cls):
+        connections.databases['read_replica'] = dict(connections.databases['default'], TEST={'MIRROR': 'default'})
+        super(TestReadReplicaQueries, cls).setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super(TestReadReplicaQueries, cls).tearDownClass()
+        connections['read_replica'].close()
+        del connections.databases['read_replica']
+
+    def setUp(self):
+        cache.delete(REPLICA_PIN_CACHE_KEY)
+        self.course_key = CourseKey.from_string('course-v1:REPLICA+Test+2023')
+        loadtest.create_course_overview(self.course_key, 'Replica', datetime(2023, 3, 1, tzinfo=timezone.utc), datetime(2030, 3, 1, tzinfo=timezone.utc))
+
+    def test_discovery_reads_use_replica(self):
+        """
+            Test the course overviews and course modes of the discovery are read through the replica,
+            and the other reads of the course overviews use the primary database
+        """
+        with CaptureQueriesContext(connections['read_replica']) as replica_queries, \
+                CaptureQueriesContext(connections['default']) as default_queries:
+            extra_data = helpers.get_courses_extra_data_by_id([str(self.course_key)])
+        self.assertEqual(extra_data[str(self.course_key)]['display_org_with_default'], 'REPLICA')
+        replica_sql = ' '.join(x['sql'] for x in replica_queries.captured_queries)
+        self.assertIn('course_overviews_courseoverview', replica_sql)
+        self.assertIn('course_modes_coursemode', replica_sql)
+        self.assertNotIn('course_overviews_courseoverview', ' '.join(x['sql'] for x in default_queries.captured_queries))
+
+        with CaptureQueriesContext(connections['read_replica']) as replica_queries:
+            CourseOverview.objects.get(id=self.course_key)
+        self.assertEqual(len(replica_queries.captured_queries), 0)
+
+        with patch('course_classification.routers.replica_pin.is_pinned', return_value=True), \
+                CaptureQueriesContext(connections['read_replica']) as replica_queries:
+            helpers.get_courses_extra_data_by_id([str(self.course_key)])
+        self.assertEqual(len(replica_queries.captured_queries), 0)
+
+
+class TestSingleFlight(unittest.TestCase):
+    """
+    Tests the concurrent calls of the same key wait for one computation
+    """
+    def test_single_flight(self):
+        flights = discovery_cache.SingleFlight()
+        waiters = []
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        class CountingEvent(threading.Event):
+            def wait(self, timeout=None):
+                waiters.append(1)
+                return super(CountingEvent, self).wait(timeout)
+
+        def compute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {'results': [1]}
+        results = []
+        leader = threading.Thread(target=lambda: results.append(flights.do('key', compute)))
+        leader.start()
+        started.wait(5)
+        flights.flights['key'].event = CountingEvent()
+        followers = [threading.Thread(target=lambda: results.append(flights.do('key', compute))) for _ in range(4)]
+        for thread in followers:
+            thread.start()
+        deadline = time.monotonic() + 5
+        while len(waiters) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in [leader] + followers:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [{'results': [1]}] * 5)
+        self.assertEqual(flights.flights, {})
+
+    def test_single_flight_error(self):
+        flights = discovery_cache.SingleFlight()
+        with self.assertRaises(ValueError):
+            flights.do('key', lambda: int('x'))
+        self.assertEqual(flights.do('key', lambda: 1), 1)
+
+
+class TestDiscoveryResults(unittest.TestCase):
+    """
+    Tests the discovery result records are read and serialized like the dictionaries of the search engine hits
+    """
+    def setUp(self):
+        self.hit = {'id': 'course-v1:eol+Test+2023', 'start': '2023-01-01T00:00:00+00:00', 'content': {'display_name': 'Introducción'}}
+        self.extra_data = CourseExtraData(None, None, 'eol', False, None, False, {'name': 'MCC1', 'logo': ''}, 'Free')
+
+    def test_discovery_result(self):
+        """
+            Test the record has the fields of the document plus the result fields and does not modify the document
+        """
+        result = DiscoveryResult(self.hit, self.extra_data)
+        result['course_state'] = 'ongoing_enrollable'
+        result['time_left'] = [1, 'm']
+        expected = dict(self.hit, course_state='ongoing_enrollable', time_left=[1, 'm'], extra_data=self.extra_data.to_dict())
+        self.assertEqual(result, expected)
+        self.assertEqual(result['extra_data']['price'], 'Free')
+        self.assertEqual(result.get('language', 'en'), 'en')
+        self.assertEqual(list(self.hit), ['id', 'start', 'content'])
+        with self.assertRaises(KeyError):
+            result['id'] = 'course-v1:eol+Other+2023'
+        self.assertEqual(json.loads(dumps_discovery_json({'results': [result]}).decode('utf-8')), {'results': [expected]})
+
+    def test_get_discovery_fields(self):
+        """
+            Test the fields parameter with presets, nested fields and invalid fields
+        """
+        self.assertIsNone(get_discovery_fields(''))
+        self.assertIsNone(get_discovery_fields('full'))
+        self.assertIn('extra_data.price', get_discovery_fields('card'))
+        self.assertEqual(get_discovery_fields('extra_data.price, extra_data,id,id'), ('extra_data', 'id'))
+        with self.assertRaises(ValueError):
+            get_discovery_fields('content..display_name')
+        result = DiscoveryResult(self.hit, self.extra_data, 'completed')
+        self.assertEqual(
+            project_result(result, ('content.display_name', 'course_state', 'extra_data.price', 'language')),
+            {'content': {'display_name': 'Introducción'}, 'course_state': 'completed', 'extra_data': {'price': 'Free'}}
+        )
+
+    def test_dumps_discovery_json_without_orjson(self):
+        """
+            Test the json module writes the same data
+        """
+        data = {'results': [DiscoveryResult(self.hit, self.extra_data, 'completed')], 'total': 1}
+        with patch('course_classification.results.orjson', None):
+            response = dumps_discovery_json(data, sort_keys=True)
+        self.assertEqual(json.loads(response.decode('utf-8')), json.loads(dumps_discovery_json(data).decode('utf-8')))
+
+
+class TestMetricsRegistry(unittest.TestCase):
+    """
+    Tests the metrics of the process and of the other processes are rendered in the Prometheus text format
+    """
+    def test_render(self):
+        registry = metrics.MetricsRegistry(buckets=(0.1, 1.0))
+        registry.inc('course_classification_cache_requests_total', 2, cache='discovery', result='hit')
+        registry.observe('course_classification_request_duration_seconds', 0.5, endpoint='discovery')
+        registry.observe('course_classification_request_duration_seconds', 0.05, endpoint='discovery')
+        content = registry.render()
+        self.assertIn('# TYPE course_classification_cache_requests_total counter', content)
+        self.assertIn('course_classification_cache_requests_total{cache="discovery",result="hit"} 2', content)
+        self.assertIn('course_classification_request_duration_seconds_bucket{endpoint="discovery",le="0.1"} 1', content)
+        self.assertIn('course_classification_request_duration_seconds_bucket{endpoint="discovery",le="1"} 2', content)
+        self.assertIn('course_classification_request_duration_seconds_bucket{endpoint="discovery",le="+Inf"} 2', content)
+        self.assertIn('course_classification_request_duration_seconds_sum{endpoint="discovery"} 0.55', content)
+        self.assertIn('course_classification_request_duration_seconds_count{endpoint="discovery"} 2', content)
+        self.assertNotIn('course_classification_engine_errors_total', content)
+        with self.assertRaises(ValueError):
+            registry.inc('other_total')
+
+    def test_track_endpoint_nested(self):
+        """
+            Test a tracked view called by other tracked view is observed only in the endpoint of the request
+        """
+        registry = metrics.MetricsRegistry(buckets=(0.1, 1.0))
+        discovery = metrics.track_endpoint('discovery')(lambda: 'results')
+        institution = metrics.track_endpoint('institution')(lambda: discovery())
+        with patch('course_classification.metrics.registry', registry):
+            self.assertEqual(institution(), 'results')
+            self.assertEqual(discovery(), 'results')
+        content = registry.render()
+        self.assertIn('course_classification_request_duration_seconds_count{endpoint="institution"} 1', content)
+        self.assertIn('course_classification_request_duration_seconds_count{endpoint="discovery"} 1', content)
+
+    def test_stage_timer_endpoint(self):
+        """
+            Test the stages of the discovery are observed in the endpoint of the tracked request
+        """
+        registry = metrics.MetricsRegistry(buckets=(0.1, 1.0))
+
+        def search():
+            with metrics.stage_timer(metrics.get_endpoint('discovery'), 'engine'):
+                return 'results'
+        with patch('course_classification.metrics.registry', registry):
+            metrics.track_endpoint('multi_search')(search)()
+            search()
+        content = registry.render()
+        self.assertIn('course_classification_stage_duration_seconds_count{endpoint="multi_search",stage="engine"} 1', content)
+        self.assertIn('course_classification_stage_duration_seconds_count{endpoint="discovery",stage="engine"} 1', content)
+
+    def test_render_processes(self):
+        """
+            Test the metrics files of the other processes are added to the metrics of the process
+        """
+        with tempfile.TemporaryDirectory() as directory, override_settings(COURSE_CLASSIFICATION_METRICS_DIR=directory):
+            registry = metrics.MetricsRegistry(buckets=(0.1, 1.0))
+            registry.inc('course_classification_engine_errors_total')
+            registry.maybe_flush(force=True)
+            self.assertTrue(os.path.exists(registry.get_path(directory)))
+            other = {
+                'buckets': [0.1, 1.0],
+                'counters': [['course_classification_engine_errors_total', [], 2]],
+                'histograms': [],
+            }
+            with open(os.path.join(directory, 'metrics_{}.json'.format(os.getppid())), 'w') as metrics_file:
+                json.dump(other, metrics_file)
+            with open(os.path.join(directory, 'metrics_1.json'), 'w') as metrics_file:
+                metrics_file.write('{')
+            self.assertIn('course_classification_engine_errors_total 3', registry.render())
+            # the file of a process that ended is removed and not added
+            with open(os.path.join(directory, 'metrics_999999.json'), 'w') as metrics_file:
+                json.dump(other, metrics_file)
+            with patch('course_classification.metrics.is_process_alive', side_effect=lambda pid: pid != 999999):
+                self.assertIn('course_classification_engine_errors_total 3', registry.render())
+            self.assertFalse(os.path.exists(os.path.join(directory, 'metrics_999999.json')))
+
+
+class TestLoadTestOptions(unittest.TestCase):
+    """
+    Tests the request mix, variants and percentiles of the load test
+    """
+    def test_parse_mix(self):
+        self.assertEqual(loadtest.parse_mix('empty=3, text'), {'empty': 3.0, 'text': 1.0})
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix('other=1')
+        with self.assertRaises(ValueError):
+            loadtest.parse_mix('empty=0')
+
+    def test_parse_variant(self):
+        self.assertEqual(
+            loadtest.parse_variant('no_cache:COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT=0,COURSE_CLASSIFICATION_READ_REPLICA=replica'),
+            ('no_cache', {'COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT': 0, 'COURSE_CLASSIFICATION_READ_REPLICA': 'replica'})
+        )
+        self.assertEqual(loadtest.parse_variant('default'), ('default', {}))
+        with self.assertRaises(ValueError):
+            loadtest.parse_variant('no_cache:COURSE_CLASSIFICATION_DISCOVERY_CACHE_TIMEOUT')
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual([loadtest.percentile(values, x) for x in loadtest.PERCENTILES], [50, 95, 99])
+        self.assertEqual(loadtest.percentile([7], 99), 7)
+        self.assertIsNone(loadtest.percentile([], 50))
@@ -2,7 +2,7 @@
 from django.conf.urls import url
 
 # Internal project dependencies
-from .views import CourseClassificationView, course_discovery_eol
+from .views import CourseClassificationView, course_cards, course_catalog_changes, course_catalog_export, course_classification_metrics, course_discovery_eol, course_discovery_multi_search, course_discovery_suggest, course_featured_courses, course_homepage_data
 
 urlpatterns = (
     url(
@@ -11,4 +11,12 @@ urlpatterns = (
         name='institution',
     ),
     url(r'^course_classification/search/$', course_discovery_eol, name='course_discovery_eol'),
+    url(r'^course_classification/multi_search/$', course_discovery_multi_search, name='course_discovery_multi_search'),
+    url(r'^course_classification/export/$', course_catalog_export, name='course_catalog_export'),
+    url(r'^course_classification/changes/$', course_catalog_changes, name='course_catalog_changes'),
+    url(r'^course_classification/featured/$', course_featured_courses, name='course_featured_courses'),
+    url(r'^course_classification/home/$', course_homepage_data, name='course_homepage_data'),
+    url(r'^course_classification/courses/$', course_cards, name='course_cards'),
+    url(r'^course_classification/suggest/$', course_discovery_suggest, name='course_discovery_suggest'),
+    url(r'^course_classification/metrics/$', course_classification_metrics, name='course_classification_metrics'),
 )
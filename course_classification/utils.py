@@ -6,14 +6,19 @@ import logging
 from django.test.client import RequestFactory
 
 # Internal project dependencies
+from .helpers import get_featured_courses
 from .views import course_discovery_eol
 
 logger = logging.getLogger(__name__)
 
 def get_course_ctgs():
     """
-        Return courses that are featured
+        Return courses that are featured, from the precomputed featured courses.
+        If there are no featured courses return the first courses of the search
     """
+    courses = get_featured_courses()
+    if courses:
+        return courses[:20]
     factory = RequestFactory()
     data = {
         'search_string': '',
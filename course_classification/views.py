@@ -2,15 +2,17 @@
 # -- coding: utf-8 --
 
 # Python Standard Libraries
+import hmac
 import json
 import logging
 
 # Installed packages (via pip)
-from django.http import HttpResponseRedirect
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render
 from django.test.client import RequestFactory
 from django.utils.translation import ugettext as _
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
 from django.views.generic.base import View
 from eventtracking import tracker as track
 from search.views import _process_pagination_values
@@ -20,8 +22,14 @@ import six
 from common.djangoapps.util.json_request import JsonResponse
 
 # Internal project dependencies
+from . import metrics, profiling
 from .api import *
+from .card_cache import get_course_card_fragments
+from .discovery_cache import coalesced_discovery_multi_search, coalesced_discovery_search
+from .results import DiscoveryJsonResponse, get_discovery_fields
+from .helpers import CATALOG_EXPORT_FORMATS, add_enrollment_status, get_catalog_changes, get_featured_courses, iter_catalog_export
 from .models import MainCourseClassification, MainCourseClassificationTemplate
+from .suggest import get_suggestions
 
 logger = logging.getLogger(__name__)
    
@@ -29,6 +37,8 @@ class CourseClassificationView(View):
     """
         Page view for institutions (MainCourseClassification)
     """
+    @metrics.track_endpoint('institution')
+    @profiling.profile_endpoint('institution')
     def get(self, request, org_id):
         lang_options = ['en', 'es_419']
         try:
@@ -70,7 +80,8 @@ class CourseClassificationView(View):
                 'institution_name': classification.name,
                 'institution_banner': classification.banner.url,
                 'institution_html': template.template,
-                'courses': courses
+                'courses': courses,
+                'course_cards': get_course_card_fragments(courses)
             }
             return render(request, 'course_classification/institution.html', context)
         except Exception as e:
@@ -78,6 +89,8 @@ class CourseClassificationView(View):
             return HttpResponseRedirect('/')
 
 @require_POST
+@metrics.track_endpoint('discovery')
+@profiling.profile_endpoint('discovery')
 def course_discovery_eol(request):
     """
     Search for courses
@@ -100,6 +113,11 @@ def course_discovery_eol(request):
         "search_string" (optional) - text with which to search for courses
         "page_size" (optional)- how many results to return per page (defaults to 20, with maximum cutoff at 100)
         "page_index" (optional) - for which page (zero-indexed) to include results (defaults to 0)
+        "cursor" (optional) - use cursor pagination instead of page_index, empty for the first page or
+            the "next_cursor" value of the previous response
+        "fields" (optional) - fields of each result separated by commas (e.g. "id,content.display_name,extra_data.price")
+            or a preset: "card" with the fields of the course cards, "full" with all the fields (default)
+        "enrollment_status" (optional) - true to include "is_enrolled" of the user in each result
     """
     results = {
         "error": _("Nothing to search")
@@ -110,12 +128,19 @@ def course_discovery_eol(request):
     order_by = request.POST.get("order_by", "")
     year = request.POST.get("year", "")
     state = request.POST.get("state", "")
-    cc = request.POST.get("classification", "")
-    category = request.POST.get("category", "")
+    # Lists of ids as repeated parameters or separated by commas
+    cc = ",".join(request.POST.getlist("classification"))
+    category = ",".join(request.POST.getlist("category"))
+    classification_match = request.POST.get("classification_match", "any")
+    category_match = request.POST.get("category_match", "any")
     featured = bool(request.POST.get("featured", False))
+    cursor = request.POST.get("cursor", None)
+    facets = request.POST.get("facets", "").lower() in ("1", "true")
+    enrollment_status = request.POST.get("enrollment_status", "").lower() in ("1", "true")
 
     try:
         size, from_, page = _process_pagination_values(request)
+        fields = get_discovery_fields(request.POST.get("fields", ""))
 
         # Analytics - log search request
         track.emit(
@@ -127,7 +152,7 @@ def course_discovery_eol(request):
             }
         )
 
-        results = course_discovery_search_eol(
+        results = coalesced_discovery_search(
             search_term=search_term,
             size=size,
             from_=from_,
@@ -136,8 +161,17 @@ def course_discovery_eol(request):
             state=state,
             classification=cc,
             category=category,
-            featured= featured
+            featured= featured,
+            cursor=cursor,
+            fields=fields,
+            facets=facets,
+            classification_match=classification_match,
+            category_match=category_match
         )
+        # The enrollments of the user are added to a copy of the shared results
+        if enrollment_status:
+            with metrics.stage_timer('discovery', 'enrollment'):
+                results = add_enrollment_status([results], request.user)[0]
 
         # Analytics - log search results before sending to browser
         track.emit(
@@ -175,4 +209,197 @@ def course_discovery_eol(request):
             err
         )
 
-    return JsonResponse(results, status=status_code)
+    return DiscoveryJsonResponse(results, status=status_code)
+
+MULTI_SEARCH_PARAMS = (
+    "search_string", "page_size", "page_index", "order_by", "year", "state", "classification", "category",
+    "featured", "cursor", "fields", "facets", "classification_match", "category_match"
+)
+
+def _get_multi_search_query(params):
+    """
+    Return the arguments of course_discovery_search_eol of a query of the multi search, with the names of the
+    POST params of course_discovery_eol
+    """
+    if not isinstance(params, dict) or set(params) - set(MULTI_SEARCH_PARAMS):
+        raise ValueError(_("Invalid query, the params are: {}").format(", ".join(MULTI_SEARCH_PARAMS)))
+    # The same limits of the POST params of course_discovery_eol (search.views._process_pagination_values)
+    size = int(params.get("page_size", 20))
+    max_page_size = getattr(settings, "SEARCH_MAX_PAGE_SIZE", 100)
+    if not 0 < size <= max_page_size:
+        raise ValueError(_('Invalid page size of {page_size}').format(page_size=size))
+    page = int(params.get("page_index", 0))
+    if page < 0:
+        raise ValueError(_('Invalid page index of {page_index}').format(page_index=page))
+    fields = params.get("fields", "")
+    return {
+        "search_term": params.get("search_string", None),
+        "size": size,
+        "from_": size * page,
+        "order_by": params.get("order_by", ""),
+        "year": str(params.get("year", "")),
+        "state": params.get("state", ""),
+        "classification": params.get("classification", ""),
+        "category": params.get("category", ""),
+        "featured": bool(params.get("featured", False)),
+        "cursor": params.get("cursor", None),
+        "fields": get_discovery_fields(",".join(fields) if isinstance(fields, list) else fields),
+        "facets": bool(params.get("facets", False)),
+        "classification_match": params.get("classification_match", "any"),
+        "category_match": params.get("category_match", "any"),
+    }
+
+@require_POST
+@metrics.track_endpoint('multi_search')
+def course_discovery_multi_search(request):
+    """
+    Return the results of several discovery searches in one request, in the order of the queries, shared with the
+    identical discovery searches, see api.course_discovery_multi_search_eol
+
+    JSON body:
+        {"queries": [{"featured": true, "page_size": 8}, {"state": "active", "fields": "card"}, ...], "enrollment_status": true}
+        each query has the POST params of course_discovery_eol, with enrollment_status the results of all the
+        queries include "is_enrolled" of the user (one query for all of them)
+    Response:
+        {"responses": [{"results": [...], "total": 8, ...}, {"error": "..."}, ...]}
+    """
+    try:
+        body = json.loads(request.body.decode("utf-8"))
+        queries = body.get("queries")
+        if not isinstance(queries, list) or not queries:
+            raise ValueError(_("Nothing to search"))
+        max_queries = getattr(settings, "COURSE_CLASSIFICATION_MULTI_SEARCH_MAX_QUERIES", 10)
+        if len(queries) > max_queries:
+            raise ValueError(_("The maximum number of queries is {}").format(max_queries))
+        queries = [_get_multi_search_query(x) for x in queries]
+    except (AttributeError, TypeError, ValueError) as invalid_err:
+        return JsonResponse({"error": six.text_type(invalid_err)}, status=400)
+    responses = coalesced_discovery_multi_search(queries)
+    if body.get("enrollment_status", False):
+        with metrics.stage_timer('multi_search', 'enrollment'):
+            responses = add_enrollment_status(responses, request.user)
+    return DiscoveryJsonResponse({"responses": responses})
+
+@require_GET
+def course_catalog_export(request):
+    """
+    Stream all courses visible in the catalog with their classification, categories and price
+
+    Only staff users can export the catalog.
+
+    GET Params:
+        "export_format" (optional) - jsonl or csv (defaults to jsonl)
+    """
+    if not request.user.is_staff:
+        return JsonResponse({"error": _("You do not have permission to export the catalog")}, status=403)
+    export_format = request.GET.get("export_format", "jsonl")
+    if export_format not in CATALOG_EXPORT_FORMATS:
+        return JsonResponse({"error": _("Invalid export format")}, status=400)
+    chunk_size = getattr(settings, "COURSE_CLASSIFICATION_EXPORT_CHUNK_SIZE", 500)
+    content_type = "text/csv" if export_format == "csv" else "application/x-ndjson"
+    response = StreamingHttpResponse(iter_catalog_export(export_format, chunk_size), content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="course_catalog.{}"'.format(export_format)
+    return response
+
+@require_GET
+def course_catalog_changes(request):
+    """
+    Return the catalog changes since a token, see helpers.get_catalog_changes
+
+    Only staff users can read the catalog changes.
+
+    GET Params:
+        "since" (optional) - "next_since" value of the previous response or ISO timestamp,
+            without since only the current token is returned. With "resync" true in the response since is older
+            than the kept change log and the whole catalog must be read again
+    """
+    if not request.user.is_staff:
+        return JsonResponse({"error": _("You do not have permission to read the catalog changes")}, status=403)
+    limit = getattr(settings, "COURSE_CLASSIFICATION_CHANGES_PAGE_SIZE", 1000)
+    try:
+        results = get_catalog_changes(request.GET.get("since", None), limit)
+    except ValueError as invalid_err:
+        return JsonResponse({"error": six.text_type(invalid_err)}, status=400)
+    return JsonResponse(results)
+
+@require_GET
+def course_featured_courses(request):
+    """
+    Return the featured courses visible in the catalog
+
+    Returns:
+        http json response with the following fields
+            "total" - how many featured courses were found
+            "results" - json array of course cards, with the same fields of course_discovery_eol results
+    """
+    courses = get_featured_courses()
+    return DiscoveryJsonResponse({"total": len(courses), "results": courses})
+
+@require_GET
+@metrics.track_endpoint('homepage')
+def course_homepage_data(request):
+    """
+    Return all the discovery data of the homepage in one response, see api.get_homepage_discovery_data
+
+    The response has an ETag with the data version, if it match the If-None-Match header the response is 304
+    without building the data
+    """
+    etag = '"{}"'.format(get_homepage_version())
+    if request.META.get('HTTP_IF_NONE_MATCH', None) == etag:
+        response = HttpResponseNotModified()
+    else:
+        data = get_homepage_discovery_data()
+        etag = '"{}"'.format(data['version'])
+        response = DiscoveryJsonResponse(data)
+    response['ETag'] = etag
+    return response
+
+@require_POST
+def course_cards(request):
+    """
+    Return the course cards of a list of course ids, see api.get_courses_data
+
+    POST Params:
+        "course_ids" (required) - course ids, repeated or separated by commas
+    """
+    course_ids = []
+    for value in request.POST.getlist("course_ids"):
+        course_ids.extend(x.strip() for x in value.split(",") if x.strip())
+    if not course_ids:
+        return JsonResponse({"error": _("Nothing to search")}, status=400)
+    try:
+        results = get_courses_data(course_ids)
+    except ValueError as invalid_err:
+        return JsonResponse({"error": six.text_type(invalid_err)}, status=400)
+    return DiscoveryJsonResponse(results)
+
+@require_GET
+def course_discovery_suggest(request):
+    """
+    Return suggestions of courses, main classifications and categories for the search box
+
+    GET Params:
+        "q" (required) - text typed in the search box
+        "limit" (optional) - how many suggestions to return (defaults to 8, with maximum cutoff at 20)
+    """
+    try:
+        limit = max(min(int(request.GET.get("limit", 8)), 20), 1)
+    except ValueError:
+        return JsonResponse({"error": _("Invalid limit")}, status=400)
+    return JsonResponse({"results": get_suggestions(request.GET.get("q", ""), limit)})
+
+@require_GET
+def course_classification_metrics(request):
+    """
+    Return the metrics of the course discovery in the Prometheus text format, see metrics.py
+
+    Only staff users or requests with the "Authorization: Bearer <COURSE_CLASSIFICATION_METRICS_TOKEN>" header
+    can read the metrics.
+    """
+    token = getattr(settings, "COURSE_CLASSIFICATION_METRICS_TOKEN", None)
+    has_token = bool(token) and hmac.compare_digest(
+        request.META.get("HTTP_AUTHORIZATION", "").encode('utf-8'), "Bearer {}".format(token).encode('utf-8')
+    )
+    if not has_token and not request.user.is_staff:
+        return JsonResponse({"error": _("You do not have permission to read the metrics")}, status=403)
+    return HttpResponse(metrics.registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -8,6 +8,10 @@ setuptools.setup(
     description=".",
     url="https://eol.uchile.cl",
     packages=setuptools.find_packages(),
+    extras_require={
+        # Faster JSON responses of the course discovery, see course_classification/results.py
+        "orjson": ["orjson"],
+    },
     classifiers=[
         "Programming Language :: Python :: 2",
         "License :: OSI Approved :: MIT License",